@@ -0,0 +1,125 @@
+"""Stato conto + posizioni aperte condiviso all'interno di un ciclo (con numero di versione)"""
+import copy
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class AccountState:
+    """
+    Snapshot coerente di saldo e posizioni, scaricato dal broker una volta sola e
+    poi aggiornato localmente con le conferme dei deal (apertura / chiusura).
+
+    Ogni modifica incrementa `version`. Si torna al broker solo dopo invalidate()
+    (es. a inizio ciclo o quando una conferma non arriva), così nello stesso ciclo
+    stato account, sizing dell'ordine e sync del DB usano gli stessi dati senza
+    richiamare /accounts e /positions ogni volta.
+    """
+
+    def __init__(self, fetch_account: Callable[[], Dict[str, Any]],
+                 fetch_positions: Callable[[], List[Dict[str, Any]]]):
+        self._fetch_account = fetch_account
+        self._fetch_positions = fetch_positions
+        self._lock = threading.RLock()
+        self.version = 0
+        self.fetched_at: Optional[float] = None
+        self._account: Dict[str, Any] = {}
+        self._positions: List[Dict[str, Any]] = []
+        self._valid = False
+
+    def invalidate(self):
+        with self._lock:
+            self._valid = False
+
+    def refresh(self) -> Tuple[int, Dict[str, Any], List[Dict[str, Any]]]:
+        """Scarica saldo e posizioni dal broker (sempre)"""
+        with self._lock:
+            account = self._fetch_account()
+            positions = self._fetch_positions()
+            self._account = account
+            self._positions = positions
+            # Un fetch fallito (dict/lista vuoti) non rende lo stato valido: verrà ritentato
+            self._valid = bool(account)
+            self.fetched_at = time.time()
+            self.version += 1
+            return self._snapshot()
+
+    def get(self) -> Tuple[int, Dict[str, Any], List[Dict[str, Any]]]:
+        """(version, account, positions): copie, dal broker solo se lo stato non è valido"""
+        with self._lock:
+            if not self._valid:
+                return self.refresh()
+            return self._snapshot()
+
+    def account(self) -> Dict[str, Any]:
+        return self.get()[1]
+
+    def positions(self) -> List[Dict[str, Any]]:
+        return self.get()[2]
+
+    def _snapshot(self):
+        return self.version, copy.deepcopy(self._account), copy.deepcopy(self._positions)
+
+    # ==========================================================================
+    #                       AGGIORNAMENTI LOCALI
+    # ==========================================================================
+
+    def apply_confirmation(self, confirmation: Dict[str, Any]) -> bool:
+        """
+        Applica l'esito di GET /confirms/{dealReference}: aggiunge la posizione aperta
+        o rimuove quelle chiuse, aggiornando il saldo col profitto realizzato se presente.
+        Restituisce False (e invalida lo stato) se la conferma non è interpretabile.
+        """
+        if confirmation.get("dealStatus") == "REJECTED":
+            return True  # deal rifiutato: conto e posizioni invariati
+        if confirmation.get("dealStatus") != "ACCEPTED":
+            self.invalidate()
+            return False
+
+        affected = confirmation.get("affectedDeals") or []
+        opened = [d.get("dealId") for d in affected if d.get("status") == "OPENED"]
+        closed = [d.get("dealId") for d in affected if d.get("status") in ("FULLY_CLOSED", "DELETED")]
+        if not affected and confirmation.get("status") == "OPEN":
+            opened = [confirmation.get("dealId")]
+        if not affected and confirmation.get("status") in ("CLOSED", "DELETED"):
+            closed = [confirmation.get("dealId")]
+
+        with self._lock:
+            partial = bool(affected) and len(opened) + len(closed) < len(affected)
+            if not self._valid or not (opened or closed) or partial:
+                # Stato non ancora scaricato o modifica parziale: meglio rileggere dal broker
+                self._valid = False
+                return False
+
+            for deal_id in opened:
+                if deal_id and not any(p.get("dealId") == deal_id for p in self._positions):
+                    self._positions.append(position_from_confirmation(deal_id, confirmation))
+            if closed:
+                self._positions = [p for p in self._positions if p.get("dealId") not in closed]
+                # Il P&L realizzato passa nel saldo (l'equity lo includeva già come non realizzato)
+                profit = confirmation.get("profit")
+                if profit is not None and "balance" in self._account:
+                    self._account["balance"] = (self._account["balance"] or 0) + profit
+            self.version += 1
+            return True
+
+
+def position_from_confirmation(deal_id: str, confirmation: Dict[str, Any]) -> Dict[str, Any]:
+    """Posizione nel formato di parse_positions a partire da una conferma di apertura"""
+    return {
+        "dealId": deal_id,
+        "dealReference": confirmation.get("dealReference"),
+        "symbol": confirmation.get("epic"),
+        "direction": confirmation.get("direction"),
+        "size": confirmation.get("size"),
+        "entry_price": confirmation.get("level"),
+        "mark_price": confirmation.get("level"),
+        "stopLevel": confirmation.get("stopLevel"),
+        "profitLevel": confirmation.get("profitLevel"),
+        "trailingStop": confirmation.get("trailingStop"),
+        "guaranteedStop": confirmation.get("guaranteedStop"),
+        "pnl": 0,
+        "created_at": confirmation.get("date"),
+        "leverage": None,
+        "currency": None,
+    }
@@ -0,0 +1,672 @@
+"""
+Versione asyncio di CapitalTrader.
+
+Espone gli stessi metodi (fetch_candles, get_open_positions, execute_order,
+close_position, update_position, execute_signal, ...) con gli stessi formati di
+ritorno, ma ogni chiamata è una coroutine: più richieste al broker possono
+partire insieme (es. candele di N ticker con asyncio.gather) invece che in serie.
+
+Uso:
+    async with await AsyncCapitalTrader.create(api_key, password, identifier) as bot:
+        candles = await bot.fetch_candles_many(["BTCUSD", "ETHUSD"], "MINUTE_15", 200)
+"""
+import asyncio
+import json
+import os
+import random
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+
+import timing
+from candle_block import CandleBlock
+from capital_trader import (
+    CONFIRM_DEADLINE_SECONDS,
+    CONFIRM_FIRST_DELAY,
+    CONFIRM_MAX_INTERVAL,
+    ConfirmationWaiter,
+    DEFAULT_SESSION_CACHE_PATH,
+    DEMO_BASE_URL,
+    HTTP_POOL_SIZE,
+    LIVE_BASE_URL,
+    MAX_EPICS_PER_QUOTE_REQUEST,
+    MAX_GET_RETRIES,
+    RATE_LIMIT_WAIT_RECORD_SECONDS,
+    REQUEST_TIMEOUTS,
+    RETRY_BASE_DELAY,
+    RETRYABLE_STATUS,
+    MarketCache,
+    build_order_payload,
+    build_prices_params,
+    build_update_payload,
+    choose_account,
+    clear_session_cache,
+    compute_order_size,
+    confirmed_deal_id,
+    format_account_status,
+    is_deal_confirmed,
+    map_symbol_to_epic,
+    parse_account_summary,
+    parse_candles,
+    parse_positions,
+    parse_quotes,
+    read_session_cache,
+    retry_after_seconds,
+    snapshots_from_positions,
+    write_session_cache,
+)
+from rate_limiter import shared_limiter
+
+class AsyncCapitalTrader:
+    """
+    Client asyncio per Capital.com con la stessa interfaccia di CapitalTrader.
+
+    - Re-autenticazione su 401 gestita internamente e "single-flight": se N richieste
+      concorrenti trovano la sessione scaduta, parte un solo login
+    - Rate limit condiviso con CapitalTrader (stesso limiter per API key)
+    - Sessione salvata/riusata dallo stesso file di CapitalTrader
+    """
+
+    def __init__(self, api_key: str, password: str, identifier: str, demo_mode: bool = True, account_id: str = None,
+                 session_cache_path: Optional[str] = DEFAULT_SESSION_CACHE_PATH, base_url: Optional[str] = None):
+        self.api_key = api_key
+        self.password = password
+        self.identifier = identifier
+        self.demo_mode = demo_mode
+        self.account_id = account_id
+        base_url = base_url or os.getenv("CAPITAL_BASE_URL")
+        self.base_url = base_url.rstrip("/") if base_url else (DEMO_BASE_URL if demo_mode else LIVE_BASE_URL)
+        self.session_cache_path = session_cache_path or None
+
+        self.rate_limiter = shared_limiter(api_key)
+        self.market_cache = MarketCache()
+        self.quote_epics: List[str] = []
+        self.confirmations = ConfirmationWaiter()
+        self.cst = None
+        self.x_security_token = None
+        self.active_account_id = None
+        self.active_account_name = None
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._auth_lock = asyncio.Lock()
+        self._auth_generation = 0
+
+    @classmethod
+    async def create(cls, *args, **kwargs) -> "AsyncCapitalTrader":
+        """Crea il trader ed esegue login + selezione conto (equivalente di CapitalTrader(...))"""
+        trader = cls(*args, **kwargs)
+        await trader.connect()
+        return trader
+
+    async def connect(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=HTTP_POOL_SIZE))
+        if not await self._restore_cached_session():
+            await self._authenticate()
+            await self._select_account()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self) -> "AsyncCapitalTrader":
+        if self._session is None:
+            await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    # ==========================================================================
+    #                           HTTP / AUTH
+    # ==========================================================================
+
+    def _headers(self) -> Dict[str, str]:
+        return {
+            "X-CAP-API-KEY": self.api_key,
+            "CST": self.cst or "",
+            "X-SECURITY-TOKEN": self.x_security_token or "",
+            "Content-Type": "application/json"
+        }
+
+    async def _send(self, lane: str, method: str, path: str, headers: Dict[str, str],
+                    **kwargs) -> Tuple[int, Any, str]:
+        """Singola richiesta nel rispetto del rate limit. Restituisce (status, headers, body)"""
+        connect_timeout, read_timeout = REQUEST_TIMEOUTS.get(lane, REQUEST_TIMEOUTS["account"])
+        kwargs.setdefault("timeout", aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout))
+        t0 = time.monotonic()
+        await self.rate_limiter.acquire_async(lane)
+        t1 = time.monotonic()
+        if t1 - t0 >= RATE_LIMIT_WAIT_RECORD_SECONDS:
+            timing.record(f"rate_limit:{lane}", t0, t1)
+        async with self._session.request(method, f"{self.base_url}{path}", headers=headers, **kwargs) as resp:
+            text = await resp.text()
+            if resp.status == 429:
+                self.rate_limiter.backoff(retry_after_seconds(resp.headers) or 1.0)
+            return resp.status, resp.headers, text
+
+    async def _request(self, lane: str, method: str, path: str, retries: Optional[int] = None,
+                       **kwargs) -> Tuple[int, Dict[str, Any], str]:
+        """
+        Richiesta autenticata, stessa politica di CapitalTrader._request. Restituisce (status, json, body):
+        - retry con backoff e jitter su errori di rete / 5xx / 429, solo per GET
+        - su 401 un solo re-login (condiviso tra le coroutine) e un nuovo tentativo
+        """
+        if retries is None:
+            retries = MAX_GET_RETRIES if method == "GET" else 0
+        attempt = 0
+        reauthed = False
+        while True:
+            generation = self._auth_generation
+            try:
+                status, headers, text = await self._send(lane, method, path, self._headers(), **kwargs)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt >= retries:
+                    raise
+                attempt += 1
+                await self._retry_sleep(attempt, type(e).__name__, method, path)
+                continue
+
+            if status == 401 and not reauthed:
+                reauthed = True
+                await self._reauthenticate(generation)
+                continue
+            if status in RETRYABLE_STATUS and attempt < retries:
+                attempt += 1
+                await self._retry_sleep(attempt, f"HTTP {status}", method, path, retry_after_seconds(headers))
+                continue
+            break
+        try:
+            data = json.loads(text) if text else {}
+        except ValueError:
+            data = {}
+        return status, data, text
+
+    @staticmethod
+    async def _retry_sleep(attempt: int, reason: str, method: str, path: str, retry_after: Optional[float] = None):
+        delay = RETRY_BASE_DELAY * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+        if retry_after:
+            delay = max(delay, retry_after)
+        print(f"🔁 {method} {path}: {reason}, nuovo tentativo {attempt} tra {delay:.2f}s")
+        await asyncio.sleep(delay)
+
+    async def _reauthenticate(self, seen_generation: int):
+        """Re-login single-flight: chi arriva dopo un login già fatto riusa i nuovi token"""
+        async with self._auth_lock:
+            if self._auth_generation != seen_generation:
+                return
+            print("🔄 Session expired, re-authenticating...")
+            await self._authenticate()
+            await self._select_account()
+
+    async def _authenticate(self, max_retries: int = 5):
+        """Authenticate with Capital.com API with retry on rate limit"""
+        headers = {"X-CAP-API-KEY": self.api_key}
+        payload = {
+            "identifier": self.identifier,
+            "password": self.password,
+            "encryptedPassword": False
+        }
+        for attempt in range(max_retries):
+            with timing.stage("auth"):
+                status, resp_headers, text = await self._send("session", "POST", "/api/v1/session",
+                                                              headers, json=payload)
+            if status == 200:
+                self.cst = resp_headers.get("CST")
+                self.x_security_token = resp_headers.get("X-SECURITY-TOKEN")
+                if not self.cst or not self.x_security_token:
+                    raise ValueError("Authentication failed: Missing tokens in response headers")
+                self._auth_generation += 1
+                print("✅ Capital.com Authenticated Successfully")
+                self._save_session_cache()
+                return
+            if status == 429:
+                wait_time = (2 ** attempt) * 10  # 10s, 20s, 40s, 80s, 160s
+                print(f"⚠️ Rate limited (429). Waiting {wait_time}s before retry {attempt + 1}/{max_retries}...")
+                await asyncio.sleep(wait_time)
+                continue
+            raise Exception(f"Auth failed with status {status}: {text}")
+
+        raise Exception(f"Authentication failed after {max_retries} retries due to rate limiting")
+
+    async def _select_account(self):
+        """Seleziona il conto corretto (specificato o preferito)"""
+        try:
+            status, data, text = await self._send_authenticated_once("account", "GET", "/api/v1/accounts")
+            if status != 200:
+                print(f"⚠️ Errore selezione conto: {status} - {text}")
+                return
+            accounts = data.get("accounts", [])
+            if not accounts:
+                print("⚠️ Nessun conto trovato")
+                return
+            if self.account_id and not any(a.get("accountId") == self.account_id for a in accounts):
+                print(f"⚠️ Account ID {self.account_id} non trovato, uso il preferito")
+            await self._switch_to_account(choose_account(accounts, self.account_id))
+        except Exception as e:
+            print(f"⚠️ Errore selezione conto: {e}")
+
+    async def _switch_to_account(self, account: Dict):
+        """Switch al conto specificato"""
+        account_id = account.get("accountId")
+        account_name = account.get("accountName", "Unknown")
+        status, resp_headers, text = await self._send("session", "PUT", "/api/v1/session", self._headers(),
+                                                      json={"accountId": account_id})
+        if status == 200:
+            if "CST" in resp_headers:
+                self.cst = resp_headers["CST"]
+            if "X-SECURITY-TOKEN" in resp_headers:
+                self.x_security_token = resp_headers["X-SECURITY-TOKEN"]
+        elif not (status == 400 and "not-different" in text):
+            print(f"⚠️ Switch account fallito: {status} - {text}")
+            return
+        self.active_account_id = account_id
+        self.active_account_name = account_name
+        print(f"✅ Conto attivo: {account_name}")
+        self._save_session_cache()
+
+    async def _send_authenticated_once(self, lane: str, method: str, path: str, **kwargs):
+        """Richiesta autenticata senza re-login (usata dentro il re-login stesso)"""
+        status, _, text = await self._send(lane, method, path, self._headers(), **kwargs)
+        try:
+            data = json.loads(text) if text else {}
+        except ValueError:
+            data = {}
+        return status, data, text
+
+    def _save_session_cache(self):
+        if not self.session_cache_path or not self.cst or not self.x_security_token:
+            return
+        try:
+            write_session_cache(self.session_cache_path, self.base_url, self.identifier, self.cst,
+                                self.x_security_token, self.active_account_id, self.active_account_name)
+        except OSError as e:
+            print(f"⚠️ Impossibile salvare la sessione su {self.session_cache_path}: {e}")
+
+    async def _restore_cached_session(self) -> bool:
+        data = read_session_cache(self.session_cache_path, self.base_url, self.identifier)
+        if data is None:
+            return False
+        self.cst = data.get("cst")
+        self.x_security_token = data.get("x_security_token")
+        try:
+            status, _, _ = await self._send("account", "GET", "/api/v1/ping", self._headers())
+        except Exception as e:
+            print(f"⚠️ Validazione sessione salvata fallita: {e}")
+            status = None
+        if status != 200:
+            print("🔄 Sessione salvata non più valida, nuovo login...")
+            self.cst = None
+            self.x_security_token = None
+            clear_session_cache(self.session_cache_path)
+            return False
+
+        self.active_account_id = data.get("active_account_id")
+        self.active_account_name = data.get("active_account_name")
+        print(f"✅ Sessione Capital.com riusata da {self.session_cache_path}")
+        if self.account_id and self.account_id != self.active_account_id:
+            await self._select_account()
+        return True
+
+    async def ping(self) -> bool:
+        """GET /api/v1/ping (keepalive); ri-autentica se la sessione è scaduta"""
+        try:
+            status, _, _ = await self._request("account", "GET", "/api/v1/ping", retries=0)
+            return status == 200
+        except Exception as e:
+            print(f"⚠️ Keepalive ping fallito: {e}")
+            return False
+
+    # ==========================================================================
+    #                           ACCOUNT / POSITIONS
+    # ==========================================================================
+
+    async def get_account_status(self) -> Dict[str, Any]:
+        """Get account balance and equity information for the active account"""
+        try:
+            with timing.stage("broker:accounts"):
+                status, data, text = await self._request("account", "GET", "/api/v1/accounts")
+            if status != 200:
+                raise Exception(f"{status} - {text}")
+            return parse_account_summary(choose_account(data.get("accounts", []), self.active_account_id))
+        except Exception as e:
+            print(f"❌ Error getting account status: {e}")
+            return {}
+
+    async def get_open_positions(self) -> List[Dict[str, Any]]:
+        """Get all open positions"""
+        try:
+            with timing.stage("broker:positions"):
+                status, data, text = await self._request("account", "GET", "/api/v1/positions")
+            if status != 200:
+                raise Exception(f"{status} - {text}")
+            for epic, snapshot in snapshots_from_positions(data).items():
+                self.market_cache.store_snapshot(epic, snapshot)
+            return parse_positions(data)
+        except Exception as e:
+            print(f"❌ Error getting open positions: {e}")
+            return []
+
+    async def get_account_status_formatted(self) -> Dict[str, Any]:
+        """Stato account nel formato di CapitalTrader.get_account_status_formatted (saldo e posizioni in parallelo)"""
+        account, positions = await asyncio.gather(self.get_account_status(), self.get_open_positions())
+        return format_account_status(account, positions)
+
+    # ==========================================================================
+    #                           MARKET DATA
+    # ==========================================================================
+
+    async def fetch_candles(self, epic: str, resolution: str = "MINUTE_15", limit: int = 100,
+                            from_date: Optional[str] = None, to_date: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Fetch historical candles for technical analysis.
+        from_date / to_date (UTC, "YYYY-MM-DDTHH:MM:SS") limitano la finestra, es. per
+        scaricare solo le barre successive all'ultima già salvata.
+        """
+        data = await self._get_prices(epic, build_prices_params(resolution, limit, from_date, to_date))
+        return parse_candles(data) if data is not None else []
+
+    async def fetch_candles_columnar(self, epic: str, resolution: str = "MINUTE_15", limit: int = 100,
+                                     from_date: Optional[str] = None, to_date: Optional[str] = None) -> CandleBlock:
+        """Come fetch_candles, ma decodificate direttamente in array (vedi candle_block); vuoto in caso di errore"""
+        data = await self._get_prices(epic, build_prices_params(resolution, limit, from_date, to_date))
+        return CandleBlock.from_prices(data) if data is not None else CandleBlock.empty()
+
+    async def _get_prices(self, epic: str, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        try:
+            with timing.stage(f"candles:{epic}:{params['resolution']}"):
+                status, data, text = await self._request("market_data", "GET", f"/api/v1/prices/{epic}",
+                                                         params=params)
+            if status != 200:
+                raise Exception(f"{status} - {text}")
+            return data
+        except Exception as e:
+            print(f"❌ Error fetching candles for {epic}: {e}")
+            return None
+
+    async def fetch_candles_many(self, epics: List[str], resolution: str = "MINUTE_15",
+                                 limit: int = 100) -> Dict[str, List[Dict[str, Any]]]:
+        """Candele per più epic in parallelo (entro il rate limit): {epic: candles}"""
+        results = await asyncio.gather(*(self.fetch_candles(epic, resolution, limit) for epic in epics))
+        return dict(zip(epics, results))
+
+    async def get_deal_confirmation(self, deal_reference: str) -> Dict[str, Any]:
+        """Get deal confirmation details including dealId from dealReference"""
+        try:
+            status, data, text = await self._request("confirm", "GET", f"/api/v1/confirms/{deal_reference}")
+            if status != 200:
+                return {"status": "error", "message": text}
+            return {"status": "ok", "data": data}
+        except Exception as e:
+            return {"status": "error", "error": str(e)}
+
+    async def wait_for_confirmation(self, deal_reference: str,
+                                    deadline: float = CONFIRM_DEADLINE_SECONDS) -> Dict[str, Any]:
+        """Come CapitalTrader.wait_for_confirmation; una notify viene vista al risveglio successivo"""
+        self.confirmations.register(deal_reference)
+        loop = asyncio.get_running_loop()
+        end = loop.time() + deadline
+        delay = CONFIRM_FIRST_DELAY
+        try:
+            while True:
+                notified = self.confirmations.result(deal_reference)
+                if notified is not None:
+                    return {"status": "ok", "data": notified, "source": "notify"}
+                confirm = await self.get_deal_confirmation(deal_reference)
+                if is_deal_confirmed(confirm):
+                    return confirm
+                remaining = end - loop.time()
+                if remaining <= 0:
+                    return {"status": "timeout", "message": f"Nessuna conferma per {deal_reference} entro {deadline}s"}
+                await asyncio.sleep(min(delay, remaining))
+                delay = min(delay * 2, CONFIRM_MAX_INTERVAL)
+        finally:
+            self.confirmations.release(deal_reference)
+
+    def notify_confirmation(self, deal_reference: str, confirmation: Dict[str, Any]):
+        self.confirmations.notify(deal_reference, confirmation)
+
+    async def get_market_info(self, epic: str, use_cache: bool = True) -> Dict[str, Any]:
+        """Get market details and dealing rules for a symbol (vedi CapitalTrader.get_market_info)"""
+        if use_cache:
+            cached = self.market_cache.get(epic)
+            if cached is not None:
+                return cached
+        try:
+            with timing.stage(f"broker:market:{epic}"):
+                status, data, _ = await self._request("market_data", "GET", f"/api/v1/markets/{epic}")
+            if status != 200:
+                return {}
+            self.market_cache.store(epic, data)
+            return data
+        except Exception as e:
+            print(f"❌ Error getting market info for {epic}: {e}")
+            return {}
+
+    async def get_dealing_rules(self, epic: str) -> Dict[str, Any]:
+        rules = self.market_cache.rules(epic)
+        if rules is None:
+            await self.get_market_info(epic, use_cache=False)
+            rules = self.market_cache.rules(epic) or {}
+        return rules
+
+    async def get_quotes(self, epics: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """Come CapitalTrader.get_quotes: una GET /markets?epics=... per blocco di 50 epic"""
+        for epic in epics or []:
+            if epic not in self.quote_epics:
+                self.quote_epics.append(epic)
+        quotes = {}
+        for i in range(0, len(self.quote_epics), MAX_EPICS_PER_QUOTE_REQUEST):
+            chunk = self.quote_epics[i:i + MAX_EPICS_PER_QUOTE_REQUEST]
+            try:
+                with timing.stage("broker:quotes"):
+                    status, data, text = await self._request("market_data", "GET", "/api/v1/markets",
+                                                             params={"epics": ",".join(chunk)})
+                if status != 200:
+                    raise Exception(f"{status} - {text}")
+            except Exception as e:
+                print(f"❌ Error getting quotes for {chunk}: {e}")
+                continue
+            for details in data.get("marketDetails", []):
+                epic = details.get("instrument", {}).get("epic")
+                if epic:
+                    self.market_cache.store(epic, details)
+            quotes.update(parse_quotes(data))
+        return quotes
+
+    async def get_price_snapshot(self, epic: str, max_age: Optional[float] = None) -> Dict[str, Any]:
+        snapshot = self.market_cache.snapshot(epic, max_age)
+        if snapshot is None:
+            await self.get_quotes([epic])
+            snapshot = self.market_cache.snapshot(epic) or {}
+        return snapshot
+
+    def invalidate_market_cache(self, epic: Optional[str] = None, rules: bool = True, snapshot: bool = True):
+        self.market_cache.invalidate(epic, rules=rules, snapshot=snapshot)
+
+    # ==========================================================================
+    #                           TRADING
+    # ==========================================================================
+
+    async def execute_order(self, epic: str, direction: str, size: float,
+                            stop_distance: float = None, profit_distance: float = None,
+                            trailing_stop: bool = False) -> Dict[str, Any]:
+        """Execute a market order on Capital.com (vedi CapitalTrader.execute_order)"""
+        payload = build_order_payload(epic, direction, size, stop_distance, profit_distance, trailing_stop)
+        try:
+            print(f"🚀 Sending {direction} order for {size} {epic} to Capital.com...")
+            with timing.stage(f"order:{epic}"):
+                status, data, text = await self._request("trading", "POST", "/api/v1/positions", json=payload)
+            if status != 200:
+                print(f"⚠️ Order failed: {text}")
+                return {"status": "error", "message": text}
+
+            deal_reference = data.get('dealReference')
+            print(f"✅ Order executed: {deal_reference}")
+
+            # Get dealId from confirmation
+            deal_id = None
+            deal_status = None
+            if deal_reference:
+                with timing.stage(f"order_confirm:{epic}"):
+                    confirm = await self.wait_for_confirmation(deal_reference)
+                if confirm.get('status') == 'ok':
+                    deal_id = confirmed_deal_id(confirm.get('data', {}))
+                    deal_status = confirm.get('data', {}).get('dealStatus')
+                    if deal_status == "REJECTED":
+                        reason = confirm['data'].get('reason')
+                        print(f"⚠️ Deal {deal_reference} rifiutato: {reason}")
+                        return {
+                            "status": "rejected",
+                            "reason": reason,
+                            "dealReference": deal_reference,
+                            "dealStatus": deal_status,
+                            "confirmation": confirm['data'],
+                            "data": data
+                        }
+                else:
+                    print(f"⚠️ {confirm.get('message', 'Conferma deal non disponibile')}")
+
+            return {
+                "status": "ok",
+                "dealReference": deal_reference,
+                "dealId": deal_id,
+                "dealStatus": deal_status,
+                "confirmation": confirm.get('data') if deal_reference and confirm.get('status') == 'ok' else None,
+                "data": data
+            }
+        except Exception as e:
+            print(f"❌ Error executing order: {e}")
+            return {"status": "error", "error": str(e)}
+
+    async def close_position(self, deal_id: str) -> Dict[str, Any]:
+        """Close an open position by dealId"""
+        try:
+            print(f"🗑️ Closing position {deal_id}...")
+            with timing.stage("close_position"):
+                status, data, text = await self._request("trading", "DELETE", f"/api/v1/positions/{deal_id}")
+            if status != 200:
+                print(f"⚠️ Close failed: {text}")
+                return {"status": "error", "message": text}
+            print(f"✅ Position closed: {data.get('dealReference')}")
+            return {"status": "ok", "dealReference": data.get("dealReference")}
+        except Exception as e:
+            print(f"❌ Error closing position: {e}")
+            return {"status": "error", "error": str(e)}
+
+    async def update_position(self, deal_id: str, stop_level: float = None, stop_distance: float = None,
+                              profit_level: float = None, profit_distance: float = None,
+                              trailing_stop: bool = None) -> Dict[str, Any]:
+        """Update stop/profit levels on an existing position"""
+        payload = build_update_payload(stop_level, stop_distance, profit_level, profit_distance, trailing_stop)
+        try:
+            status, data, text = await self._request("trading", "PUT", f"/api/v1/positions/{deal_id}", json=payload)
+            if status != 200:
+                return {"status": "error", "message": text}
+            return {"status": "ok", "dealReference": data.get("dealReference")}
+        except Exception as e:
+            return {"status": "error", "error": str(e)}
+
+    # ==========================================================================
+    #                     HELPER FOR TRADING-AGENT INTEGRATION
+    # ==========================================================================
+
+    async def execute_signal(self, order_json: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Execute a trading signal from the AI agent (vedi CapitalTrader.execute_signal).
+        Le scritture su DB (sincrone) girano in un thread per non bloccare l'event loop.
+        """
+        import db_utils
+
+        op = order_json.get("operation", "").lower()
+        symbol = order_json.get("symbol", "")
+        direction = order_json.get("direction", "").lower()
+        portion = float(order_json.get("target_portion_of_balance", 0))
+        leverage = int(order_json.get("leverage", 1))
+
+        epic = map_symbol_to_epic(symbol)
+
+        if op == "hold":
+            print(f"[AsyncCapitalTrader] HOLD — nessuna azione per {symbol}.")
+            return {"status": "hold", "message": "No action taken."}
+
+        if op == "close":
+            print(f"[AsyncCapitalTrader] Market CLOSE per {symbol}")
+            positions = await self.get_open_positions()
+            position_to_close = next((p for p in positions if p['symbol'] == epic), None)
+            if not position_to_close:
+                print(f"[AsyncCapitalTrader] ⚠️ Nessuna posizione aperta per {symbol}")
+                return {"status": "skipped", "message": "No position to close"}
+
+            result = await self.close_position(position_to_close['dealId'])
+            if result.get('status') == 'ok':
+                confirm = await self.wait_for_confirmation(result["dealReference"]) if result.get("dealReference") else {}
+                confirmation = confirm.get("data") if confirm.get("status") == "ok" else None
+                deal_status = (confirmation or {}).get("dealStatus")
+                if deal_status == "REJECTED":
+                    reason = confirmation.get("reason")
+                    print(f"[AsyncCapitalTrader] ⚠️ Chiusura {symbol} rifiutata: {reason}")
+                    return {"status": "rejected", "reason": reason,
+                            "dealReference": result.get("dealReference"), "confirmation": confirmation}
+
+                if deal_status == "ACCEPTED":
+                    print(f"[AsyncCapitalTrader] ✅ Posizione {symbol} chiusa con successo")
+                    # Prezzo e profitto effettivi della chiusura
+                    position_to_close = dict(position_to_close)
+                    position_to_close["mark_price"] = confirmation.get("level", position_to_close.get("mark_price"))
+                    position_to_close["pnl"] = confirmation.get("profit", position_to_close.get("pnl"))
+                    try:
+                        await asyncio.to_thread(
+                            db_utils.log_trade_close_from_position,
+                            position_to_close,
+                            close_reason=order_json.get("reason", "AI decision"),
+                        )
+                    except Exception as e:
+                        print(f"[AsyncCapitalTrader] ⚠️ Errore registrazione storico: {e}")
+                else:
+                    print(f"[AsyncCapitalTrader] ⚠️ Chiusura {symbol} non confermata: storico non aggiornato")
+                try:
+                    updated_positions = await self.get_open_positions()
+                    await asyncio.to_thread(db_utils.sync_real_positions, updated_positions)
+                except Exception as e:
+                    print(f"[AsyncCapitalTrader] ⚠️ Errore sync real_positions: {e}")
+            else:
+                print(f"[AsyncCapitalTrader] ⚠️ Chiusura fallita: {result}")
+            return result
+
+        if op == "open":
+            # Saldo e prezzo sono indipendenti: in parallelo (le dealing rules arrivano dalla cache)
+            account, snapshot = await asyncio.gather(self.get_account_status(), self.get_price_snapshot(epic))
+            balance = account.get("balance", 0)
+            if balance <= 0:
+                return {"status": "error", "message": "No balance available"}
+
+            current_price = snapshot.get("offer") if direction == "long" else snapshot.get("bid")
+            if not current_price:
+                return {"status": "error", "message": "Could not get current price"}
+
+            dealing_rules = (await self.get_dealing_rules(epic)).get("dealingRules", {})
+            min_size = dealing_rules.get("minDealSize", {}).get("value", 0.0001)
+            size, notional = compute_order_size(balance, portion, leverage, current_price, min_size)
+            cap_direction = "BUY" if direction == "long" else "SELL"
+
+            print(f"\n[AsyncCapitalTrader] Market {cap_direction} {size} {epic}")
+            print(f"  💰 Prezzo: ${current_price}")
+            print(f"  📊 Notional: ${notional:.2f}")
+            print(f"  🎯 Leverage: {leverage}x (via position size)")
+
+            result = await self.execute_order(epic, cap_direction, size)
+            if result.get('status') == 'ok':
+                try:
+                    updated_positions = await self.get_open_positions()
+                    await asyncio.to_thread(db_utils.sync_real_positions, updated_positions)
+                    print(f"[AsyncCapitalTrader] 🔄 real_positions sincronizzato ({len(updated_positions)} posizioni)")
+                except Exception as e:
+                    print(f"[AsyncCapitalTrader] ⚠️ Errore sync real_positions: {e}")
+            else:
+                self.invalidate_market_cache(epic)
+            return result
+
+        return {"status": "error", "message": f"Unknown operation: {op}"}
@@ -0,0 +1,167 @@
+"""
+Costruzione delle candele OHLC dalle quotazioni in streaming.
+
+BarAggregator espone lo stesso fetch_candles(epic, resolution, limit) di
+CapitalTrader (stesso formato delle candele: prezzi bid, ultima candela ancora
+in formazione), quindi può essere passato a indicators/forecaster al posto del
+trader. Lo storico viene scaricato via REST solo la prima volta o dopo un buco
+nello stream; poi ogni quotazione aggiorna le candele in memoria.
+"""
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+RESOLUTION_SECONDS = {
+    "MINUTE": 60,
+    "MINUTE_5": 5 * 60,
+    "MINUTE_15": 15 * 60,
+    "MINUTE_30": 30 * 60,
+    "HOUR": 60 * 60,
+    "HOUR_4": 4 * 60 * 60,
+    "DAY": 24 * 60 * 60,
+}
+# Nessuna quotazione per più di così = stream interrotto: serve un nuovo backfill REST
+DEFAULT_MAX_QUOTE_GAP = 120
+DEFAULT_MAX_BARS = 500
+
+
+def bar_start(ts: float, seconds: int) -> int:
+    """Inizio (epoch UTC) della barra che contiene ts"""
+    return int(ts // seconds) * seconds
+
+
+def format_bar_time(start: int) -> str:
+    """Stesso formato del timestamp delle candele REST (snapshotTimeUTC, senza fuso)"""
+    return datetime.fromtimestamp(start, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def parse_bar_time(timestamp: str) -> float:
+    """
+    Timestamp di una candela -> epoch. Le candele REST arrivano da parse_candles, che usa
+    snapshotTimeUTC: un orario senza fuso è quindi UTC, come i timestamp dello stream.
+    """
+    dt = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+class BarSeries:
+    """Candele di un epic a una risoluzione: barre chiuse + barra in formazione"""
+
+    def __init__(self, seconds: int, capacity: int):
+        self.seconds = seconds
+        self.capacity = capacity
+        self.bars: List[Dict[str, Any]] = []
+        self.current: Optional[Dict[str, Any]] = None
+        self.current_start: Optional[int] = None
+        self.last_update: Optional[float] = None
+        self.needs_backfill = True
+
+    def load(self, candles: List[Dict[str, Any]]):
+        """Sostituisce lo storico con le candele REST (timestamp UTC, l'ultima è quella in formazione)"""
+        candles = [dict(c) for c in candles if c.get("timestamp")]
+        if not candles:
+            return
+        self.current = candles[-1]
+        self.current_start = bar_start(parse_bar_time(self.current["timestamp"]), self.seconds)
+        self.bars = candles[:-1][-self.capacity:]
+        self.needs_backfill = False
+        self.last_update = time.monotonic()
+
+    def add_quote(self, price: float, ts: float):
+        """Quotazione con timestamp epoch UTC (stream): aggiorna la barra in formazione o ne apre una nuova"""
+        start = bar_start(ts, self.seconds)
+        if self.current_start is not None and start < self.current_start:
+            return  # quotazione fuori ordine
+        if self.current is None or start != self.current_start:
+            if self.current is not None:
+                if start > self.current_start + self.seconds:
+                    # Barre intere senza quotazioni: lo storico ha un buco
+                    self.needs_backfill = True
+                self.bars.append(self.current)
+                del self.bars[:-self.capacity]
+            self.current_start = start
+            self.current = {
+                "timestamp": format_bar_time(start),
+                "open": price,
+                "high": price,
+                "low": price,
+                "close": price,
+                "volume": 1,
+            }
+        else:
+            bar = self.current
+            bar["high"] = max(bar["high"], price)
+            bar["low"] = min(bar["low"], price)
+            bar["close"] = price
+            bar["volume"] = (bar.get("volume") or 0) + 1
+        self.last_update = time.monotonic()
+
+    def candles(self, limit: int) -> List[Dict[str, Any]]:
+        series = self.bars + ([self.current] if self.current is not None else [])
+        return [dict(c) for c in series[-limit:]]
+
+
+class BarAggregator:
+    """
+    Candele OHLC (bid) aggiornate dalle quotazioni del PriceBus.
+
+    Le serie vengono create al primo fetch_candles(epic, resolution) con un backfill
+    REST da `rest_client`; un nuovo backfill avviene solo se manca storico (limit
+    più grande del disponibile), se ci sono barre senza quotazioni o se lo stream
+    tace da più di max_quote_gap secondi.
+    """
+
+    def __init__(self, rest_client: Any, bus=None, max_bars: int = DEFAULT_MAX_BARS,
+                 max_quote_gap: float = DEFAULT_MAX_QUOTE_GAP):
+        self.rest_client = rest_client
+        self.max_bars = max_bars
+        self.max_quote_gap = max_quote_gap
+        self.backfills = 0
+        self._series: Dict[Tuple[str, str], BarSeries] = {}
+        self._lock = threading.Lock()
+        if bus is not None:
+            bus.add_listener(self.on_quote)
+
+    def on_quote(self, epic: str, quote: Dict[str, Any]):
+        """Listener del PriceBus: aggiorna tutte le serie dell'epic"""
+        price = quote.get("bid")
+        if price is None:
+            return
+        ts = quote.get("timestamp") or time.time()
+        with self._lock:
+            for (series_epic, _), series in self._series.items():
+                if series_epic == epic:
+                    series.add_quote(price, ts)
+
+    def _is_stale(self, series: BarSeries) -> bool:
+        """Né quotazioni né backfill recenti (es. stream fermo): meglio rileggere via REST"""
+        return (series.last_update is None
+                or time.monotonic() - series.last_update > self.max_quote_gap)
+
+    def fetch_candles(self, epic: str, resolution: str = "MINUTE_15", limit: int = 100) -> List[Dict[str, Any]]:
+        """Stessa interfaccia e formato di CapitalTrader.fetch_candles"""
+        seconds = RESOLUTION_SECONDS.get(resolution)
+        if seconds is None:
+            return self.rest_client.fetch_candles(epic, resolution, limit)
+
+        key = (epic, resolution)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = BarSeries(seconds, max(self.max_bars, limit))
+            series.capacity = max(series.capacity, limit)
+            available = len(series.bars) + (1 if series.current is not None else 0)
+            backfill = series.needs_backfill or available < limit or self._is_stale(series)
+            if not backfill:
+                return series.candles(limit)
+
+        # Backfill fuori dal lock: le quotazioni continuano ad arrivare nel frattempo
+        candles = self.rest_client.fetch_candles(epic, resolution, limit)
+        with self._lock:
+            if candles:
+                self.backfills += 1
+                series.load(candles)
+            return series.candles(limit)
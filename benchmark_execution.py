@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Benchmark della latenza decisione -> posizione confermata.
+
+Esegue CapitalTrader.execute_signal (open, hold, close) contro il server locale
+di mock_capital_server.py con latenza iniettata, raccoglie i record di timing di
+ogni esecuzione e stampa p50/p95/p99 per fase (sizing, POST ordine, conferma,
+sync posizioni, scrittura DB...).
+
+Con --pause 0 i segnali si susseguono senza sosta: le attese del rate limiter
+compaiono come fasi rate_limit:<corsia>, separate dalla latenza del broker.
+
+Il DB è quello di DATABASE_URL se impostato (connessione persistente, come in
+daemon mode); altrimenti le scritture sono sostituite da un'attesa fissa
+(--db-latency) e il report lo segnala.
+
+Con --indicators misura invece gli indicatori: costo dei kernel NumPy per 3 e per
+100 strumenti e analisi seriale contro batch sul server locale (i test controllano
+solo numero di chiamate e richieste, i tempi stanno qui).
+
+Uso:
+    python benchmark_execution.py --iterations 100 --latency 0.03 --jitter 0.01
+    python benchmark_execution.py --indicators --latency 0.2
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import time
+from collections import defaultdict
+from typing import Any, Dict, List
+
+import numpy as np
+
+import db_utils
+import indicator_kernels as kernels
+import timing
+from capital_trader import CapitalTrader
+from indicator_engine import IndicatorEngine
+from indicators import analyze_multiple_tickers
+from mock_capital_server import MockCapitalServer, MockConfig
+
+SIGNALS = {
+    "open": {"operation": "open", "symbol": "BTC", "direction": "long",
+             "target_portion_of_balance": 0.1, "leverage": 2, "reason": "benchmark"},
+    "hold": {"operation": "hold", "symbol": "BTC", "reason": "benchmark"},
+    "close": {"operation": "close", "symbol": "BTC", "reason": "benchmark"},
+}
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Percentile con interpolazione lineare (come numpy.percentile)"""
+    ordered = sorted(values)
+    if not ordered:
+        return float("nan")
+    k = (len(ordered) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def summarize(samples: Dict[str, List[float]]) -> List[Dict[str, Any]]:
+    rows = []
+    for stage, values in samples.items():
+        rows.append({
+            "stage": stage,
+            "count": len(values),
+            "p50_ms": percentile(values, 50),
+            "p95_ms": percentile(values, 95),
+            "p99_ms": percentile(values, 99),
+            "max_ms": max(values),
+        })
+    return rows
+
+
+def use_simulated_db(latency: float):
+    """Sostituisce le scritture DB usate da execute_signal con un'attesa fissa"""
+    def write(*args, **kwargs):
+        time.sleep(latency)
+        return 0
+
+    db_utils.sync_real_positions = write
+    db_utils.log_trade_close_from_position = write
+    db_utils.log_trades_close = write
+
+
+def run_signal(bot: CapitalTrader, op: str, samples: Dict[str, List[float]], verbose: bool) -> Dict[str, Any]:
+    """Un'esecuzione di execute_signal con il proprio timer; i record finiscono in samples[op:stage]"""
+    bot.invalidate_account_state()  # come all'inizio di ogni ciclo di main.py
+    timer = timing.start_cycle()
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    try:
+        with output:
+            with timing.stage("total"):
+                result = bot.execute_signal(dict(SIGNALS[op]))
+    finally:
+        timing.end_cycle()
+    for record in timer.records:
+        samples[f"{op}:{record['stage']}"].append(record["duration_ms"])
+    return result
+
+
+def benchmark_kernels(repeats: int = 20) -> Dict[int, float]:
+    """ms (mediana) di EMA/MACD/RSI/ATR in un'unica chiamata per 3 e per 100 strumenti da 200 barre"""
+    rng = np.random.default_rng(0)
+    result = {}
+    for n_rows in (3, 100):
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, (n_rows, 200)), axis=1))
+        high, low = close * 1.002, close * 0.998
+        durations = []
+        for _ in range(repeats + 1):
+            t0 = time.perf_counter()
+            kernels.ema(close, 20), kernels.macd_diff(close), kernels.rsi(close, 14), kernels.atr(high, low, close, 14)
+            durations.append((time.perf_counter() - t0) * 1000)
+        result[n_rows] = percentile(durations[1:], 50)  # il primo giro è di riscaldamento
+    return result
+
+
+def benchmark_analysis(latency: float, n_tickers: int = 12) -> Dict[str, Dict[str, float]]:
+    """analyze_multiple_tickers seriale e batch contro il server locale con latenza iniettata"""
+    prices = {f"X{i}USD": 100.0 + i for i in range(n_tickers)}
+    server = MockCapitalServer(MockConfig(latency=latency, jitter=0, max_requests_per_second=0, prices=prices))
+    server.start()
+    result = {}
+    try:
+        bot = CapitalTrader("benchmark", "benchmark", "benchmark@example.com",
+                            session_cache_path=None, base_url=server.base_url)
+        tickers = [epic[:-3] for epic in prices]
+        for mode, batch in (("serial", False), ("batch", True)):
+            server.reset_stats()
+            t0 = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                analyze_multiple_tickers(tickers, bot, engine=IndicatorEngine(), batch=batch)
+            result[mode] = {"seconds": time.perf_counter() - t0, "requests": sum(server.requests.values()),
+                            "max_in_flight": server.max_in_flight}
+    finally:
+        server.stop()
+    return result
+
+
+def run_indicator_benchmarks(args):
+    print("=" * 60)
+    print("⏱️ BENCHMARK INDICATORI (kernel NumPy e analisi batch)")
+    print("=" * 60)
+    costs = benchmark_kernels()
+    print(f"Kernel: 3 strumenti {costs[3]:.2f} ms, 100 strumenti {costs[100]:.2f} ms "
+          f"({costs[100] / costs[3]:.1f}x per {100 / 3:.0f}x strumenti)")
+    analysis = benchmark_analysis(args.latency)
+    for mode, row in analysis.items():
+        print(f"Analisi {mode:<6}: {row['seconds']:.2f}s, {row['requests']} richieste, "
+              f"max {row['max_in_flight']} in parallelo")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"config": vars(args), "kernels_ms": costs, "analysis": analysis}, f, indent=2)
+        print(f"💾 Report salvato in {args.json}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark latenza execute_signal (server locale)")
+    parser.add_argument("--iterations", type=int, default=50, help="Sequenze open/hold/close da eseguire")
+    parser.add_argument("--latency", type=float, default=0.03, help="Latenza del server per richiesta (secondi)")
+    parser.add_argument("--jitter", type=float, default=0.01, help="Variazione casuale della latenza (secondi)")
+    parser.add_argument("--confirm-delay", type=float, default=0.0, help="Ritardo delle conferme dei deal (secondi)")
+    parser.add_argument("--pause", type=float, default=0.5,
+                        help="Attesa tra due segnali (0 = carico continuo: compaiono le attese del rate limiter)")
+    parser.add_argument("--db-latency", type=float, default=0.005,
+                        help="Durata simulata di una scrittura DB se DATABASE_URL non è impostata (secondi)")
+    parser.add_argument("--json", help="Salva anche il report in questo file")
+    parser.add_argument("--verbose", action="store_true", help="Mostra l'output di execute_signal")
+    parser.add_argument("--indicators", action="store_true",
+                        help="Misura kernel degli indicatori e analisi seriale/batch invece di execute_signal")
+    args = parser.parse_args(argv)
+    if args.indicators:
+        run_indicator_benchmarks(args)
+        return
+
+    real_db = bool(os.getenv("DATABASE_URL"))
+    if real_db:
+        db_utils.enable_persistent_connection()
+    else:
+        use_simulated_db(args.db_latency)
+
+    server = MockCapitalServer(MockConfig(latency=args.latency, jitter=args.jitter,
+                                          confirm_delay=args.confirm_delay, max_requests_per_second=0))
+    server.start()
+
+    print("=" * 60)
+    print("⏱️ BENCHMARK SEGNALE -> POSIZIONE CONFERMATA")
+    print("=" * 60)
+    print(f"Server locale: {server.base_url} | latenza {args.latency * 1000:.0f}±{args.jitter * 1000:.0f} ms"
+          f" | conferme +{args.confirm_delay * 1000:.0f} ms")
+    print(f"DB: {'DATABASE_URL' if real_db else f'simulato ({args.db_latency * 1000:.0f} ms per scrittura)'}")
+
+    samples: Dict[str, List[float]] = defaultdict(list)
+    failures: Dict[str, int] = defaultdict(int)
+    try:
+        bot = CapitalTrader("benchmark", "benchmark", "benchmark@example.com",
+                            session_cache_path=None, base_url=server.base_url)
+        for i in range(args.iterations):
+            for op in ("open", "hold", "close"):
+                result = run_signal(bot, op, samples, args.verbose)
+                if result.get("status") not in ("ok", "hold"):
+                    failures[op] += 1
+                time.sleep(args.pause)
+            if (i + 1) % 10 == 0:
+                print(f"   {i + 1}/{args.iterations} sequenze completate")
+    finally:
+        server.stop()
+        if real_db:
+            db_utils.close_persistent_connection()
+
+    rows = summarize(samples)
+    print(f"\n{'fase':<36} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    print("-" * 81)
+    for row in rows:
+        print(f"{row['stage']:<36} {row['count']:>5} {row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f}"
+              f" {row['p99_ms']:>9.1f} {row['max_ms']:>9.1f}")
+    if failures:
+        print(f"\n⚠️ Esecuzioni non riuscite: {dict(failures)}")
+    print(f"\nRichieste al server: {sum(server.requests.values())} | login: {server.logins}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"config": vars(args), "real_db": real_db, "stages": rows,
+                       "failures": dict(failures), "requests": server.requests}, f, indent=2)
+        print(f"💾 Report salvato in {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Candele in formato colonnare: un array int64 di timestamp (epoch UTC, inizio barra)
+e un array float64 (5, n) con open/high/low/close/volume, una riga per campo.
+
+CandleBlock.from_prices decodifica la risposta di GET /prices/{epic} direttamente
+negli array (niente dict per candela, niente pd.to_datetime senza formato, niente
+to_numeric/fillna/sort per colonna). Gli array sono in sola lettura, quindi lo
+stesso blocco può essere condiviso tra indicatori, kernel e forecaster: tail(),
+i campi (block.close...) e to_frame() sono viste, non copie.
+
+Stesse convenzioni di fetch_candles/fetch_ohlcv: prezzi bid, valori mancanti = 0,
+timestamp UTC, barre dalla più vecchia, l'ultima ancora in formazione.
+"""
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from bar_aggregator import format_bar_time, parse_bar_time
+
+FIELDS = ("open", "high", "low", "close", "volume")
+# Campi della risposta /prices (prezzo bid) nello stesso ordine di FIELDS
+_PRICE_KEYS = ("openPrice", "highPrice", "lowPrice", "closePrice")
+
+
+def _to_float(value: Any) -> float:
+    """Come pd.to_numeric(..., errors='coerce').fillna(0)"""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if value != value else value
+
+
+def parse_timestamps(timestamps: Sequence[Optional[str]]) -> np.ndarray:
+    """snapshotTimeUTC -> epoch in secondi (int64); parsing vettoriale di NumPy per il formato ISO di Capital.com"""
+    try:
+        return np.array(timestamps, dtype="datetime64[s]").astype(np.int64)
+    except (ValueError, TypeError):
+        # Formati diversi (es. con fuso orario): stessa interpretazione di parse_bar_time
+        return np.array([int(parse_bar_time(t)) for t in timestamps], dtype=np.int64)
+
+
+class CandleBlock:
+    """Candele di una serie: timestamp (n,) int64 e ohlcv (5, n) float64, in sola lettura"""
+
+    __slots__ = ("timestamp", "ohlcv")
+
+    def __init__(self, timestamp: np.ndarray, ohlcv: np.ndarray):
+        self.timestamp = timestamp
+        self.ohlcv = ohlcv
+        self.timestamp.flags.writeable = False
+        self.ohlcv.flags.writeable = False
+
+    @classmethod
+    def empty(cls) -> "CandleBlock":
+        return cls(np.empty(0, dtype=np.int64), np.empty((len(FIELDS), 0)))
+
+    @classmethod
+    def from_prices(cls, data: Dict[str, Any]) -> "CandleBlock":
+        """Risposta di GET /prices/{epic} -> blocco (prezzi bid e snapshotTimeUTC, come parse_candles)"""
+        prices = [p for p in data.get("prices", []) if p.get("snapshotTimeUTC") or p.get("snapshotTime")]
+        n = len(prices)
+        ohlcv = np.empty((len(FIELDS), n))
+        for row, key in enumerate(_PRICE_KEYS):
+            ohlcv[row] = [_to_float((p.get(key) or {}).get("bid")) for p in prices]
+        ohlcv[4] = [_to_float(p.get("lastTradedVolume", 0)) for p in prices]
+        return cls._sorted(parse_timestamps([p.get("snapshotTimeUTC") or p["snapshotTime"] for p in prices]), ohlcv)
+
+    @classmethod
+    def from_candles(cls, candles: List[Dict[str, Any]]) -> "CandleBlock":
+        """Candele in formato fetch_candles (lista di dict) -> blocco"""
+        candles = [c for c in candles if c.get("timestamp")]
+        ohlcv = np.array([[_to_float(c.get(f)) for c in candles] for f in FIELDS]).reshape(len(FIELDS), len(candles))
+        return cls._sorted(parse_timestamps([c["timestamp"] for c in candles]), ohlcv)
+
+    @classmethod
+    def _sorted(cls, timestamp: np.ndarray, ohlcv: np.ndarray) -> "CandleBlock":
+        # Capital.com restituisce già le barre in ordine: si riordina solo se serve
+        if len(timestamp) > 1 and np.any(timestamp[1:] < timestamp[:-1]):
+            order = np.argsort(timestamp, kind="stable")
+            timestamp, ohlcv = timestamp[order], ohlcv[:, order]
+        return cls(timestamp, ohlcv)
+
+    # ==========================================================================
+    #                           ACCESSO
+    # ==========================================================================
+
+    def __len__(self) -> int:
+        return len(self.timestamp)
+
+    def __bool__(self) -> bool:
+        return len(self.timestamp) > 0
+
+    @property
+    def open(self) -> np.ndarray:
+        return self.ohlcv[0]
+
+    @property
+    def high(self) -> np.ndarray:
+        return self.ohlcv[1]
+
+    @property
+    def low(self) -> np.ndarray:
+        return self.ohlcv[2]
+
+    @property
+    def close(self) -> np.ndarray:
+        return self.ohlcv[3]
+
+    @property
+    def volume(self) -> np.ndarray:
+        return self.ohlcv[4]
+
+    def tail(self, n: int) -> "CandleBlock":
+        """Ultime n barre (vista sugli stessi array)"""
+        if n >= len(self):
+            return self
+        start = len(self) - max(n, 0)
+        return CandleBlock(self.timestamp[start:], self.ohlcv[:, start:])
+
+    def candle(self, i: int) -> Dict[str, Any]:
+        """Una barra in formato fetch_candles (es. block.candle(-1) per quella in formazione)"""
+        candle = {"timestamp": format_bar_time(int(self.timestamp[i]))}
+        candle.update({f: float(v) for f, v in zip(FIELDS, self.ohlcv[:, i])})
+        return candle
+
+    def to_candles(self) -> List[Dict[str, Any]]:
+        """Lista di dict come CapitalTrader.fetch_candles (per chi non usa ancora gli array)"""
+        return [self.candle(i) for i in range(len(self))]
+
+    def to_frame(self, tz: Optional[str] = "UTC") -> pd.DataFrame:
+        """
+        DataFrame come indicators.fetch_ohlcv: le colonne OHLCV sono una vista sul blocco
+        (solo la colonna timestamp viene creata). tz=None per timestamp senza fuso (Prophet).
+        """
+        df = pd.DataFrame(self.ohlcv.T, columns=list(FIELDS), copy=False)
+        df.insert(0, "timestamp", pd.to_datetime(self.timestamp, unit="s", utc=tz is not None))
+        if tz not in (None, "UTC"):
+            df["timestamp"] = df["timestamp"].dt.tz_convert(tz)
+        return df
+
+
+def as_block(candles: Union[CandleBlock, List[Dict[str, Any]], None]) -> CandleBlock:
+    """Blocco da un risultato di fetch_candles (lista di dict) o da un blocco già pronto"""
+    if isinstance(candles, CandleBlock):
+        return candles
+    return CandleBlock.from_candles(candles or [])
+
+
+def fetch_block(source: Any, epic: str, resolution: str, limit: int) -> CandleBlock:
+    """fetch_candles_columnar della sorgente se disponibile, altrimenti fetch_candles convertito"""
+    if hasattr(source, "fetch_candles_columnar"):
+        return source.fetch_candles_columnar(epic, resolution, limit)
+    return as_block(source.fetch_candles(epic, resolution, limit))
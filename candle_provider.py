@@ -0,0 +1,81 @@
+"""Sorgente candele condivisa da indicators e forecaster (una richiesta per serie per ciclo)"""
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from candle_block import CandleBlock, fetch_block
+
+
+class _Fetch:
+    """Richiesta (in corso o completata) per una serie"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.block = CandleBlock.empty()
+        self.done = threading.Event()
+
+
+class CandleProvider:
+    """
+    Wrapper di una sorgente con fetch_candles(epic, resolution, limit) (CapitalTrader,
+    CandleStore, BarAggregator...) che unisce le richieste per la stessa serie:
+
+    - richieste concorrenti per (epic, resolution) aspettano la stessa chiamata
+    - una finestra più piccola viene ritagliata da una più grande già scaricata
+    - ogni serie viene chiesta alla sorgente con la finestra più grande mai richiesta,
+      così dal secondo ciclo in poi basta una sola chiamata per serie
+
+    I risultati restano validi fino a reset(), da chiamare all'inizio di ogni ciclo.
+    Le serie sono tenute come CandleBlock (dalla sorgente con fetch_candles_columnar se
+    disponibile): fetch_candles_columnar restituisce viste in sola lettura, senza copie.
+    """
+
+    def __init__(self, source: Any):
+        self.source = source
+        self.fetches = 0
+        self.hits = 0
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple[str, str], _Fetch] = {}
+        self._wanted: Dict[Tuple[str, str], int] = {}
+
+    def reset(self):
+        """Dimentica le candele scaricate (la finestra massima per serie resta)"""
+        with self._lock:
+            self._entries = {k: e for k, e in self._entries.items() if not e.done.is_set()}
+
+    def fetch_candles(self, epic: str, resolution: str = "MINUTE_15", limit: int = 100) -> List[Dict[str, Any]]:
+        """Stessa interfaccia e formato di CapitalTrader.fetch_candles"""
+        return self.fetch_candles_columnar(epic, resolution, limit).to_candles()
+
+    def fetch_candles_columnar(self, epic: str, resolution: str = "MINUTE_15", limit: int = 100) -> CandleBlock:
+        """Stessa interfaccia di CapitalTrader.fetch_candles_columnar (blocco condiviso: non modificabile)"""
+        key = (epic, resolution)
+        while True:
+            with self._lock:
+                self._wanted[key] = max(self._wanted.get(key, 0), limit)
+                entry: Optional[_Fetch] = self._entries.get(key)
+                owner = entry is None or (entry.done.is_set() and entry.limit < limit)
+                if owner:
+                    entry = self._entries[key] = _Fetch(self._wanted[key])
+
+            if owner:
+                return self._fetch(key, entry, limit)
+
+            entry.done.wait()
+            if entry.limit >= limit or not entry.block:
+                self.hits += 1
+                return entry.block.tail(limit)
+            # La richiesta in corso era per una finestra più piccola: ne serve una nuova
+
+    def _fetch(self, key: Tuple[str, str], entry: _Fetch, limit: int) -> CandleBlock:
+        epic, resolution = key
+        try:
+            entry.block = fetch_block(self.source, epic, resolution, entry.limit)
+            self.fetches += 1
+        finally:
+            if not entry.block:
+                # Errore o risposta vuota: non memorizzare, il prossimo chiamante riprova
+                with self._lock:
+                    if self._entries.get(key) is entry:
+                        del self._entries[key]
+            entry.done.set()
+        return entry.block.tail(limit)
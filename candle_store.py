@@ -0,0 +1,182 @@
+"""
+Archivio locale (SQLite) delle candele Capital.com con aggiornamento incrementale.
+
+CandleStore espone lo stesso fetch_candles(epic, resolution, limit) di
+CapitalTrader: la prima volta scarica la finestra completa, poi chiede a
+/prices solo le barre dall'ultima salvata in avanti (from/to), le unisce allo
+storico e serve la finestra richiesta dal database locale.
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from bar_aggregator import RESOLUTION_SECONDS, format_bar_time, parse_bar_time
+
+# File SQLite delle candele ("" per disabilitare l'archivio e usare solo REST)
+DEFAULT_CANDLE_STORE_PATH = os.getenv("CANDLE_STORE_PATH", ".candles.sqlite")
+# Limite di Capital.com per il parametro max di /prices
+MAX_BARS_PER_REQUEST = 1000
+# Barre conservate per (epic, resolution): oltre, le più vecchie vengono eliminate
+DEFAULT_KEEP_BARS = 2000
+# Entro questo intervallo dall'ultimo aggiornamento la serie è servita senza chiamare /prices
+# (indicatori e previsioni leggono le stesse serie a pochi secondi di distanza)
+DEFAULT_MIN_REFRESH_SECONDS = 5.0
+# PRAGMA user_version dell'archivio. 1: ts da snapshotTimeUTC (prima snapshotTime, nel fuso
+# del conto): le candele salvate da versioni precedenti vengono scartate e riscaricate
+STORE_VERSION = 1
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS candles (
+    epic        TEXT NOT NULL,
+    resolution  TEXT NOT NULL,
+    ts          TEXT NOT NULL,
+    open        REAL,
+    high        REAL,
+    low         REAL,
+    close       REAL,
+    volume      REAL,
+    PRIMARY KEY (epic, resolution, ts)
+);
+"""
+
+
+class CandleStore:
+    """
+    Candele persistite per (epic, resolution) con delta fetch da `rest_client`.
+
+    L'ultima barra salvata era probabilmente ancora in formazione: il delta parte
+    sempre dal suo timestamp (incluso), così viene sovrascritta con i valori finali.
+    I timestamp sono quelli UTC di /prices (snapshotTimeUTC, vedi parse_candles): le
+    chiavi, il from/to del delta e il controllo sullo storico vecchio usano tutti l'epoch UTC.
+    """
+
+    def __init__(self, rest_client: Any, path: str = DEFAULT_CANDLE_STORE_PATH,
+                 keep_bars: int = DEFAULT_KEEP_BARS, min_refresh_seconds: float = DEFAULT_MIN_REFRESH_SECONDS,
+                 clock=time.time):
+        self.rest_client = rest_client
+        self.path = path
+        self.keep_bars = keep_bars
+        self.min_refresh_seconds = min_refresh_seconds
+        self.clock = clock
+        self.rest_calls = 0
+        self.bars_downloaded = 0
+        self._refreshed: Dict[Tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA_SQL)
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] < STORE_VERSION:
+            with self._conn:
+                self._conn.execute("DELETE FROM candles")
+            self._conn.execute(f"PRAGMA user_version = {STORE_VERSION}")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # ==========================================================================
+    #                           LETTURA / SCRITTURA
+    # ==========================================================================
+
+    def _stats(self, epic: str, resolution: str) -> Tuple[int, Optional[str]]:
+        row = self._conn.execute(
+            "SELECT COUNT(*), MAX(ts) FROM candles WHERE epic = ? AND resolution = ?",
+            (epic, resolution),
+        ).fetchone()
+        return row[0], row[1]
+
+    def _upsert(self, epic: str, resolution: str, candles: List[Dict[str, Any]]):
+        rows = [
+            (epic, resolution, normalize_ts(c["timestamp"]), c.get("open"), c.get("high"),
+             c.get("low"), c.get("close"), c.get("volume"))
+            for c in candles if c.get("timestamp")
+        ]
+        with self._conn:
+            self._conn.executemany(
+                """
+                INSERT INTO candles (epic, resolution, ts, open, high, low, close, volume)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (epic, resolution, ts) DO UPDATE SET
+                    open = excluded.open, high = excluded.high, low = excluded.low,
+                    close = excluded.close, volume = excluded.volume
+                """,
+                rows,
+            )
+            self._conn.execute(
+                """
+                DELETE FROM candles WHERE epic = ? AND resolution = ? AND ts NOT IN (
+                    SELECT ts FROM candles WHERE epic = ? AND resolution = ?
+                    ORDER BY ts DESC LIMIT ?
+                )
+                """,
+                (epic, resolution, epic, resolution, self.keep_bars),
+            )
+
+    def _window(self, epic: str, resolution: str, limit: int) -> List[Dict[str, Any]]:
+        rows = self._conn.execute(
+            """
+            SELECT ts, open, high, low, close, volume FROM (
+                SELECT * FROM candles WHERE epic = ? AND resolution = ?
+                ORDER BY ts DESC LIMIT ?
+            ) ORDER BY ts ASC
+            """,
+            (epic, resolution, limit),
+        ).fetchall()
+        return [
+            {"timestamp": ts, "open": o, "high": h, "low": l, "close": c, "volume": v}
+            for ts, o, h, l, c, v in rows
+        ]
+
+    # ==========================================================================
+    #                           INTERFACCIA CANDELE
+    # ==========================================================================
+
+    def fetch_candles(self, epic: str, resolution: str = "MINUTE_15", limit: int = 100) -> List[Dict[str, Any]]:
+        """Stessa interfaccia e formato di CapitalTrader.fetch_candles"""
+        seconds = RESOLUTION_SECONDS.get(resolution)
+        if seconds is None or limit > self.keep_bars:
+            return self.rest_client.fetch_candles(epic, resolution, limit)
+
+        key = (epic, resolution)
+        with self._lock:
+            count, last_ts = self._stats(epic, resolution)
+            now = self.clock()
+            recently = now - self._refreshed.get(key, float("-inf")) < self.min_refresh_seconds
+            if count >= limit and recently:
+                return self._window(epic, resolution, limit)
+
+        calls = 1
+        if count < limit or last_ts is None or parse_bar_time(last_ts) < now - limit * seconds:
+            # Storico assente, troppo corto o troppo vecchio: finestra completa
+            candles = self.rest_client.fetch_candles(epic, resolution, min(limit, MAX_BARS_PER_REQUEST))
+        else:
+            # Solo le barre dall'ultima salvata (inclusa) a adesso
+            missing = math.ceil((now - parse_bar_time(last_ts)) / seconds) + 1
+            candles = self.rest_client.fetch_candles(
+                epic, resolution, min(missing + 1, MAX_BARS_PER_REQUEST),
+                from_date=last_ts, to_date=format_bar_time(int(now)),
+            )
+            if not candles:
+                print(f"⚠️ CandleStore: delta {epic} {resolution} vuoto, riprovo con la finestra completa")
+                candles = self.rest_client.fetch_candles(epic, resolution, min(limit, MAX_BARS_PER_REQUEST))
+                calls += 1
+
+        with self._lock:
+            self.rest_calls += calls
+            if not candles:
+                # Mai servire lo storico locale come se fosse aggiornato: il chiamante vede "nessuna candela"
+                print(f"⚠️ CandleStore: nessuna candela da Capital.com per {epic} {resolution}")
+                return []
+            self.bars_downloaded += len(candles)
+            self._upsert(epic, resolution, candles)
+            self._refreshed[key] = self.clock()
+            return self._window(epic, resolution, limit)
+
+
+def normalize_ts(timestamp: str) -> str:
+    """Timestamp di /prices nel formato "YYYY-MM-DDTHH:MM:SS" (UTC): ordinabile come testo"""
+    return datetime.fromtimestamp(parse_bar_time(timestamp), timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
@@ -0,0 +1,275 @@
+"""
+Client streaming Capital.com (WebSocket) per le quotazioni in tempo reale.
+
+Si iscrive a `marketData.subscribe` per gli epic configurati e tiene l'ultimo
+bid/offer di ognuno in un PriceBus in memoria. Sizing, PnL e controlli di
+rischio possono così leggere il prezzo senza una chiamata REST.
+
+Il client gira in un thread dedicato con il proprio event loop asyncio e si
+riconnette (con backoff) e re-iscrive da solo se la connessione cade.
+"""
+import asyncio
+import itertools
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import aiohttp
+
+STREAMING_URL = os.getenv("CAPITAL_STREAMING_URL", "wss://api-streaming-capital.backend-capital.com/connect")
+# Limite Capital.com: massimo 40 epic per sottoscrizione
+MAX_EPICS_PER_SUBSCRIPTION = 40
+# La connessione streaming va pingata almeno ogni 10 minuti
+STREAM_PING_INTERVAL = 5 * 60
+RECONNECT_MIN_DELAY = 1.0
+RECONNECT_MAX_DELAY = 30.0
+
+
+class SessionExpired(Exception):
+    """Il server streaming ha rifiutato i token di sessione"""
+
+
+class PriceBus:
+    """Ultima quotazione per epic, condivisa tra thread, con callback sugli aggiornamenti"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._quotes: Dict[str, Dict[str, Any]] = {}
+        self._listeners: List[Callable[[str, Dict[str, Any]], None]] = []
+
+    def update(self, epic: str, bid: float, offer: float, timestamp: Optional[float] = None):
+        quote = {
+            "bid": bid,
+            "offer": offer,
+            "timestamp": timestamp or time.time(),
+            "received_at": time.monotonic(),
+        }
+        with self._cond:
+            self._quotes[epic] = quote
+            listeners = list(self._listeners)
+            self._cond.notify_all()
+        for listener in listeners:
+            try:
+                listener(epic, quote)
+            except Exception as e:
+                print(f"⚠️ PriceBus: errore nel listener: {e}")
+
+    def get(self, epic: str, max_age: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Ultima quotazione di epic, o None se assente o più vecchia di max_age secondi"""
+        with self._lock:
+            quote = self._quotes.get(epic)
+        if quote is None:
+            return None
+        if max_age is not None and time.monotonic() - quote["received_at"] > max_age:
+            return None
+        return dict(quote)
+
+    def mid(self, epic: str, max_age: Optional[float] = None) -> Optional[float]:
+        quote = self.get(epic, max_age)
+        if quote is None or quote["bid"] is None or quote["offer"] is None:
+            return None
+        return (quote["bid"] + quote["offer"]) / 2
+
+    def wait_for(self, epic: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """Attende la prima quotazione di epic (utile all'avvio)"""
+        with self._cond:
+            self._cond.wait_for(lambda: epic in self._quotes, timeout)
+        return self.get(epic)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {epic: dict(q) for epic, q in self._quotes.items()}
+
+    def add_listener(self, listener: Callable[[str, Dict[str, Any]], None]):
+        with self._lock:
+            self._listeners.append(listener)
+
+
+class CapitalStreamingClient:
+    """
+    Client WebSocket per le quotazioni Capital.com.
+
+    `trader` fornisce i token di sessione (cst / x_security_token) e ping() per
+    rinnovarli. Con CapitalTrader usare start()/stop() (thread dedicato); con
+    AsyncCapitalTrader eseguire `await client.run()` nello stesso event loop.
+    Se il trader ha una market_cache, ogni quotazione aggiorna anche lo snapshot
+    usato da get_price_snapshot().
+    """
+
+    def __init__(self, trader, epics: List[str], bus: Optional[PriceBus] = None,
+                 url: str = STREAMING_URL, ping_interval: float = STREAM_PING_INTERVAL):
+        self.trader = trader
+        self.epics = list(dict.fromkeys(epics))
+        self.bus = bus or PriceBus()
+        self.url = url
+        self.ping_interval = ping_interval
+
+        self.connected = threading.Event()
+        self.reconnects = 0
+        self.quotes_received = 0
+        self.bad_messages = 0
+
+        self._correlation = itertools.count(1)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop: Optional[asyncio.Event] = None
+
+        market_cache = getattr(trader, "market_cache", None)
+        if market_cache is not None:
+            self.bus.add_listener(lambda epic, q: market_cache.store_snapshot(
+                epic, {"bid": q["bid"], "offer": q["offer"], "updateTime": q["timestamp"]}
+            ))
+
+    # ==========================================================================
+    #                           THREAD / LIFECYCLE
+    # ==========================================================================
+
+    def start(self):
+        """Avvia il client in un thread daemon"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._thread_main, name="capital-streaming", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        if self._loop is not None and self._stop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def _thread_main(self):
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self.run())
+        finally:
+            self._loop.close()
+            self._loop = None
+
+    async def run(self):
+        """Loop principale: connetti, iscriviti, leggi; riconnetti con backoff finché non fermato"""
+        self._stop = asyncio.Event()
+        delay = RECONNECT_MIN_DELAY
+        async with aiohttp.ClientSession() as session:
+            while not self._stop.is_set():
+                try:
+                    await self._session_loop(session)
+                except (aiohttp.ClientError, asyncio.TimeoutError, ConnectionError) as e:
+                    print(f"⚠️ Streaming: connessione persa ({e})")
+                except SessionExpired:
+                    print("🔄 Streaming: sessione scaduta, rinnovo token...")
+                    try:
+                        await self._refresh_session()
+                    except Exception as e:
+                        print(f"⚠️ Streaming: rinnovo token fallito ({e})")
+                except Exception as e:
+                    # Qualsiasi altro errore: il thread non deve morire lasciando il PriceBus fermo
+                    print(f"❌ Streaming: errore inatteso ({type(e).__name__}: {e})")
+                finally:
+                    if self.connected.is_set():
+                        # Era connesso: la prossima riconnessione riparte dal ritardo minimo
+                        delay = RECONNECT_MIN_DELAY
+                    self.connected.clear()
+
+                if self._stop.is_set():
+                    break
+                self.reconnects += 1
+                print(f"🔌 Streaming: riconnessione tra {delay:.0f}s")
+                try:
+                    await asyncio.wait_for(self._stop.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    # ==========================================================================
+    #                           PROTOCOLLO
+    # ==========================================================================
+
+    def _message(self, destination: str, payload: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        message = {
+            "destination": destination,
+            "correlationId": str(next(self._correlation)),
+            "cst": self.trader.cst,
+            "securityToken": self.trader.x_security_token,
+        }
+        if payload is not None:
+            message["payload"] = payload
+        return message
+
+    async def _session_loop(self, session: aiohttp.ClientSession):
+        async with session.ws_connect(self.url, heartbeat=30) as ws:
+            for i in range(0, len(self.epics), MAX_EPICS_PER_SUBSCRIPTION):
+                chunk = self.epics[i:i + MAX_EPICS_PER_SUBSCRIPTION]
+                await ws.send_json(self._message("marketData.subscribe", {"epics": chunk}))
+            print(f"📡 Streaming connesso: {len(self.epics)} epic sottoscritti")
+            self.connected.set()
+
+            ping_task = asyncio.ensure_future(self._ping_loop(ws))
+            stop_task = asyncio.ensure_future(self._stop.wait())
+            try:
+                while True:
+                    receive = asyncio.ensure_future(ws.receive())
+                    done, _ = await asyncio.wait({receive, stop_task}, return_when=asyncio.FIRST_COMPLETED)
+                    if stop_task in done:
+                        receive.cancel()
+                        return
+                    msg = receive.result()
+                    if msg.type == aiohttp.WSMsgType.TEXT:
+                        self._handle(msg.data)
+                    elif msg.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSED,
+                                      aiohttp.WSMsgType.CLOSING, aiohttp.WSMsgType.ERROR):
+                        raise ConnectionError(f"websocket chiuso ({msg.type.name})")
+            finally:
+                ping_task.cancel()
+                stop_task.cancel()
+
+    async def _ping_loop(self, ws):
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            await ws.send_json(self._message("ping"))
+
+    def _handle(self, data: str):
+        """Un frame di testo: gli errori del singolo messaggio vengono registrati, non chiudono lo stream"""
+        try:
+            self._dispatch(json.loads(data))
+        except SessionExpired:
+            raise
+        except Exception as e:
+            self.bad_messages += 1
+            print(f"⚠️ Streaming: messaggio ignorato ({type(e).__name__}: {e}): {data[:200]}")
+
+    def _dispatch(self, message: Dict[str, Any]):
+        destination = message.get("destination")
+        payload = message.get("payload") or {}
+
+        if message.get("status") == "ERROR" or payload.get("errorCode"):
+            error = payload.get("errorCode") or str(payload)
+            if "session" in error or "token" in error:
+                raise SessionExpired(error)
+            print(f"⚠️ Streaming: errore {destination}: {error}")
+            return
+
+        if destination == "quote":
+            timestamp = payload.get("timestamp")
+            self.bus.update(
+                payload.get("epic"),
+                payload.get("bid"),
+                payload.get("ofr", payload.get("offer")),
+                timestamp / 1000 if timestamp else None,
+            )
+            self.quotes_received += 1
+        elif destination == "marketData.subscribe":
+            rejected = {e: s for e, s in payload.get("subscriptions", {}).items() if s != "PROCESSED"}
+            if rejected:
+                print(f"⚠️ Streaming: sottoscrizione rifiutata per {rejected}")
+
+    async def _refresh_session(self):
+        """Rinnova i token tramite il trader (ping ri-autentica su 401)"""
+        ping = self.trader.ping
+        if asyncio.iscoroutinefunction(ping):
+            await ping()
+        else:
+            await asyncio.get_running_loop().run_in_executor(None, ping)
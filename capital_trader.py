@@ -3,8 +3,18 @@ import json
 import time
 import base64
 from datetime import datetime
-from typing import Dict, Any, List, Optional
+from typing import Callable, Dict, Any, List, Optional
 import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from requests.adapters import HTTPAdapter
+
+import timing
+from account_state import AccountState
+from candle_block import CandleBlock
+from rate_limiter import shared_limiter
 
 # Try to import crypto libraries for password encryption
 try:
@@ -15,6 +25,517 @@ except ImportError:
     HAS_CRYPTO = False
     print("⚠️ pycryptodome not installed. Encrypted login will not be available.")
 
+# Capital.com chiude la sessione dopo 10 minuti di inattività: teniamo un margine
+SESSION_TTL_SECONDS = 9 * 60
+# File dove salvare CST / X-SECURITY-TOKEN tra un riavvio e l'altro ("" per disabilitare)
+DEFAULT_SESSION_CACHE_PATH = os.getenv("CAPITAL_SESSION_CACHE", ".capital_session.json")
+# Keepalive: ping se la sessione è inattiva da più di così (ben prima dei 10 minuti)
+DEFAULT_KEEPALIVE_INTERVAL = 5 * 60
+
+DEMO_BASE_URL = "https://demo-api-capital.backend-capital.com"
+LIVE_BASE_URL = "https://api-capital.backend-capital.com"
+
+# Timeout (connect, read) in secondi per corsia: nessuna chiamata può bloccare il ciclo all'infinito.
+# Caso peggiore per una GET: (MAX_GET_RETRIES + 1) * (connect + read) + attese tra i tentativi.
+REQUEST_TIMEOUTS = {
+    "session": (5, 15),
+    "trading": (5, 10),
+    "account": (5, 10),
+    "market_data": (5, 20),
+}
+# Retry con backoff esponenziale + jitter, solo per GET (idempotenti)
+MAX_GET_RETRIES = 2
+RETRY_BASE_DELAY = 0.5
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+# Connessioni keep-alive tenute aperte verso l'host (>= richieste concorrenti del ciclo)
+HTTP_POOL_SIZE = 10
+# Attese del rate limiter più lunghe di così finiscono nei record di timing
+RATE_LIMIT_WAIT_RECORD_SECONDS = 0.001
+
+# Dettagli strumento e dealing rules cambiano di rado; lo snapshot bid/offer invecchia in pochi secondi
+MARKET_RULES_TTL_SECONDS = float(os.getenv("CAPITAL_MARKET_RULES_TTL", 6 * 60 * 60))
+MARKET_SNAPSHOT_TTL_SECONDS = float(os.getenv("CAPITAL_MARKET_SNAPSHOT_TTL", 5))
+
+# GET /markets?epics=... accetta al massimo 50 epic per richiesta
+MAX_EPICS_PER_QUOTE_REQUEST = 50
+
+# Conferma deal: primo controllo quasi subito, poi intervallo raddoppiato fino a
+# CONFIRM_MAX_INTERVAL, rinunciando dopo CONFIRM_DEADLINE_SECONDS
+CONFIRM_FIRST_DELAY = 0.05
+CONFIRM_MAX_INTERVAL = 0.5
+CONFIRM_DEADLINE_SECONDS = 5.0
+
+
+# ==============================================================================
+#        HELPER CONDIVISI (usati da CapitalTrader e AsyncCapitalTrader)
+# ==============================================================================
+
+def read_session_cache(path: Optional[str], base_url: str, identifier: str) -> Optional[Dict[str, Any]]:
+    """Legge la sessione salvata; None (e file rimosso) se assente, corrotta, scaduta o di un altro utente"""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        clear_session_cache(path)
+        return None
+    if (data.get("base_url") != base_url or data.get("identifier") != identifier
+            or data.get("expires_at", 0) <= time.time()):
+        clear_session_cache(path)
+        return None
+    return data
+
+
+def write_session_cache(path: str, base_url: str, identifier: str, cst: str, x_security_token: str,
+                        active_account_id: Optional[str], active_account_name: Optional[str]) -> float:
+    """Scrive la sessione in modo atomico (permessi 0600); restituisce il timestamp di scrittura"""
+    now = time.time()
+    data = {
+        "base_url": base_url,
+        "identifier": identifier,
+        "cst": cst,
+        "x_security_token": x_security_token,
+        "active_account_id": active_account_id,
+        "active_account_name": active_account_name,
+        "saved_at": now,
+        "expires_at": now + SESSION_TTL_SECONDS,
+    }
+    tmp_path = f"{path}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+    return now
+
+
+def clear_session_cache(path: Optional[str]):
+    if path:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def choose_account(accounts: List[Dict[str, Any]], account_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Conto con l'id indicato, altrimenti il preferito, altrimenti il primo"""
+    if account_id:
+        account = next((a for a in accounts if a.get("accountId") == account_id), None)
+        if account:
+            return account
+    return next((a for a in accounts if a.get("preferred", False)), accounts[0] if accounts else None)
+
+
+def parse_account_summary(account: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Riassunto saldo/equity di un elemento di GET /accounts"""
+    if not account:
+        return {}
+    return {
+        "balance": account.get("balance", {}).get("balance", 0),
+        "equity": account.get("balance", {}).get("equity", 0),
+        "pnl": account.get("balance", {}).get("profitLoss", 0),
+        "available": account.get("balance", {}).get("available", 0),
+        "currency": account.get("currency", "EUR"),
+        "account_name": account.get("accountName", "Unknown")
+    }
+
+
+def parse_positions(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Converte la risposta di GET /positions nel formato usato dal bot"""
+    positions = []
+    for item in data.get("positions", []):
+        pos = item.get("position", {})
+        market = item.get("market", {})
+        
+        positions.append({
+            "dealId": pos.get("dealId"),
+            "dealReference": pos.get("dealReference"),
+            "symbol": market.get("epic"),
+            "direction": pos.get("direction"),
+            "size": pos.get("size"),
+            "entry_price": pos.get("level"),
+            "mark_price": market.get("bid") if pos.get("direction") == "SELL" else market.get("offer"),
+            "stopLevel": pos.get("stopLevel"),
+            "profitLevel": pos.get("profitLevel"),
+            "trailingStop": pos.get("trailingStop"),
+            "guaranteedStop": pos.get("guaranteedStop"),
+            "pnl": pos.get("upl"),
+            "created_at": pos.get("createdDate"),
+            "leverage": pos.get("leverage"),
+            "currency": pos.get("currency")
+        })
+    return positions
+
+
+def build_prices_params(resolution: str, limit: int, from_date: Optional[str] = None,
+                        to_date: Optional[str] = None) -> Dict[str, Any]:
+    """Query string di GET /prices/{epic}"""
+    params = {"resolution": resolution, "max": limit}
+    if from_date:
+        params["from"] = from_date
+    if to_date:
+        params["to"] = to_date
+    return params
+
+
+def parse_candles(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Converte la risposta di GET /prices/{epic} in candele (prezzi bid).
+    timestamp = snapshotTimeUTC: snapshotTime è nel fuso del conto (fallback se manca).
+    """
+    candles = []
+    for price in data.get("prices", []):
+        candles.append({
+            "timestamp": price.get("snapshotTimeUTC") or price.get("snapshotTime"),
+            "open": price.get("openPrice", {}).get("bid"),
+            "high": price.get("highPrice", {}).get("bid"),
+            "low": price.get("lowPrice", {}).get("bid"),
+            "close": price.get("closePrice", {}).get("bid"),
+            "volume": price.get("lastTradedVolume", 0)
+        })
+    return candles
+
+
+def build_order_payload(epic: str, direction: str, size: float, stop_distance: float = None,
+                        profit_distance: float = None, trailing_stop: bool = False) -> Dict[str, Any]:
+    """Body di POST /positions"""
+    payload = {
+        "epic": epic, 
+        "direction": direction.upper(),
+        "size": size,
+        "guaranteedStop": False
+    }
+    
+    # Add Stop Loss if provided
+    if stop_distance is not None and stop_distance > 0:
+        payload["stopDistance"] = round(stop_distance, 5)
+    
+    # Add Take Profit if provided
+    if profit_distance is not None and profit_distance > 0:
+        payload["profitDistance"] = round(profit_distance, 5)
+    
+    # Add Trailing Stop if requested
+    if trailing_stop and stop_distance is not None:
+        payload["trailingStop"] = True
+    return payload
+
+
+def build_update_payload(stop_level: float = None, stop_distance: float = None, profit_level: float = None,
+                         profit_distance: float = None, trailing_stop: bool = None) -> Dict[str, Any]:
+    """Body di PUT /positions/{dealId}"""
+    payload = {}
+    if stop_level is not None:
+        payload["stopLevel"] = stop_level
+    if stop_distance is not None:
+        payload["stopDistance"] = stop_distance
+    if profit_level is not None:
+        payload["profitLevel"] = profit_level
+    if profit_distance is not None:
+        payload["profitDistance"] = profit_distance
+    if trailing_stop is not None:
+        payload["trailingStop"] = trailing_stop
+    return payload
+
+
+def map_symbol_to_epic(symbol: str) -> str:
+    """Map common symbol names to Capital.com EPICs"""
+    mapping = {
+        "BTC": "BTCUSD",
+        "BTCUSD": "BTCUSD",
+        "ETH": "ETHUSD",
+        "ETHUSD": "ETHUSD",
+        "SOL": "SOLUSD",
+        "SOLUSD": "SOLUSD",
+    }
+    return mapping.get(symbol.upper(), symbol.upper())
+
+
+def compute_order_size(balance: float, portion: float, leverage: int, price: float, min_size: float) -> tuple:
+    """
+    Size (in unità dell'asset) per una nuova posizione: balance * portion * leverage / price,
+    almeno min_size e arrotondata a 4 decimali (crypto). Restituisce (size, notional).
+    """
+    # For crypto: size is in units of the asset
+    notional = balance * portion * leverage
+    size = notional / price
+    
+    # Ensure size meets minimum
+    if size < min_size:
+        size = min_size
+    
+    # Round to appropriate decimals for crypto
+    size = round(size, 4)  # 4 decimals for crypto
+    return size, notional
+
+
+def format_account_status(account: Dict[str, Any], positions: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Stato account nello stesso formato di HyperLiquidTrader
+    (usato da main.py, dal prompt e da db_utils)
+    """
+    formatted_positions = []
+    for pos in positions:
+        # Reverse map epic to symbol
+        epic = pos.get('epic', pos.get('symbol', ''))
+        symbol = epic.replace("USD", "") if epic.endswith("USD") else epic
+        
+        # Calcola PnL percentuale
+        entry_price = pos.get('entry_price') or pos.get('openLevel') or 0
+        mark_price = pos.get('mark_price') or pos.get('currentLevel') or 0
+        pnl_pct = 0
+        if entry_price and mark_price and entry_price != 0:
+            price_diff = mark_price - entry_price
+            if pos.get('direction') == 'SELL':
+                price_diff = -price_diff
+            pnl_pct = (price_diff / entry_price) * 100
+        
+        formatted_positions.append({
+            "deal_id": pos.get('dealId'),  # Capital.com deal ID
+            "symbol": symbol,
+            "epic": epic,
+            "side": "long" if pos.get('direction') == "BUY" else "short",
+            "direction": pos.get('direction', 'BUY'),
+            "size": pos.get('size', 0),
+            "entry_price": entry_price,
+            "mark_price": mark_price,
+            "openLevel": pos.get('openLevel'),
+            "currentLevel": pos.get('currentLevel'),
+            "pnl_usd": pos.get('pnl') or pos.get('profit') or 0,
+            "pnl_pct": pnl_pct,  # Aggiunto per anti-overtrading
+            "profit": pos.get('profit') or pos.get('pnl') or 0,
+            "stopLevel": pos.get('stopLevel'),
+            "limitLevel": pos.get('limitLevel'),
+            "leverage": "N/A (CFD)",
+            "opened_at": pos.get('created_at'),  # Aggiunto per anti-overtrading
+        })
+    
+    return {
+        "balance_usd": account.get("balance", 0),
+        "equity": account.get("equity", 0),
+        "available": account.get("available", 0),
+        "pnl": account.get("pnl", 0),
+        "currency": account.get("currency", "EUR"),
+        "account_name": account.get("account_name", "Unknown"),
+        "positions": formatted_positions,
+        "open_positions": formatted_positions,  # Keep both for compatibility
+    }
+
+
+class MarketCache:
+    """
+    Cache per epic di GET /markets/{epic}, divisa in due parti con TTL diversi:
+    - instrument + dealingRules: TTL lungo (MARKET_RULES_TTL_SECONDS)
+    - snapshot bid/offer: TTL breve (MARKET_SNAPSHOT_TTL_SECONDS), aggiornabile anche
+      da altre risposte che contengono il prezzo (es. GET /positions)
+    Thread-safe.
+    """
+
+    def __init__(self, rules_ttl: float = MARKET_RULES_TTL_SECONDS,
+                 snapshot_ttl: float = MARKET_SNAPSHOT_TTL_SECONDS, clock=time.monotonic):
+        self.rules_ttl = rules_ttl
+        self.snapshot_ttl = snapshot_ttl
+        self.clock = clock
+        self._rules: Dict[str, tuple] = {}
+        self._snapshots: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def store(self, epic: str, market_info: Dict[str, Any]):
+        """Memorizza una risposta completa di GET /markets/{epic}"""
+        now = self.clock()
+        with self._lock:
+            if "dealingRules" in market_info or "instrument" in market_info:
+                self._rules[epic] = (now, {
+                    "instrument": market_info.get("instrument", {}),
+                    "dealingRules": market_info.get("dealingRules", {}),
+                })
+            if market_info.get("snapshot"):
+                self._snapshots[epic] = (now, market_info["snapshot"])
+
+    def store_snapshot(self, epic: str, snapshot: Dict[str, Any]):
+        if epic and snapshot.get("bid") is not None and snapshot.get("offer") is not None:
+            with self._lock:
+                self._snapshots[epic] = (self.clock(), snapshot)
+
+    def rules(self, epic: str) -> Optional[Dict[str, Any]]:
+        """{"instrument", "dealingRules"} se ancora validi, altrimenti None"""
+        with self._lock:
+            entry = self._rules.get(epic)
+        if entry and self.clock() - entry[0] < self.rules_ttl:
+            return entry[1]
+        return None
+
+    def snapshot(self, epic: str, max_age: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Ultimo snapshot bid/offer se più recente di max_age (default snapshot_ttl)"""
+        max_age = self.snapshot_ttl if max_age is None else max_age
+        with self._lock:
+            entry = self._snapshots.get(epic)
+        if entry and self.clock() - entry[0] < max_age:
+            return entry[1]
+        return None
+
+    def get(self, epic: str) -> Optional[Dict[str, Any]]:
+        """Market info nello stesso formato di GET /markets/{epic}, solo se entrambe le parti sono valide"""
+        rules = self.rules(epic)
+        snapshot = self.snapshot(epic)
+        if rules is None or snapshot is None:
+            return None
+        return {**rules, "snapshot": snapshot}
+
+    def invalidate(self, epic: Optional[str] = None, rules: bool = True, snapshot: bool = True):
+        """Scarta la cache di un epic (o di tutti con epic=None)"""
+        with self._lock:
+            for enabled, store in ((rules, self._rules), (snapshot, self._snapshots)):
+                if not enabled:
+                    continue
+                if epic is None:
+                    store.clear()
+                else:
+                    store.pop(epic, None)
+
+
+def parse_quotes(data: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Quotazioni per epic dalla risposta di GET /markets?epics=..."""
+    quotes = {}
+    for details in data.get("marketDetails", []):
+        epic = details.get("instrument", {}).get("epic")
+        snapshot = details.get("snapshot", {})
+        if epic:
+            quotes[epic] = {
+                "bid": snapshot.get("bid"),
+                "offer": snapshot.get("offer"),
+                "marketStatus": snapshot.get("marketStatus"),
+                "percentageChange": snapshot.get("percentageChange"),
+                "updateTime": snapshot.get("updateTime"),
+            }
+    return quotes
+
+
+def mark_positions(positions: List[Dict[str, Any]], market_cache: "MarketCache") -> List[Dict[str, Any]]:
+    """Aggiorna mark_price delle posizioni con gli snapshot ancora validi in cache"""
+    marked = []
+    for pos in positions:
+        snapshot = market_cache.snapshot(pos.get("symbol"))
+        if snapshot:
+            pos = dict(pos)
+            pos["mark_price"] = snapshot.get("bid") if pos.get("direction") == "SELL" else snapshot.get("offer")
+        marked.append(pos)
+    return marked
+
+
+def format_quotes(quotes: Dict[str, Dict[str, Any]]) -> str:
+    """Quotazioni in testo per il prompt, una riga per epic"""
+    lines = []
+    for epic, q in quotes.items():
+        bid, offer = q.get("bid"), q.get("offer")
+        spread = f"{offer - bid:.5g}" if bid is not None and offer is not None else "N/A"
+        change = q.get("percentageChange")
+        change_txt = f"{change:+.2f}%" if change is not None else "N/A"
+        lines.append(f"{epic}: bid {bid} / offer {offer} (spread {spread}, 24h {change_txt}, {q.get('marketStatus')})")
+    return "\n".join(lines)
+
+
+def snapshots_from_positions(data: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Snapshot bid/offer per epic contenuti nella risposta di GET /positions"""
+    snapshots = {}
+    for item in data.get("positions", []):
+        market = item.get("market", {})
+        if market.get("epic"):
+            snapshots[market["epic"]] = {
+                "bid": market.get("bid"),
+                "offer": market.get("offer"),
+                "marketStatus": market.get("marketStatus"),
+                "updateTime": market.get("updateTimeUTC") or market.get("updateTime"),
+            }
+    return snapshots
+
+
+def is_deal_confirmed(confirm: Dict[str, Any]) -> bool:
+    """True se la risposta di get_deal_confirmation contiene l'esito definitivo del deal"""
+    return confirm.get("status") == "ok" and bool(confirm.get("data", {}).get("dealStatus"))
+
+
+def confirmed_deal_id(data: Dict[str, Any]) -> Optional[str]:
+    """dealId della posizione aperta/modificata (campo diretto o primo affectedDeals)"""
+    if data.get("dealId"):
+        return data["dealId"]
+    affected = data.get("affectedDeals") or []
+    return affected[0].get("dealId") if affected else None
+
+
+class ConfirmationWaiter:
+    """
+    Deal in attesa di conferma, indicizzati per dealReference.
+
+    wait() interroga /confirms con backoff adattivo fino alla deadline, ma termina
+    subito se nel frattempo arriva notify() (es. da un aggiornamento in streaming).
+    Le notifiche che arrivano prima che qualcuno sia in attesa vengono conservate.
+    """
+
+    MAX_UNCLAIMED = 100
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events: Dict[str, threading.Event] = {}
+        self._results: Dict[str, Dict[str, Any]] = {}
+
+    def register(self, deal_reference: str) -> threading.Event:
+        with self._lock:
+            event = self._events.setdefault(deal_reference, threading.Event())
+            if deal_reference in self._results:
+                event.set()
+            return event
+
+    def notify(self, deal_reference: str, confirmation: Dict[str, Any]):
+        """Completa l'attesa di deal_reference con i dati di conferma (formato di GET /confirms)"""
+        with self._lock:
+            self._results[deal_reference] = confirmation
+            while len(self._results) > self.MAX_UNCLAIMED:
+                self._results.pop(next(iter(self._results)))
+            event = self._events.get(deal_reference)
+        if event is not None:
+            event.set()
+
+    def result(self, deal_reference: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._results.get(deal_reference)
+
+    def release(self, deal_reference: str):
+        with self._lock:
+            self._events.pop(deal_reference, None)
+            self._results.pop(deal_reference, None)
+
+    def wait(self, deal_reference: str, poll: Callable[[], Dict[str, Any]],
+             deadline: float = CONFIRM_DEADLINE_SECONDS) -> Dict[str, Any]:
+        """
+        Attende la conferma: `poll()` deve restituire il risultato di get_deal_confirmation.
+        Restituisce {"status": "ok", "data": ...} oppure {"status": "timeout"}.
+        """
+        event = self.register(deal_reference)
+        end = time.monotonic() + deadline
+        delay = CONFIRM_FIRST_DELAY
+        try:
+            while True:
+                remaining = end - time.monotonic()
+                if event.wait(max(0.0, min(delay, remaining))):
+                    return {"status": "ok", "data": self.result(deal_reference), "source": "notify"}
+                confirm = poll()
+                if is_deal_confirmed(confirm):
+                    return confirm
+                if time.monotonic() >= end:
+                    return {"status": "timeout", "message": f"Nessuna conferma per {deal_reference} entro {deadline}s"}
+                delay = min(delay * 2, CONFIRM_MAX_INTERVAL)
+        finally:
+            self.release(deal_reference)
+
+
+def retry_after_seconds(headers) -> Optional[float]:
+    """Secondi indicati dall'header Retry-After (None se assente o non numerico); headers requests o aiohttp"""
+    value = headers.get("Retry-After")
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
 
 class CapitalTrader:
     """
@@ -27,27 +548,57 @@ class CapitalTrader:
     - Candele storiche per analisi tecnica
     """
     
-    def __init__(self, api_key: str, password: str, identifier: str, demo_mode: bool = True, account_id: str = None):
+    def __init__(self, api_key: str, password: str, identifier: str, demo_mode: bool = True, account_id: str = None,
+                 session_cache_path: Optional[str] = DEFAULT_SESSION_CACHE_PATH,
+                 keepalive: bool = False, keepalive_interval: float = DEFAULT_KEEPALIVE_INTERVAL,
+                 base_url: Optional[str] = None):
         self.api_key = api_key
         self.password = password
         self.identifier = identifier
         self.demo_mode = demo_mode
         self.account_id = account_id  # Opzionale: specifica quale conto usare
         
-        if demo_mode:
-            self.base_url = "https://demo-api-capital.backend-capital.com"
+        # base_url / CAPITAL_BASE_URL: es. il server locale di mock_capital_server.py
+        if base_url or os.getenv("CAPITAL_BASE_URL"):
+            self.base_url = (base_url or os.getenv("CAPITAL_BASE_URL")).rstrip("/")
+        elif demo_mode:
+            self.base_url = DEMO_BASE_URL
         else:
-            self.base_url = "https://api-capital.backend-capital.com"
+            self.base_url = LIVE_BASE_URL
             
         self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=HTTP_POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # Budget di richieste condiviso da tutti i trader con la stessa API key
+        self.rate_limiter = shared_limiter(api_key)
+        self.market_cache = MarketCache()
+        # Epic di cui get_quotes aggiorna sempre la quotazione (uno per richiesta batch)
+        self.quote_epics: List[str] = []
+        self.confirmations = ConfirmationWaiter()
+        # Saldo + posizioni condivisi nel ciclo (invalidate_account_state() per rileggerli)
+        self.account_state = AccountState(self.get_account_status, self.get_open_positions)
         self.cst = None
         self.x_security_token = None
+        self.session_cache_path = session_cache_path or None
+        self._session_cache_touched = 0.0
+        self._last_activity = time.monotonic()
+        self._keepalive_thread = None
+        self._keepalive_stop = threading.Event()
+        # Re-login single-flight: il contatore dice se qualcun altro ha già rinnovato i token
+        self._auth_lock = threading.RLock()
+        self._auth_generation = 0
         
-        # Authenticate on init
-        self._authenticate()
-        
-        # Switch to correct account if specified or use preferred
-        self._select_account()
+        # Riusa la sessione salvata da un processo precedente, se ancora valida
+        if not self._restore_cached_session():
+            # Authenticate on init
+            self._authenticate()
+            
+            # Switch to correct account if specified or use preferred
+            self._select_account()
+
+        if keepalive:
+            self.start_keepalive(keepalive_interval)
 
     def _authenticate(self, max_retries: int = 5):
         """Authenticate with Capital.com API with retry on rate limit"""
@@ -61,7 +612,8 @@ class CapitalTrader:
         
         for attempt in range(max_retries):
             try:
-                response = self.session.post(url, headers=headers, json=payload)
+                with timing.stage("auth"):
+                    response = self._send("session", "POST", url, headers=headers, json=payload)
                 
                 if response.status_code == 200:
                     self._handle_auth_success(response)
@@ -85,6 +637,80 @@ class CapitalTrader:
         # If we exhausted all retries
         raise Exception(f"Authentication failed after {max_retries} retries due to rate limiting")
 
+    def _send(self, lane: str, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Invia una richiesta rispettando il rate limit della corsia indicata
+        ("session", "trading", "account", "market_data"). Un 429 dal server
+        sospende brevemente tutte le corsie.
+        """
+        kwargs.setdefault("timeout", REQUEST_TIMEOUTS.get(lane, REQUEST_TIMEOUTS["account"]))
+        t0 = time.monotonic()
+        self.rate_limiter.acquire(lane)
+        t1 = time.monotonic()
+        if t1 - t0 >= RATE_LIMIT_WAIT_RECORD_SECONDS:
+            # Attesa del rate limiter visibile nel timing (separata dalla latenza del broker)
+            timing.record(f"rate_limit:{lane}", t0, t1)
+        response = self.session.request(method, url, **kwargs)
+        if response.status_code == 429:
+            self.rate_limiter.backoff(retry_after_seconds(response.headers) or 1.0)
+        return response
+
+    def _request(self, lane: str, method: str, path: str, retries: Optional[int] = None,
+                 reauth: bool = True, **kwargs) -> requests.Response:
+        """
+        Richiesta autenticata verso `path` (es. "/api/v1/positions"). Unico punto
+        d'ingresso per tutti gli endpoint:
+        - timeout per corsia (REQUEST_TIMEOUTS)
+        - retry con backoff e jitter su errori di rete / 5xx / 429, solo per GET
+        - su 401 un solo re-login (condiviso tra thread) e un nuovo tentativo
+        """
+        url = f"{self.base_url}{path}"
+        if retries is None:
+            retries = MAX_GET_RETRIES if method == "GET" else 0
+        attempt = 0
+        reauthed = not reauth
+        while True:
+            generation = self._auth_generation
+            try:
+                response = self._send(lane, method, url, headers=self._get_headers(), **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt >= retries:
+                    raise
+                attempt += 1
+                self._retry_sleep(attempt, f"{type(e).__name__}", method, path)
+                continue
+
+            if response.status_code == 401 and not reauthed:
+                reauthed = True
+                self._reauthenticate(generation)
+                continue
+            if response.status_code in RETRYABLE_STATUS and attempt < retries:
+                attempt += 1
+                self._retry_sleep(attempt, f"HTTP {response.status_code}", method, path,
+                                  retry_after_seconds(response.headers))
+                continue
+            return response
+
+    @staticmethod
+    def _retry_sleep(attempt: int, reason: str, method: str, path: str, retry_after: Optional[float] = None):
+        delay = RETRY_BASE_DELAY * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+        if retry_after:
+            delay = max(delay, retry_after)
+        print(f"🔁 {method} {path}: {reason}, nuovo tentativo {attempt} tra {delay:.2f}s")
+        time.sleep(delay)
+
+    def _reauthenticate(self, seen_generation: int):
+        """
+        Re-login dopo un 401. Se più thread trovano la sessione scaduta insieme,
+        solo il primo rifà il login: gli altri attendono il lock e riusano i nuovi token.
+        """
+        with self._auth_lock:
+            if self._auth_generation != seen_generation:
+                return
+            print("🔄 Session expired, re-authenticating...")
+            self._authenticate()
+            self._select_account()
+
     def _handle_auth_success(self, response):
         self.cst = response.headers.get("CST")
         self.x_security_token = response.headers.get("X-SECURITY-TOKEN")
@@ -92,11 +718,74 @@ class CapitalTrader:
         if not self.cst or not self.x_security_token:
             raise ValueError("Authentication failed: Missing tokens in response headers")
             
+        self._auth_generation += 1
         print("✅ Capital.com Authenticated Successfully")
+        self._save_session_cache()
+
+    # ==========================================================================
+    #                           SESSION CACHE
+    # ==========================================================================
+
+    def _save_session_cache(self):
+        """Salva token e conto attivo su file, con scadenza a SESSION_TTL_SECONDS"""
+        if not self.session_cache_path or not self.cst or not self.x_security_token:
+            return
+        try:
+            self._session_cache_touched = write_session_cache(
+                self.session_cache_path, self.base_url, self.identifier, self.cst, self.x_security_token,
+                getattr(self, "active_account_id", None), getattr(self, "active_account_name", None)
+            )
+        except OSError as e:
+            print(f"⚠️ Impossibile salvare la sessione su {self.session_cache_path}: {e}")
+
+    def _touch_session_cache(self):
+        """Estende la scadenza del file di sessione (al massimo una scrittura al minuto)"""
+        if self.session_cache_path and time.time() - self._session_cache_touched > 60:
+            self._save_session_cache()
+
+    def _restore_cached_session(self) -> bool:
+        """
+        Prova a riusare CST / X-SECURITY-TOKEN salvati da un processo precedente.
+        I token vengono validati con GET /api/v1/ping; se sono scaduti o rifiutati
+        il file viene cancellato e si torna al login completo.
+        """
+        data = read_session_cache(self.session_cache_path, self.base_url, self.identifier)
+        if data is None:
+            return False
+
+        self.cst = data.get("cst")
+        self.x_security_token = data.get("x_security_token")
+        try:
+            headers = {"X-CAP-API-KEY": self.api_key, "CST": self.cst, "X-SECURITY-TOKEN": self.x_security_token}
+            response = self._send("account", "GET", f"{self.base_url}/api/v1/ping", headers=headers)
+        except Exception as e:
+            print(f"⚠️ Validazione sessione salvata fallita: {e}")
+            response = None
+
+        if response is None or response.status_code != 200:
+            print("🔄 Sessione salvata non più valida, nuovo login...")
+            self.cst = None
+            self.x_security_token = None
+            clear_session_cache(self.session_cache_path)
+            return False
+
+        self.active_account_id = data.get("active_account_id")
+        self.active_account_name = data.get("active_account_name")
+        print(f"✅ Sessione Capital.com riusata da {self.session_cache_path}")
+
+        # Conto richiesto diverso da quello della sessione salvata: switch (senza nuovo login)
+        if self.account_id and self.account_id != self.active_account_id:
+            self._select_account()
+        else:
+            self._save_session_cache()
+        return True
 
     def _get_headers(self) -> Dict[str, str]:
         if not self.cst or not self.x_security_token:
             self._authenticate()
+        else:
+            self._touch_session_cache()
+        self._last_activity = time.monotonic()
             
         return {
             "X-CAP-API-KEY": self.api_key,
@@ -105,11 +794,52 @@ class CapitalTrader:
             "Content-Type": "application/json"
         }
 
+    # ==========================================================================
+    #                           SESSION KEEPALIVE
+    # ==========================================================================
+
+    def ping(self) -> bool:
+        """
+        GET /api/v1/ping per mantenere viva la sessione.
+        Se la sessione è già scaduta ri-autentica subito, così la prossima
+        chiamata "calda" (es. un ordine) non paga il re-login.
+        """
+        try:
+            response = self._request("account", "GET", "/api/v1/ping", retries=0)
+            return response.status_code == 200
+        except Exception as e:
+            print(f"⚠️ Keepalive ping fallito: {e}")
+            return False
+
+    def start_keepalive(self, interval: float = DEFAULT_KEEPALIVE_INTERVAL):
+        """
+        Avvia un thread daemon che pinga la sessione quando resta inattiva per
+        più di `interval` secondi (la sessione Capital.com scade dopo 10 minuti).
+        """
+        if self._keepalive_thread and self._keepalive_thread.is_alive():
+            return
+        self._keepalive_stop.clear()
+        self._keepalive_thread = threading.Thread(
+            target=self._keepalive_loop, args=(interval,), name="capital-keepalive", daemon=True
+        )
+        self._keepalive_thread.start()
+
+    def stop_keepalive(self):
+        self._keepalive_stop.set()
+        if self._keepalive_thread:
+            self._keepalive_thread.join(timeout=5)
+            self._keepalive_thread = None
+
+    def _keepalive_loop(self, interval: float):
+        check_every = min(30.0, interval / 2)
+        while not self._keepalive_stop.wait(check_every):
+            if time.monotonic() - self._last_activity >= interval:
+                self.ping()
+
     def _select_account(self):
         """Seleziona il conto corretto (specificato o preferito)"""
         try:
-            url = f"{self.base_url}/api/v1/accounts"
-            response = self.session.get(url, headers=self._get_headers())
+            response = self._request("account", "GET", "/api/v1/accounts", reauth=False)
             response.raise_for_status()
             data = response.json()
             
@@ -118,22 +848,10 @@ class CapitalTrader:
                 print("⚠️ Nessun conto trovato")
                 return
             
-            # Se è specificato un account_id, cercalo
-            if self.account_id:
-                target_account = next((a for a in accounts if a["accountId"] == self.account_id), None)
-                if target_account:
-                    self._switch_to_account(target_account)
-                    return
-                else:
-                    print(f"⚠️ Account ID {self.account_id} non trovato, uso il preferito")
-            
-            # Altrimenti usa il conto preferito
-            preferred_account = next((a for a in accounts if a.get("preferred", False)), None)
-            if preferred_account:
-                self._switch_to_account(preferred_account)
-            else:
-                # Fallback al primo conto
-                self._switch_to_account(accounts[0])
+            # Se è specificato un account_id, cercalo; altrimenti preferito o primo conto
+            if self.account_id and not any(a.get("accountId") == self.account_id for a in accounts):
+                print(f"⚠️ Account ID {self.account_id} non trovato, uso il preferito")
+            self._switch_to_account(choose_account(accounts, self.account_id))
                 
         except Exception as e:
             print(f"⚠️ Errore selezione conto: {e}")
@@ -145,9 +863,8 @@ class CapitalTrader:
         balance = account.get("balance", {}).get("balance", 0)
         
         try:
-            url = f"{self.base_url}/api/v1/session"
             payload = {"accountId": account_id}
-            response = self.session.put(url, headers=self._get_headers(), json=payload)
+            response = self._request("session", "PUT", "/api/v1/session", reauth=False, json=payload)
             
             if response.status_code == 200:
                 # Aggiorna i token se presenti nella risposta
@@ -159,11 +876,13 @@ class CapitalTrader:
                 print(f"✅ Conto selezionato: {account_name} (€{balance:,.2f})")
                 self.active_account_id = account_id
                 self.active_account_name = account_name
+                self._save_session_cache()
             elif response.status_code == 400 and "not-different" in response.text:
                 # Conto già selezionato - OK
                 print(f"✅ Conto già attivo: {account_name} (€{balance:,.2f})")
                 self.active_account_id = account_id
                 self.active_account_name = account_name
+                self._save_session_cache()
             else:
                 print(f"⚠️ Switch account fallito: {response.status_code} - {response.text}")
                 
@@ -176,38 +895,17 @@ class CapitalTrader:
     
     def get_account_status(self) -> Dict[str, Any]:
         """Get account balance and equity information for the active account"""
-        url = f"{self.base_url}/api/v1/accounts"
         try:
-            response = self.session.get(url, headers=self._get_headers())
-            if response.status_code == 401:
-                print("🔄 Session expired, re-authenticating...")
-                self._authenticate()
-                self._select_account()
-                response = self.session.get(url, headers=self._get_headers())
+            with timing.stage("broker:accounts"):
+                response = self._request("account", "GET", "/api/v1/accounts")
                 
             response.raise_for_status()
             data = response.json()
             accounts = data.get("accounts", [])
             
-            # Trova il conto attivo
-            account = None
-            if hasattr(self, 'active_account_id') and self.active_account_id:
-                account = next((a for a in accounts if a["accountId"] == self.active_account_id), None)
-            
-            # Fallback: conto preferito o primo
-            if not account:
-                account = next((a for a in accounts if a.get("preferred", False)), accounts[0] if accounts else None)
-            
-            if account:
-                return {
-                    "balance": account.get("balance", {}).get("balance", 0),
-                    "equity": account.get("balance", {}).get("equity", 0),
-                    "pnl": account.get("balance", {}).get("profitLoss", 0),
-                    "available": account.get("balance", {}).get("available", 0),
-                    "currency": account.get("currency", "EUR"),
-                    "account_name": account.get("accountName", "Unknown")
-                }
-            return {}
+            # Trova il conto attivo (fallback: conto preferito o primo)
+            account = choose_account(accounts, getattr(self, 'active_account_id', None))
+            return parse_account_summary(account)
         except Exception as e:
             print(f"❌ Error getting account status: {e}")
             return {}
@@ -218,37 +916,14 @@ class CapitalTrader:
     
     def get_open_positions(self) -> List[Dict[str, Any]]:
         """Get all open positions"""
-        url = f"{self.base_url}/api/v1/positions"
         try:
-            response = self.session.get(url, headers=self._get_headers())
-            if response.status_code == 401:
-                self._authenticate()
-                response = self.session.get(url, headers=self._get_headers())
+            with timing.stage("broker:positions"):
+                response = self._request("account", "GET", "/api/v1/positions")
             response.raise_for_status()
             data = response.json()
-            positions = []
-            for item in data.get("positions", []):
-                pos = item.get("position", {})
-                market = item.get("market", {})
-                
-                positions.append({
-                    "dealId": pos.get("dealId"),
-                    "dealReference": pos.get("dealReference"),
-                    "symbol": market.get("epic"),
-                    "direction": pos.get("direction"),
-                    "size": pos.get("size"),
-                    "entry_price": pos.get("level"),
-                    "mark_price": market.get("bid") if pos.get("direction") == "SELL" else market.get("offer"),
-                    "stopLevel": pos.get("stopLevel"),
-                    "profitLevel": pos.get("profitLevel"),
-                    "trailingStop": pos.get("trailingStop"),
-                    "guaranteedStop": pos.get("guaranteedStop"),
-                    "pnl": pos.get("upl"),
-                    "created_at": pos.get("createdDate"),
-                    "leverage": pos.get("leverage"),
-                    "currency": pos.get("currency")
-                })
-            return positions
+            for epic, snapshot in snapshots_from_positions(data).items():
+                self.market_cache.store_snapshot(epic, snapshot)
+            return parse_positions(data)
         except Exception as e:
             print(f"❌ Error getting open positions: {e}")
             return []
@@ -257,61 +932,125 @@ class CapitalTrader:
     #                           MARKET DATA
     # ==========================================================================
     
-    def fetch_candles(self, epic: str, resolution: str = "MINUTE_15", limit: int = 100) -> List[Dict[str, Any]]:
-        """Fetch historical candles for technical analysis"""
-        url = f"{self.base_url}/api/v1/prices/{epic}"
-        params = {"resolution": resolution, "max": limit}
+    def fetch_candles(self, epic: str, resolution: str = "MINUTE_15", limit: int = 100,
+                      from_date: Optional[str] = None, to_date: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Fetch historical candles for technical analysis.
+        from_date / to_date (UTC, "YYYY-MM-DDTHH:MM:SS") limitano la finestra, es. per
+        scaricare solo le barre successive all'ultima già salvata.
+        """
+        data = self._get_prices(epic, build_prices_params(resolution, limit, from_date, to_date))
+        return parse_candles(data) if data is not None else []
+
+    def fetch_candles_columnar(self, epic: str, resolution: str = "MINUTE_15", limit: int = 100,
+                               from_date: Optional[str] = None, to_date: Optional[str] = None) -> CandleBlock:
+        """Come fetch_candles, ma decodificate direttamente in array (vedi candle_block); vuoto in caso di errore"""
+        data = self._get_prices(epic, build_prices_params(resolution, limit, from_date, to_date))
+        return CandleBlock.from_prices(data) if data is not None else CandleBlock.empty()
+
+    def _get_prices(self, epic: str, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         try:
-            response = self.session.get(url, headers=self._get_headers(), params=params)
-            if response.status_code == 401:
-                self._authenticate()
-                response = self.session.get(url, headers=self._get_headers(), params=params)
+            with timing.stage(f"candles:{epic}:{params['resolution']}"):
+                response = self._request("market_data", "GET", f"/api/v1/prices/{epic}", params=params)
             response.raise_for_status()
-            data = response.json()
-            candles = []
-            for price in data.get("prices", []):
-                candles.append({
-                    "timestamp": price.get("snapshotTime"),
-                    "open": price.get("openPrice", {}).get("bid"),
-                    "high": price.get("highPrice", {}).get("bid"),
-                    "low": price.get("lowPrice", {}).get("bid"),
-                    "close": price.get("closePrice", {}).get("bid"),
-                    "volume": price.get("lastTradedVolume", 0)
-                })
-            return candles
+            return response.json()
         except Exception as e:
             print(f"❌ Error fetching candles for {epic}: {e}")
-            return []
+            return None
 
     def get_deal_confirmation(self, deal_reference: str) -> Dict[str, Any]:
         """Get deal confirmation details including dealId from dealReference"""
-        url = f"{self.base_url}/api/v1/confirms/{deal_reference}"
         try:
-            response = self.session.get(url, headers=self._get_headers())
-            if response.status_code == 401:
-                self._authenticate()
-                response = self.session.get(url, headers=self._get_headers())
+            response = self._request("confirm", "GET", f"/api/v1/confirms/{deal_reference}")
             if response.status_code != 200:
                 return {"status": "error", "message": response.text}
             return {"status": "ok", "data": response.json()}
         except Exception as e:
             return {"status": "error", "error": str(e)}
 
-    def get_market_info(self, epic: str) -> Dict[str, Any]:
-        """Get market details and dealing rules for a symbol"""
-        url = f"{self.base_url}/api/v1/markets/{epic}"
+    def wait_for_confirmation(self, deal_reference: str,
+                              deadline: float = CONFIRM_DEADLINE_SECONDS) -> Dict[str, Any]:
+        """Attende l'esito del deal (polling adattivo su /confirms o notify_confirmation)"""
+        return self.confirmations.wait(
+            deal_reference, lambda: self.get_deal_confirmation(deal_reference), deadline
+        )
+
+    def notify_confirmation(self, deal_reference: str, confirmation: Dict[str, Any]):
+        """Conferma ricevuta da fuori (es. streaming): sblocca subito wait_for_confirmation"""
+        self.confirmations.notify(deal_reference, confirmation)
+
+    def get_market_info(self, epic: str, use_cache: bool = True) -> Dict[str, Any]:
+        """
+        Get market details and dealing rules for a symbol.
+        Con use_cache=True restituisce la copia in cache se sia le regole sia lo snapshot sono validi.
+        """
+        if use_cache:
+            cached = self.market_cache.get(epic)
+            if cached is not None:
+                return cached
         try:
-            response = self.session.get(url, headers=self._get_headers())
-            if response.status_code == 401:
-                self._authenticate()
-                response = self.session.get(url, headers=self._get_headers())
+            with timing.stage(f"broker:market:{epic}"):
+                response = self._request("market_data", "GET", f"/api/v1/markets/{epic}")
             if response.status_code != 200:
                 return {}
-            return response.json()
+            data = response.json()
+            self.market_cache.store(epic, data)
+            return data
         except Exception as e:
             print(f"❌ Error getting market info for {epic}: {e}")
             return {}
 
+    def get_dealing_rules(self, epic: str) -> Dict[str, Any]:
+        """{"instrument", "dealingRules"} dalla cache (TTL lungo), con fetch solo se scaduti"""
+        rules = self.market_cache.rules(epic)
+        if rules is None:
+            self.get_market_info(epic, use_cache=False)
+            rules = self.market_cache.rules(epic) or {}
+        return rules
+
+    def get_quotes(self, epics: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Bid/offer/stato di più epic con una sola GET /markets?epics=... (a blocchi di 50).
+        Aggiorna anche la market cache (snapshot e dealing rules). Gli epic richiesti
+        vengono ricordati: le chiamate successive senza argomenti li aggiornano tutti.
+        """
+        for epic in epics or []:
+            if epic not in self.quote_epics:
+                self.quote_epics.append(epic)
+        quotes = {}
+        for i in range(0, len(self.quote_epics), MAX_EPICS_PER_QUOTE_REQUEST):
+            chunk = self.quote_epics[i:i + MAX_EPICS_PER_QUOTE_REQUEST]
+            try:
+                with timing.stage("broker:quotes"):
+                    response = self._request("market_data", "GET", "/api/v1/markets",
+                                             params={"epics": ",".join(chunk)})
+                response.raise_for_status()
+                data = response.json()
+            except Exception as e:
+                print(f"❌ Error getting quotes for {chunk}: {e}")
+                continue
+            for details in data.get("marketDetails", []):
+                epic = details.get("instrument", {}).get("epic")
+                if epic:
+                    self.market_cache.store(epic, details)
+            quotes.update(parse_quotes(data))
+        return quotes
+
+    def get_price_snapshot(self, epic: str, max_age: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Snapshot bid/offer non più vecchio di max_age secondi (default MARKET_SNAPSHOT_TTL_SECONDS).
+        Se scaduto, una sola richiesta batch aggiorna insieme tutti gli epic seguiti.
+        """
+        snapshot = self.market_cache.snapshot(epic, max_age)
+        if snapshot is None:
+            self.get_quotes([epic])
+            snapshot = self.market_cache.snapshot(epic) or {}
+        return snapshot
+
+    def invalidate_market_cache(self, epic: Optional[str] = None, rules: bool = True, snapshot: bool = True):
+        """Forza il prossimo get_market_info/get_dealing_rules/get_price_snapshot a interrogare il broker"""
+        self.market_cache.invalidate(epic, rules=rules, snapshot=snapshot)
+
     # ==========================================================================
     #                           TRADING
     # ==========================================================================
@@ -330,33 +1069,12 @@ class CapitalTrader:
             profit_distance: Optional take profit distance from entry
             trailing_stop: Whether to use trailing stop (requires stop_distance)
         """
-        url = f"{self.base_url}/api/v1/positions"
-        
-        payload = {
-            "epic": epic, 
-            "direction": direction.upper(),
-            "size": size,
-            "guaranteedStop": False
-        }
-        
-        # Add Stop Loss if provided
-        if stop_distance is not None and stop_distance > 0:
-            payload["stopDistance"] = round(stop_distance, 5)
-        
-        # Add Take Profit if provided
-        if profit_distance is not None and profit_distance > 0:
-            payload["profitDistance"] = round(profit_distance, 5)
-        
-        # Add Trailing Stop if requested
-        if trailing_stop and stop_distance is not None:
-            payload["trailingStop"] = True
+        payload = build_order_payload(epic, direction, size, stop_distance, profit_distance, trailing_stop)
         
         try:
             print(f"🚀 Sending {direction} order for {size} {epic} to Capital.com...")
-            response = self.session.post(url, headers=self._get_headers(), json=payload)
-            if response.status_code == 401:
-                self._authenticate()
-                response = self.session.post(url, headers=self._get_headers(), json=payload)
+            with timing.stage(f"order:{epic}"):
+                response = self._request("trading", "POST", "/api/v1/positions", json=payload)
             if response.status_code != 200:
                 print(f"⚠️ Order failed: {response.text}")
                 return {"status": "error", "message": response.text}
@@ -367,16 +1085,33 @@ class CapitalTrader:
             
             # Get dealId from confirmation
             deal_id = None
+            deal_status = None
             if deal_reference:
-                time.sleep(0.5)
-                confirm = self.get_deal_confirmation(deal_reference)
+                with timing.stage(f"order_confirm:{epic}"):
+                    confirm = self.wait_for_confirmation(deal_reference)
                 if confirm.get('status') == 'ok':
-                    deal_id = confirm.get('data', {}).get('dealId')
+                    deal_id = confirmed_deal_id(confirm.get('data', {}))
+                    deal_status = confirm.get('data', {}).get('dealStatus')
+                    if deal_status == "REJECTED":
+                        reason = confirm['data'].get('reason')
+                        print(f"⚠️ Deal {deal_reference} rifiutato: {reason}")
+                        return {
+                            "status": "rejected",
+                            "reason": reason,
+                            "dealReference": deal_reference,
+                            "dealStatus": deal_status,
+                            "confirmation": confirm['data'],
+                            "data": data
+                        }
+                else:
+                    print(f"⚠️ {confirm.get('message', 'Conferma deal non disponibile')}")
             
             return {
                 "status": "ok", 
                 "dealReference": deal_reference,
                 "dealId": deal_id,
+                "dealStatus": deal_status,
+                "confirmation": confirm.get('data') if deal_reference and confirm.get('status') == 'ok' else None,
                 "data": data
             }
         except Exception as e:
@@ -385,13 +1120,10 @@ class CapitalTrader:
 
     def close_position(self, deal_id: str) -> Dict[str, Any]:
         """Close an open position by dealId"""
-        url = f"{self.base_url}/api/v1/positions/{deal_id}"
         try:
             print(f"🗑️ Closing position {deal_id}...")
-            response = self.session.delete(url, headers=self._get_headers())
-            if response.status_code == 401:
-                self._authenticate()
-                response = self.session.delete(url, headers=self._get_headers())
+            with timing.stage("close_position"):
+                response = self._request("trading", "DELETE", f"/api/v1/positions/{deal_id}")
             if response.status_code != 200:
                 print(f"⚠️ Close failed: {response.text}")
                 return {"status": "error", "message": response.text}
@@ -406,25 +1138,10 @@ class CapitalTrader:
                        profit_level: float = None, profit_distance: float = None, 
                        trailing_stop: bool = None) -> Dict[str, Any]:
         """Update stop/profit levels on an existing position"""
-        url = f"{self.base_url}/api/v1/positions/{deal_id}"
-        payload = {}
-        
-        if stop_level is not None:
-            payload["stopLevel"] = stop_level
-        if stop_distance is not None:
-            payload["stopDistance"] = stop_distance
-        if profit_level is not None:
-            payload["profitLevel"] = profit_level
-        if profit_distance is not None:
-            payload["profitDistance"] = profit_distance
-        if trailing_stop is not None:
-            payload["trailingStop"] = trailing_stop
+        payload = build_update_payload(stop_level, stop_distance, profit_level, profit_distance, trailing_stop)
             
         try:
-            response = self.session.put(url, headers=self._get_headers(), json=payload)
-            if response.status_code == 401:
-                self._authenticate()
-                response = self.session.put(url, headers=self._get_headers(), json=payload)
+            response = self._request("trading", "PUT", f"/api/v1/positions/{deal_id}", json=payload)
             if response.status_code != 200:
                 return {"status": "error", "message": response.text}
             data = response.json()
@@ -432,6 +1149,94 @@ class CapitalTrader:
         except Exception as e:
             return {"status": "error", "error": str(e)}
 
+    def close_positions(self, deal_ids: Optional[List[str]] = None, close_reason: str = "Bulk close",
+                        max_workers: int = HTTP_POOL_SIZE) -> Dict[str, Dict[str, Any]]:
+        """
+        Chiude più posizioni in parallelo (tutte quelle aperte se deal_ids è None).
+
+        Le DELETE partono insieme (il rate limiter della lane "trading" le distribuisce)
+        e ogni worker attende la propria conferma, quindi le conferme arrivano in parallelo.
+        Le chiusure confermate aggiornano account_state e vengono registrate in
+        trades_history / real_positions in un'unica transazione.
+
+        Returns:
+            {dealId: {"status": "closed" | "rejected" | "unconfirmed" | "error", ...}}
+        """
+        positions = {p["dealId"]: p for p in self.account_state.positions()}
+        if deal_ids is None:
+            deal_ids = list(positions)
+        deal_ids = list(dict.fromkeys(deal_ids))
+        if not deal_ids:
+            return {}
+
+        def close_one(deal_id: str) -> Dict[str, Any]:
+            result = self.close_position(deal_id)
+            if result.get("status") != "ok":
+                return {"status": "error", "error": result.get("message") or result.get("error")}
+            deal_reference = result.get("dealReference")
+            confirm = self.wait_for_confirmation(deal_reference) if deal_reference else {}
+            if confirm.get("status") != "ok":
+                return {"status": "unconfirmed", "dealReference": deal_reference,
+                        "error": confirm.get("message")}
+            data = confirm.get("data") or {}
+            return {
+                "status": "closed" if data.get("dealStatus") == "ACCEPTED" else "rejected",
+                "dealReference": deal_reference,
+                "level": data.get("level"),
+                "profit": data.get("profit"),
+                "confirmation": data,
+            }
+
+        with timing.stage("close_positions"):
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(deal_ids)))) as pool:
+                results = dict(zip(deal_ids, pool.map(close_one, deal_ids)))
+
+        # Stato del conto: applica le conferme, rilegge al prossimo accesso se qualcosa non torna
+        consistent = True
+        for result in results.values():
+            if result.get("confirmation"):
+                consistent &= self.account_state.apply_confirmation(result["confirmation"])
+            else:
+                consistent = False
+        if not consistent:
+            self.account_state.invalidate()
+
+        closed = []
+        for deal_id, result in results.items():
+            if result["status"] != "closed":
+                continue
+            position = positions.get(deal_id)
+            if position is None:
+                # Posizione non nello stato locale: dati dalla conferma di chiusura
+                confirmation = result["confirmation"]
+                if not (confirmation.get("epic") and confirmation.get("direction") and confirmation.get("size")):
+                    print(f"[CapitalTrader] ⚠️ Chiusura {deal_id} senza dati della posizione: storico non aggiornato")
+                    continue
+                position = {"dealId": deal_id, "symbol": confirmation["epic"],
+                            "direction": confirmation["direction"], "size": confirmation["size"]}
+            position = dict(position)
+            # Prezzo e profitto effettivi della chiusura
+            if result.get("level") is not None:
+                position["mark_price"] = result["level"]
+            if result.get("profit") is not None:
+                position["pnl"] = result["profit"]
+            closed.append(position)
+
+        pending = {d: r["status"] for d, r in results.items() if r["status"] != "closed"}
+        if pending:
+            print(f"[CapitalTrader] ⚠️ {len(pending)} chiusure non riconciliate: "
+                  + ", ".join(f"{d} ({status})" for d, status in pending.items()))
+
+        if closed:
+            try:
+                import db_utils
+                db_utils.log_trades_close(closed, close_reason=close_reason)
+                print(f"[CapitalTrader] 📊 {len(closed)} trade registrati nello storico")
+            except Exception as e:
+                print(f"[CapitalTrader] ⚠️ Errore registrazione storico: {e}")
+
+        return results
+
     # ==========================================================================
     #                     HELPER FOR TRADING-AGENT INTEGRATION
     # ==========================================================================
@@ -460,7 +1265,7 @@ class CapitalTrader:
 
         if op == "close":
             print(f"[CapitalTrader] Market CLOSE per {symbol}")
-            positions = self.get_open_positions()
+            positions = self.account_state.positions()
             position_to_close = None
             deal_id = None
             for p in positions:
@@ -472,28 +1277,41 @@ class CapitalTrader:
             if deal_id:
                 result = self.close_position(deal_id)
                 if result.get('status') == 'ok':
-                    print(f"[CapitalTrader] ✅ Posizione {symbol} chiusa con successo")
+                    with timing.stage("close_confirm"):
+                        confirmation = self._apply_deal_result(result.get("dealReference"))
+                    deal_status = (confirmation or {}).get("dealStatus")
+                    if deal_status == "REJECTED":
+                        reason = confirmation.get("reason")
+                        print(f"[CapitalTrader] ⚠️ Chiusura {symbol} rifiutata: {reason}")
+                        return {"status": "rejected", "reason": reason,
+                                "dealReference": result.get("dealReference"), "confirmation": confirmation}
+
+                    if deal_status == "ACCEPTED":
+                        print(f"[CapitalTrader] ✅ Posizione {symbol} chiusa con successo")
+                        # Prezzo e profitto effettivi della chiusura
+                        position_to_close = dict(position_to_close)
+                        position_to_close["mark_price"] = confirmation.get("level", position_to_close.get("mark_price"))
+                        position_to_close["pnl"] = confirmation.get("profit", position_to_close.get("pnl"))
+                    else:
+                        # Esito sconosciuto: lo storico non si scrive, real_positions viene riletto dal broker
+                        print(f"[CapitalTrader] ⚠️ Chiusura {symbol} non confermata: storico non aggiornato")
+                        position_to_close = None
                     
                     # Registra il trade chiuso nello storico
                     if position_to_close:
                         try:
                             import db_utils
-                            db_utils.log_trade_close_from_position(
-                                position_to_close, 
-                                close_reason=order_json.get("reason", "AI decision")
-                            )
+                            with timing.stage("db:log_trade_close"):
+                                db_utils.log_trade_close_from_position(
+                                    position_to_close, 
+                                    close_reason=order_json.get("reason", "AI decision")
+                                )
                             print(f"[CapitalTrader] 📊 Trade registrato nello storico")
                         except Exception as e:
                             print(f"[CapitalTrader] ⚠️ Errore registrazione storico: {e}")
                     
                     # Sincronizza real_positions con Capital.com
-                    try:
-                        import db_utils
-                        updated_positions = self.get_open_positions()
-                        db_utils.sync_real_positions(updated_positions)
-                        print(f"[CapitalTrader] 🔄 real_positions sincronizzato")
-                    except Exception as e:
-                        print(f"[CapitalTrader] ⚠️ Errore sync real_positions: {e}")
+                    self._sync_real_positions()
                 else:
                     print(f"[CapitalTrader] ⚠️ Chiusura fallita: {result}")
                 return result
@@ -502,36 +1320,25 @@ class CapitalTrader:
                 return {"status": "skipped", "message": "No position to close"}
 
         if op == "open":
-            # Get account balance
-            account = self.get_account_status()
-            balance = account.get("balance", 0)
-            
-            if balance <= 0:
-                return {"status": "error", "message": "No balance available"}
-            
-            # Get market info for price
-            market_info = self.get_market_info(epic)
-            snapshot = market_info.get("snapshot", {})
-            current_price = snapshot.get("offer") if direction == "long" else snapshot.get("bid")
-            
-            if not current_price:
-                return {"status": "error", "message": "Could not get current price"}
-            
-            # Calculate size based on portion and leverage
-            # For crypto: size is in units of the asset
-            notional = balance * portion * leverage
-            size = notional / current_price
-            
-            # Round size according to dealing rules
-            dealing_rules = market_info.get("dealingRules", {})
-            min_size = dealing_rules.get("minDealSize", {}).get("value", 0.0001)
-            
-            # Ensure size meets minimum
-            if size < min_size:
-                size = min_size
-            
-            # Round to appropriate decimals for crypto
-            size = round(size, 4)  # 4 decimals for crypto
+            with timing.stage("signal:sizing"):
+                # Saldo dallo stato del ciclo (già letto per il prompt)
+                account = self.account_state.account()
+                balance = account.get("balance", 0)
+                
+                if balance <= 0:
+                    return {"status": "error", "message": "No balance available"}
+                
+                # Prezzo (snapshot recente) e dealing rules (cache a TTL lungo): al massimo una GET /markets
+                snapshot = self.get_price_snapshot(epic)
+                current_price = snapshot.get("offer") if direction == "long" else snapshot.get("bid")
+                
+                if not current_price:
+                    return {"status": "error", "message": "Could not get current price"}
+                
+                # Calculate size based on portion and leverage, rounded according to dealing rules
+                dealing_rules = self.get_dealing_rules(epic).get("dealingRules", {})
+                min_size = dealing_rules.get("minDealSize", {}).get("value", 0.0001)
+                size, notional = compute_order_size(balance, portion, leverage, current_price, min_size)
             
             cap_direction = "BUY" if direction == "long" else "SELL"
             
@@ -544,84 +1351,49 @@ class CapitalTrader:
             
             # Sincronizza real_positions dopo apertura
             if result.get('status') == 'ok':
-                try:
-                    import db_utils
-                    # Attendi un attimo che Capital.com aggiorni lo stato
-                    import time
-                    time.sleep(0.5)
-                    updated_positions = self.get_open_positions()
-                    db_utils.sync_real_positions(updated_positions)
-                    print(f"[CapitalTrader] 🔄 real_positions sincronizzato ({len(updated_positions)} posizioni)")
-                except Exception as e:
-                    print(f"[CapitalTrader] ⚠️ Errore sync real_positions: {e}")
+                # execute_order ha già atteso la conferma: aggiorna lo stato senza rileggere /positions
+                if not (result.get("confirmation") and self.account_state.apply_confirmation(result["confirmation"])):
+                    self.account_state.invalidate()
+                self._sync_real_positions()
+            else:
+                # Ordine rifiutato: le regole in cache potrebbero non essere più valide
+                self.invalidate_market_cache(epic)
             
             return result
 
         return {"status": "error", "message": f"Unknown operation: {op}"}
 
+    def _apply_deal_result(self, deal_reference: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Attende la conferma del deal e la applica ad account_state (invalidandolo se non arriva)"""
+        confirm = self.wait_for_confirmation(deal_reference) if deal_reference else {}
+        data = confirm.get("data") if confirm.get("status") == "ok" else None
+        if not (data and self.account_state.apply_confirmation(data)):
+            self.account_state.invalidate()
+        return data
+
+    def _sync_real_positions(self):
+        try:
+            import db_utils
+            with timing.stage("db:sync_real_positions"):
+                positions = self.account_state.positions()
+                db_utils.sync_real_positions(positions)
+            print(f"[CapitalTrader] 🔄 real_positions sincronizzato ({len(positions)} posizioni)")
+        except Exception as e:
+            print(f"[CapitalTrader] ⚠️ Errore sync real_positions: {e}")
+
+    def invalidate_account_state(self):
+        """Il prossimo accesso a saldo/posizioni (es. a inizio ciclo) rilegge /accounts e /positions"""
+        self.account_state.invalidate()
+
     def _map_symbol_to_epic(self, symbol: str) -> str:
         """Map common symbol names to Capital.com EPICs"""
-        mapping = {
-            "BTC": "BTCUSD",
-            "BTCUSD": "BTCUSD",
-            "ETH": "ETHUSD",
-            "ETHUSD": "ETHUSD",
-            "SOL": "SOLUSD",
-            "SOLUSD": "SOLUSD",
-        }
-        return mapping.get(symbol.upper(), symbol.upper())
+        return map_symbol_to_epic(symbol)
 
     def get_account_status_formatted(self) -> Dict[str, Any]:
         """
         Get account status in the same format as HyperLiquidTrader
-        for compatibility with main.py
+        for compatibility with main.py.
+        Usa account_state: una sola lettura dal broker finché lo stato non viene invalidato.
         """
-        account = self.get_account_status()
-        positions = self.get_open_positions()
-        
-        formatted_positions = []
-        for pos in positions:
-            # Reverse map epic to symbol
-            epic = pos.get('epic', pos.get('symbol', ''))
-            symbol = epic.replace("USD", "") if epic.endswith("USD") else epic
-            
-            # Calcola PnL percentuale
-            entry_price = pos.get('entry_price') or pos.get('openLevel') or 0
-            mark_price = pos.get('mark_price') or pos.get('currentLevel') or 0
-            pnl_pct = 0
-            if entry_price and mark_price and entry_price != 0:
-                price_diff = mark_price - entry_price
-                if pos.get('direction') == 'SELL':
-                    price_diff = -price_diff
-                pnl_pct = (price_diff / entry_price) * 100
-            
-            formatted_positions.append({
-                "deal_id": pos.get('dealId'),  # Capital.com deal ID
-                "symbol": symbol,
-                "epic": epic,
-                "side": "long" if pos.get('direction') == "BUY" else "short",
-                "direction": pos.get('direction', 'BUY'),
-                "size": pos.get('size', 0),
-                "entry_price": entry_price,
-                "mark_price": mark_price,
-                "openLevel": pos.get('openLevel'),
-                "currentLevel": pos.get('currentLevel'),
-                "pnl_usd": pos.get('pnl') or pos.get('profit') or 0,
-                "pnl_pct": pnl_pct,  # Aggiunto per anti-overtrading
-                "profit": pos.get('profit') or pos.get('pnl') or 0,
-                "stopLevel": pos.get('stopLevel'),
-                "limitLevel": pos.get('limitLevel'),
-                "leverage": "N/A (CFD)",
-                "opened_at": pos.get('created_at'),  # Aggiunto per anti-overtrading
-            })
-        
-        return {
-            "balance_usd": account.get("balance", 0),
-            "equity": account.get("equity", 0),
-            "available": account.get("available", 0),
-            "pnl": account.get("pnl", 0),
-            "currency": account.get("currency", "EUR"),
-            "account_name": account.get("account_name", "Unknown"),
-            "positions": formatted_positions,
-            "open_positions": formatted_positions,  # Keep both for compatibility
-        }
+        _, account, positions = self.account_state.get()
+        return format_account_status(account, mark_positions(positions, self.market_cache))
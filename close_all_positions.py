@@ -1,4 +1,4 @@
-"""Script per chiudere tutte le posizioni aperte"""
+"""Script per chiudere tutte le posizioni aperte (chiusure e conferme in parallelo)"""
 import os
 from dotenv import load_dotenv
 from capital_trader import CapitalTrader
@@ -18,28 +18,27 @@ bot = CapitalTrader(
     account_id='299530594022675614'  # Conto solo Crypto
 )
 
-positions = bot.get_open_positions()
+positions = {p.get('dealId'): p for p in bot.get_open_positions()}
 
 if not positions:
     print("\n✅ Nessuna posizione aperta!")
 else:
     print(f"\n📊 Trovate {len(positions)} posizioni da chiudere:")
-    
-    for p in positions:
-        symbol = p.get('symbol', 'N/A')
-        direction = p.get('direction', 'N/A')
-        pnl = p.get('pnl', 0)
-        deal_id = p.get('dealId')
-        
-        print(f"\n⚡ Chiusura {symbol} {direction} (PnL: {pnl})...")
-        result = bot.close_position(deal_id)
-        
-        if result.get('status') == 'ok':
-            print(f"   ✅ Chiusa con successo!")
+    for p in positions.values():
+        print(f"  {p.get('symbol', 'N/A')} {p.get('direction', 'N/A')} (PnL: {p.get('pnl', 0)})")
+
+    print(f"\n⚡ Chiusura in parallelo...")
+    results = bot.close_positions(list(positions), close_reason="close_all_positions")
+
+    for deal_id, result in results.items():
+        p = positions.get(deal_id, {})
+        label = f"{p.get('symbol', 'N/A')} {p.get('direction', 'N/A')}"
+        if result.get('status') == 'closed':
+            print(f"   ✅ {label} chiusa a {result.get('level')} (PnL: {result.get('profit')})")
         else:
-            print(f"   ❌ Errore: {result}")
+            print(f"   ❌ {label}: {result.get('status')} {result.get('error') or ''}")
 
-# Verifica finale
+# Verifica finale (lettura fresca dal broker, non dallo stato locale)
 print("\n" + "="*60)
 print("VERIFICA FINALE")
 print("="*60)
@@ -0,0 +1,206 @@
+"""
+Feature cross-asset per tutti i ticker insieme: correlazioni dei rendimenti,
+beta rispetto a BTC e regime di volatilità.
+
+I rendimenti logaritmici delle barre chiuse vengono allineati per timestamp in
+un unico vettore per barra (un elemento per ticker) e accumulati in somme mobili
+(vettore delle somme e matrice dei prodotti incrociati), quindi ogni nuova barra
+costa O(n_ticker²) e correlazioni, beta e volatilità sono operazioni matriciali
+sullo stesso array. Le barre arrivano dalle righe di IndicatorEngine: nessuna
+candela in più da scaricare, e dopo un riavvio lo stato si ricostruisce dalle
+righe salvate nel checkpoint degli indicatori.
+"""
+import math
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from bar_aggregator import RESOLUTION_SECONDS, parse_bar_time
+
+# Barre per correlazioni, beta e volatilità di lungo periodo (12 ore a 15m)
+CROSS_ASSET_WINDOW = 48
+# Barre per la volatilità recente (3 ore a 15m)
+VOL_SHORT_WINDOW = 12
+# Rapporto vol recente / vol lunga sotto/sopra il quale il regime è "low"/"high"
+REGIME_LOW_RATIO = 0.75
+REGIME_HIGH_RATIO = 1.33
+# Rendimenti minimi nella finestra lunga prima di pubblicare le feature
+MIN_RETURNS = 2 * VOL_SHORT_WINDOW
+
+
+class RollingMoments:
+    """Somme mobili (Σr e Σr·rᵀ) degli ultimi `window` vettori di rendimenti"""
+
+    def __init__(self, window: int, size: int):
+        self.window = window
+        self.buffer = np.zeros((window, size))
+        self.count = 0
+        self.pos = 0
+        self.sum = np.zeros(size)
+        self.cross = np.zeros((size, size))
+        self._since_rebuild = 0
+
+    def push(self, r: np.ndarray):
+        if self.count == self.window:
+            old = self.buffer[self.pos]
+            self.sum -= old
+            self.cross -= np.outer(old, old)
+        else:
+            self.count += 1
+        self.buffer[self.pos] = r
+        self.sum += r
+        self.cross += np.outer(r, r)
+        self.pos = (self.pos + 1) % self.window
+
+        # Ricalcolo esatto periodico: le sottrazioni accumulano errori di arrotondamento
+        self._since_rebuild += 1
+        if self._since_rebuild >= self.window:
+            data = self.buffer[:self.count]
+            self.sum = data.sum(axis=0)
+            self.cross = data.T @ data
+            self._since_rebuild = 0
+
+    def covariance(self) -> np.ndarray:
+        """Matrice di covarianza campionaria (ddof=1)"""
+        n = self.count
+        mean = self.sum / n
+        return (self.cross - n * np.outer(mean, mean)) / (n - 1)
+
+
+class CrossAssetFeatures:
+    """
+    Stato delle feature cross-asset per una lista fissa di ticker.
+
+    update(ticker, rows) con le righe chiuse di IndicatorEngine (timestamp, close);
+    una barra entra nelle statistiche quando è arrivata per tutti i ticker, e il
+    rendimento che scavalca barre mancanti non viene usato.
+    features() restituisce correlazioni, beta e regimi; format_output() il testo per il prompt.
+    """
+
+    def __init__(self, tickers: List[str], benchmark: str = "BTC", resolution: str = "MINUTE_15",
+                 window: int = CROSS_ASSET_WINDOW, short_window: int = VOL_SHORT_WINDOW):
+        self.tickers = list(dict.fromkeys(t.upper() for t in tickers))
+        self.benchmark = benchmark.upper()
+        self.resolution = resolution
+        self.long = RollingMoments(window, len(self.tickers))
+        self.short = RollingMoments(short_window, len(self.tickers))
+        self.last_ts: Optional[float] = None
+        self._prev_closes: Optional[np.ndarray] = None
+        self._pending: Dict[float, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def update(self, ticker: str, rows: List[Dict[str, Any]]):
+        """Registra le barre chiuse di un ticker (solo quelle successive all'ultima barra allineata)"""
+        ticker = ticker.upper()
+        if ticker not in self.tickers:
+            return
+        with self._lock:
+            for row in rows:
+                if not row.get("timestamp") or not row.get("close"):
+                    continue
+                ts = parse_bar_time(row["timestamp"])
+                if self.last_ts is None or ts > self.last_ts:
+                    self._pending.setdefault(ts, {})[ticker] = row["close"]
+            self._advance()
+
+    def _advance(self):
+        """Applica in ordine le barre complete; quelle incomplete più vecchie vengono scartate"""
+        seconds = RESOLUTION_SECONDS.get(self.resolution, 900)
+        if self._pending:
+            # Un ticker che continua a fallire non deve far crescere le barre in attesa. Si tengono
+            # due finestre: al primo caricamento gli altri ticker devono ancora arrivare e qualche
+            # barra può mancare, ma più indietro le barre non entrerebbero comunque nelle statistiche
+            horizon = max(self._pending) - 2 * self.long.window * seconds
+            self._pending = {ts: c for ts, c in self._pending.items() if ts >= horizon}
+        complete = [ts for ts, closes in self._pending.items() if len(closes) == len(self.tickers)]
+        if not complete:
+            return
+        for ts in sorted(complete):
+            closes = self._pending[ts]
+            vector = np.array([closes[t] for t in self.tickers])
+            if self._prev_closes is not None and ts - self.last_ts > seconds:
+                # Barre mancanti: il rendimento che le scavalca non è su una barra, si riparte da qui
+                self._prev_closes = None
+            if self._prev_closes is not None:
+                returns = np.log(vector / self._prev_closes)
+                self.long.push(returns)
+                self.short.push(returns)
+            self._prev_closes = vector
+            self.last_ts = ts
+        self._pending = {ts: c for ts, c in self._pending.items() if ts > self.last_ts}
+
+    def features(self) -> Optional[Dict[str, Any]]:
+        """Correlazioni, beta verso il benchmark e regime di volatilità (None se pochi dati)"""
+        with self._lock:
+            if self.long.count < MIN_RETURNS or self.short.count < 2:
+                return None
+            cov = self.long.covariance()
+            short_var = np.diag(self.short.covariance())
+
+        long_var = np.diag(cov)
+        std = np.sqrt(long_var)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            corr = cov / np.outer(std, std)
+            ratio = np.sqrt(short_var) / std
+        bars_per_year = 365 * 24 * 3600 / RESOLUTION_SECONDS.get(self.resolution, 900)
+        b = self.tickers.index(self.benchmark) if self.benchmark in self.tickers else None
+
+        result = {
+            "window_bars": self.long.count,
+            "short_window_bars": self.short.count,
+            "correlations": {t: {u: _clean(corr[i, j]) for j, u in enumerate(self.tickers)}
+                             for i, t in enumerate(self.tickers)},
+            "beta_to_benchmark": {},
+            "volatility": {},
+        }
+        for i, ticker in enumerate(self.tickers):
+            if b is not None and long_var[b] > 0:
+                result["beta_to_benchmark"][ticker] = _clean(cov[i, b] / long_var[b])
+            result["volatility"][ticker] = {
+                "short_annualized_pct": _clean(math.sqrt(short_var[i] * bars_per_year) * 100),
+                "long_annualized_pct": _clean(std[i] * math.sqrt(bars_per_year) * 100),
+                "regime": regime_label(ratio[i]),
+            }
+        return result
+
+    def format_output(self, features: Dict[str, Any]) -> str:
+        tickers = self.tickers
+        output = "\n<cross_asset>\n"
+        output += f"Return correlations ({self.resolution}, last {features['window_bars']} bars):\n"
+        output += "      " + "".join(f"{t:>8}" for t in tickers) + "\n"
+        for t in tickers:
+            row = features["correlations"][t]
+            output += f"{t:<6}" + "".join(f"{_fmt(row[u], 2):>8}" for u in tickers) + "\n"
+        betas = [f"{t} {_fmt(v, 2)}" for t, v in features["beta_to_benchmark"].items() if t != self.benchmark]
+        if betas:
+            output += f"Beta to {self.benchmark}: " + ", ".join(betas) + "\n"
+        output += (f"Volatility regime (annualized realized vol, last {features['short_window_bars']} "
+                   f"vs {features['window_bars']} bars):\n")
+        for t in tickers:
+            vol = features["volatility"][t]
+            output += (f"{t}: {vol['regime']} ({_fmt(vol['short_annualized_pct'], 1)}% vs "
+                       f"{_fmt(vol['long_annualized_pct'], 1)}%)\n")
+        output += "</cross_asset>\n"
+        return output
+
+
+def regime_label(ratio: float) -> str:
+    """Vol recente rispetto a quella della finestra lunga"""
+    if ratio is None or not np.isfinite(ratio):
+        return "unknown"
+    if ratio < REGIME_LOW_RATIO:
+        return "low"
+    if ratio > REGIME_HIGH_RATIO:
+        return "high"
+    return "normal"
+
+
+def _clean(value: float) -> Optional[float]:
+    """float JSON-friendly (None al posto di NaN/inf)"""
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+
+def _fmt(value: Optional[float], digits: int) -> str:
+    return "N/A" if value is None else f"{value:.{digits}f}"
@@ -5,9 +5,11 @@ from contextlib import contextmanager
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from typing import Any, Dict, List, Optional
+import threading
 import traceback
 import psycopg2
-from psycopg2.extras import Json
+import psycopg2.extensions
+from psycopg2.extras import Json, execute_values
 from dotenv import load_dotenv
 
 # Import opzionale di numpy per gestire tipi np.float64 / np.int64, ecc.
@@ -41,13 +43,68 @@ def get_db_config() -> DBConfig:
     return DBConfig(dsn=dsn)
 
 
+# Connessione persistente opzionale (daemon mode): evita un connect per ogni scrittura
+_persistent_conn = None
+_persistent_enabled = False
+_persistent_lock = threading.RLock()
+
+
+def enable_persistent_connection() -> None:
+    """Riusa una sola connessione PostgreSQL per tutte le chiamate successive.
+
+    Pensato per i processi long-running (main.py --daemon). La connessione viene
+    aperta al primo uso e riaperta automaticamente se il server la chiude.
+    """
+
+    global _persistent_enabled
+    _persistent_enabled = True
+
+
+def close_persistent_connection() -> None:
+    """Chiude la connessione persistente e torna a una connessione per chiamata."""
+
+    global _persistent_conn, _persistent_enabled
+    with _persistent_lock:
+        _persistent_enabled = False
+        if _persistent_conn is not None:
+            try:
+                _persistent_conn.close()
+            except Exception:
+                pass
+            _persistent_conn = None
+
+
 @contextmanager
 def get_connection():
     """Context manager che restituisce una connessione PostgreSQL.
 
-    Usa il DSN in DATABASE_URL.
+    Usa il DSN in DATABASE_URL. Se la connessione persistente è abilitata,
+    restituisce sempre la stessa connessione (serializzando l'accesso tra thread)
+    e fa rollback delle transazioni lasciate a metà da un errore.
     """
 
+    global _persistent_conn
+
+    if _persistent_enabled:
+        with _persistent_lock:
+            if _persistent_conn is None or _persistent_conn.closed:
+                _persistent_conn = psycopg2.connect(get_db_config().dsn)
+            conn = _persistent_conn
+            try:
+                yield conn
+            except Exception:
+                try:
+                    conn.rollback()
+                except Exception:
+                    # Connessione rotta: verrà riaperta alla prossima chiamata
+                    _persistent_conn = None
+                raise
+            else:
+                # Nessun commit esplicito (sola lettura): chiudi la transazione aperta
+                if conn.status != psycopg2.extensions.STATUS_READY:
+                    conn.rollback()
+        return
+
     config = get_db_config()
     conn = psycopg2.connect(config.dsn)
     try:
@@ -165,12 +222,32 @@ CREATE TABLE IF NOT EXISTS bot_operations (
     target_portion_of_balance NUMERIC(10, 4),
     leverage            NUMERIC(10, 4),
     pnl_usd             NUMERIC(30, 10),
+    bar_close_at        TIMESTAMPTZ,
+    decision_lag_ms     NUMERIC(20, 3),
     raw_payload         JSONB NOT NULL
 );
 
 CREATE INDEX IF NOT EXISTS idx_bot_operations_created_at
     ON bot_operations(created_at);
 
+-- Durata di ogni fase del ciclo (auth, candele, indicatori, Prophet, Gemini, ordini, DB)
+CREATE TABLE IF NOT EXISTS cycle_stage_timings (
+    id                  BIGSERIAL PRIMARY KEY,
+    created_at          TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    operation_id        BIGINT REFERENCES bot_operations(id) ON DELETE CASCADE,
+    stage               TEXT NOT NULL,
+    started_offset_ms   NUMERIC(20, 3),
+    duration_ms         NUMERIC(20, 3) NOT NULL,
+    success             BOOLEAN NOT NULL DEFAULT TRUE,
+    thread_name         TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_cycle_stage_timings_operation_id
+    ON cycle_stage_timings(operation_id);
+
+CREATE INDEX IF NOT EXISTS idx_cycle_stage_timings_stage_created_at
+    ON cycle_stage_timings(stage, created_at);
+
 CREATE TABLE IF NOT EXISTS errors (
     id              BIGSERIAL PRIMARY KEY,
     created_at      TIMESTAMPTZ NOT NULL DEFAULT NOW(),
@@ -325,6 +402,10 @@ END$$;
 
 ALTER TABLE bot_operations
     ADD COLUMN IF NOT EXISTS pnl_usd NUMERIC(30, 10);
+
+ALTER TABLE bot_operations
+    ADD COLUMN IF NOT EXISTS bar_close_at TIMESTAMPTZ,
+    ADD COLUMN IF NOT EXISTS decision_lag_ms NUMERIC(20, 3);
 """
 
 
@@ -556,6 +637,8 @@ def log_bot_operation(
     news_text: Optional[str] = None,
     sentiment: Optional[Any] = None,
     forecasts: Optional[Any] = None,
+    bar_close_at: Optional[datetime] = None,
+    decision_lag_ms: Optional[float] = None,
 ) -> int:
     """Logga un'operazione del bot e tutti gli input associati.
 
@@ -584,6 +667,8 @@ def log_bot_operation(
     - news_text: testo con le news rilevanti
     - sentiment: dict (o stringa JSON), es: {"valore": 16, "classificazione": "Extreme fear", ...}
     - forecasts: lista/dict (o stringa JSON) con i forecast per ticker/timeframe
+    - bar_close_at: chiusura della barra che ha fatto partire il ciclo (scheduler)
+    - decision_lag_ms: millisecondi tra la chiusura della barra e la decisione dell'AI
 
     Restituisce l'ID dell'operazione creata.
     """
@@ -736,7 +821,7 @@ def log_bot_operation(
                                     _to_plain_number(derivatives.get("open_interest_latest")),
                                     _to_plain_number(derivatives.get("open_interest_average")),
                                     _to_plain_number(derivatives.get("funding_rate")),
-                                    _to_plain_number(lt15.get("ema_20_current")),
+                                    _to_plain_number(lt15.get("ema_20_current", current.get("ema20"))),
                                     _to_plain_number(lt15.get("ema_50_current")),
                                     _to_plain_number(lt15.get("atr_3_current")),
                                     _to_plain_number(lt15.get("atr_14_current")),
@@ -847,9 +932,11 @@ def log_bot_operation(
                     target_portion_of_balance,
                     leverage,
                     pnl_usd,
+                    bar_close_at,
+                    decision_lag_ms,
                     raw_payload
                 )
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
                 RETURNING id;
                 """,
                 (
@@ -860,6 +947,8 @@ def log_bot_operation(
                     target_portion_of_balance,
                     leverage,
                     _to_plain_number(pnl_usd),
+                    bar_close_at,
+                    _to_plain_number(decision_lag_ms),
                     Json(operation_payload),
                 ),
             )
@@ -872,6 +961,56 @@ def log_bot_operation(
 
 
 
+def log_stage_timings(operation_id: Optional[int], timings: List[Dict[str, Any]]) -> int:
+    """Salva le durate delle fasi di un ciclo in `cycle_stage_timings`.
+
+    Parametri:
+    - operation_id: id della riga `bot_operations` del ciclo (None se il ciclo è
+      fallito prima del logging dell'operazione)
+    - timings: lista di dict prodotti da timing.CycleTimer, es:
+        {"stage": "gemini", "started_offset_ms": 8123.4, "duration_ms": 14210.7,
+         "success": True, "thread_name": "MainThread"}
+
+    Restituisce il numero di righe inserite.
+    """
+
+    if not timings:
+        return 0
+
+    rows = [
+        (
+            operation_id,
+            t.get("stage"),
+            _to_plain_number(t.get("started_offset_ms")),
+            _to_plain_number(t.get("duration_ms")),
+            bool(t.get("success", True)),
+            t.get("thread_name"),
+        )
+        for t in timings
+    ]
+
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            execute_values(
+                cur,
+                """
+                INSERT INTO cycle_stage_timings (
+                    operation_id,
+                    stage,
+                    started_offset_ms,
+                    duration_ms,
+                    success,
+                    thread_name
+                )
+                VALUES %s;
+                """,
+                rows,
+            )
+        conn.commit()
+
+    return len(rows)
+
+
 # =====================
 # Funzioni di lettura (facoltative ma utili)
 # =====================
@@ -1054,6 +1193,28 @@ def log_trade_close(deal_id: str, close_reason: str = None) -> Optional[int]:
             return None
 
 
+def _trade_close_row(position: Dict[str, Any], close_reason: Optional[str]) -> tuple:
+    """Valori per trades_history a partire dai dati della posizione chiusa"""
+    deal_id = position.get('dealId') or position.get('deal_id')
+    symbol = position.get('symbol') or position.get('epic', 'UNKNOWN')
+    direction = position.get('direction', 'BUY')
+    size = float(position.get('size', 0))
+    entry_price = float(position.get('entry_price') or position.get('openLevel', 0))
+    close_price = float(position.get('mark_price') or position.get('currentLevel', 0))
+    pnl_usd = float(position.get('pnl') or position.get('profit', 0))
+    
+    # Calcola pnl_pct
+    pnl_pct = None
+    if entry_price and close_price and entry_price != 0:
+        price_diff = close_price - entry_price
+        if direction.upper() in ('SELL', 'SHORT'):
+            price_diff = -price_diff
+        pnl_pct = (price_diff / entry_price) * 100
+    
+    return (deal_id, symbol, direction, size, entry_price, close_price,
+            pnl_usd, pnl_pct, close_reason or 'AI decision')
+
+
 def log_trade_close_from_position(position: Dict[str, Any], close_reason: str = None) -> Optional[int]:
     """
     Registra la chiusura di un trade direttamente dai dati della posizione.
@@ -1068,22 +1229,8 @@ def log_trade_close_from_position(position: Dict[str, Any], close_reason: str =
     """
     with get_connection() as conn:
         with conn.cursor() as cur:
-            # Estrai i dati dalla posizione
-            deal_id = position.get('dealId') or position.get('deal_id')
-            symbol = position.get('symbol') or position.get('epic', 'UNKNOWN')
-            direction = position.get('direction', 'BUY')
-            size = float(position.get('size', 0))
-            entry_price = float(position.get('entry_price') or position.get('openLevel', 0))
-            close_price = float(position.get('mark_price') or position.get('currentLevel', 0))
-            pnl_usd = float(position.get('pnl') or position.get('profit', 0))
-            
-            # Calcola pnl_pct
-            pnl_pct = None
-            if entry_price and close_price and entry_price != 0:
-                price_diff = close_price - entry_price
-                if direction.upper() in ('SELL', 'SHORT'):
-                    price_diff = -price_diff
-                pnl_pct = (price_diff / entry_price) * 100
+            values = _trade_close_row(position, close_reason)
+            deal_id = values[0]
             
             # Inserisci in trades_history
             cur.execute(
@@ -1094,8 +1241,7 @@ def log_trade_close_from_position(position: Dict[str, Any], close_reason: str =
                 VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW(), %s)
                 RETURNING id
                 """,
-                (deal_id, symbol, direction, size, entry_price, close_price,
-                 pnl_usd, pnl_pct, close_reason or 'AI decision')
+                values
             )
             row = cur.fetchone()
             
@@ -1112,6 +1258,44 @@ def log_trade_close_from_position(position: Dict[str, Any], close_reason: str =
             return None
 
 
+def log_trades_close(positions: List[Dict[str, Any]], close_reason: str = None) -> List[int]:
+    """
+    Come log_trade_close_from_position ma per più posizioni chiuse insieme
+    (es. CapitalTrader.close_positions): inserimento in trades_history e rimozione
+    da real_positions in un'unica transazione.
+    
+    Le chiusure già registrate (stesso deal_id) vengono saltate.
+
+    Returns:
+        ID dei record creati in trades_history
+    """
+    if not positions:
+        return []
+    rows = [_trade_close_row(p, close_reason) for p in positions]
+    deal_ids = [r[0] for r in rows if r[0]]
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            inserted = execute_values(
+                cur,
+                """
+                INSERT INTO trades_history 
+                    (deal_id, symbol, direction, size, entry_price, close_price, 
+                     pnl_usd, pnl_pct, close_reason)
+                VALUES %s
+                ON CONFLICT (deal_id) DO NOTHING
+                RETURNING id
+                """,
+                rows,
+                fetch=True,
+            )
+            if deal_ids:
+                cur.execute("DELETE FROM real_positions WHERE deal_id = ANY(%s)", (deal_ids,))
+        conn.commit()
+    ids = [row[0] for row in inserted]
+    print(f"[db_utils] {len(ids)} trade chiusi registrati")
+    return ids
+
+
 if __name__ == "__main__":
     init_db()
 
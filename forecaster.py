@@ -1,6 +1,9 @@
 import pandas as pd
 from datetime import datetime, timezone, timedelta
 from prophet import Prophet
+
+import timing
+from candle_block import fetch_block
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -8,25 +11,24 @@ warnings.filterwarnings('ignore')
 class CryptoForecaster:
     """Forecaster che usa Capital.com per i dati di prezzo"""
     
-    def __init__(self, capital_client=None):
+    def __init__(self, capital_client=None, candle_source=None):
         self.capital_client = capital_client
+        # Sorgente candele opzionale (es. CandleProvider condiviso con indicators)
+        self.candle_source = candle_source or capital_client
         self.last_prices = {}
 
     def _fetch_candles_capital(self, epic: str, resolution: str, limit: int) -> pd.DataFrame:
         """Fetch candles da Capital.com"""
-        if not self.capital_client:
+        if not self.candle_source:
             raise RuntimeError("Capital.com client not provided")
         
-        candles = self.capital_client.fetch_candles(epic, resolution=resolution, limit=limit)
+        block = fetch_block(self.candle_source, epic, resolution, limit)
         
-        if not candles:
+        if not block:
             raise RuntimeError(f"No candles for {epic} {resolution}")
         
-        df = pd.DataFrame(candles)
-        df["ds"] = pd.to_datetime(df["timestamp"])
-        df["y"] = df["close"].astype(float)
-        df = df[["ds", "y"]].sort_values("ds").reset_index(drop=True)
-        return df
+        # Prophet vuole ds senza fuso orario; y è una vista sui prezzi del blocco
+        return pd.DataFrame({"ds": pd.to_datetime(block.timestamp, unit="s"), "y": block.close}, copy=False)
 
     def _map_ticker_to_epic(self, ticker: str) -> str:
         """Mappa ticker a Capital.com EPIC"""
@@ -61,11 +63,12 @@ class CryptoForecaster:
         # Memorizza l'ultimo prezzo
         last_price = df["y"].iloc[-1]
 
-        model = Prophet(daily_seasonality=True, weekly_seasonality=True)
-        model.fit(df)
+        with timing.stage(f"prophet_fit:{ticker}:{interval}"):
+            model = Prophet(daily_seasonality=True, weekly_seasonality=True)
+            model.fit(df)
 
-        future = model.make_future_dataframe(periods=1, freq=freq)
-        forecast = model.predict(future)
+            future = model.make_future_dataframe(periods=1, freq=freq)
+            forecast = model.predict(future)
 
         return forecast.tail(1)[["ds", "yhat", "yhat_lower", "yhat_upper"]], last_price
 
@@ -106,16 +109,17 @@ class CryptoForecaster:
         return results
 
 
-def get_crypto_forecasts(tickers=['BTC', 'ETH', 'SOL'], testnet=True, capital_client=None):
+def get_crypto_forecasts(tickers=['BTC', 'ETH', 'SOL'], testnet=True, capital_client=None, candle_source=None):
     """
     Funzione principale per generare forecasts.
-    Richiede capital_client per funzionare.
+    Richiede capital_client per funzionare; candle_source (opzionale) sostituisce
+    il client come sorgente delle candele.
     """
     if capital_client is None:
         return "Forecasts non disponibili (capital_client non fornito)", "[]"
     
     try:
-        forecaster = CryptoForecaster(capital_client=capital_client)
+        forecaster = CryptoForecaster(capital_client=capital_client, candle_source=candle_source)
         results = forecaster.forecast_many(tickers)
         
         df = pd.DataFrame(results)
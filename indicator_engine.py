@@ -0,0 +1,338 @@
+"""
+Indicatori tecnici incrementali (EMA, RSI, MACD, ATR) per (epic, resolution).
+
+Lo stato di ogni indicatore viene aggiornato in O(1) per ogni nuova barra chiusa,
+quindi il costo per ciclo non dipende più dalla lunghezza della finestra: dopo il
+primo riscaldamento basta passare le barre nuove. Lo stato può essere salvato su
+file (checkpoint) e ricaricato al riavvio.
+
+Le formule sono quelle della libreria `ta` usata in indicators.py:
+- EMA: ewm(span=n, adjust=False), seme = primo valore, valida dopo n valori
+- RSI: medie di Wilder (alpha=1/n) di rialzi/ribassi, 100 se non ci sono ribassi
+- MACD: EMA12 - EMA26, segnale EMA9 della linea MACD, istogramma = differenza
+- ATR: prima media semplice del true range su n barre, poi smoothing di Wilder
+Riscaldato sulla stessa finestra, il motore restituisce gli stessi valori di `ta`.
+"""
+import copy
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from bar_aggregator import RESOLUTION_SECONDS
+from candle_block import CandleBlock, as_block
+
+# File JSON con lo stato degli indicatori ("" per non salvarlo)
+DEFAULT_INDICATOR_CHECKPOINT_PATH = os.getenv("INDICATOR_CHECKPOINT_PATH", ".indicators.json")
+CHECKPOINT_VERSION = 1
+# Barre chiuse (con i valori degli indicatori) tenute in memoria per le serie del prompt
+HISTORY_ROWS = 50
+# Finestra scaricata quando una serie non ha ancora stato (o dopo un buco)
+WARMUP_BARS = 200
+
+NAN = float("nan")
+
+
+class WarmupNeeded(Exception):
+    """La finestra non prosegue lo stato salvato ed è troppo corta per riscaldare: serve una finestra completa"""
+
+
+def _num(value: Any) -> float:
+    """Come pd.to_numeric(...).fillna(0) in indicators.fetch_ohlcv"""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if math.isnan(value) else value
+
+
+class EMA:
+    """EMA con seme sul primo valore (ewm adjust=False) e min_periods = period"""
+
+    def __init__(self, period: int = 0, alpha: Optional[float] = None):
+        self.period = period
+        self.alpha = alpha if alpha is not None else 2.0 / (period + 1)
+        self.value: Optional[float] = None
+        self.count = 0
+
+    def update(self, x: float) -> float:
+        self.value = x if self.value is None else self.alpha * x + (1 - self.alpha) * self.value
+        self.count += 1
+        return self.current()
+
+    def current(self) -> float:
+        return self.value if self.count >= self.period and self.value is not None else NAN
+
+
+class RSI:
+    """RSI di Wilder come ta.momentum.RSIIndicator"""
+
+    def __init__(self, period: int):
+        self.period = period
+        self.up = EMA(period, alpha=1.0 / period)
+        self.down = EMA(period, alpha=1.0 / period)
+
+    def update(self, change: Optional[float]) -> float:
+        # Prima barra: nessuna variazione (in ta diff() è NaN e conta come 0)
+        change = change or 0.0
+        up = self.up.update(max(change, 0.0))
+        down = self.down.update(max(-change, 0.0))
+        if math.isnan(down):
+            return NAN
+        if down == 0:
+            return 100.0
+        return 100.0 - 100.0 / (1.0 + up / down)
+
+
+class MACD:
+    """Istogramma MACD (macd - signal) come ta.trend.MACD(...).macd_diff()"""
+
+    def __init__(self, fast: int = 12, slow: int = 26, signal: int = 9):
+        self.fast = EMA(fast)
+        self.slow = EMA(slow)
+        self.signal = EMA(signal)
+
+    def update(self, close: float) -> float:
+        line = self.fast.update(close) - self.slow.update(close)
+        if math.isnan(line):
+            return NAN  # il segnale parte dal primo valore valido della linea
+        return line - self.signal.update(line)
+
+
+class ATR:
+    """ATR come ta.volatility.AverageTrueRange (0 finché non ci sono `period` barre)"""
+
+    def __init__(self, period: int):
+        self.period = period
+        self.count = 0
+        self.tr_sum = 0.0
+        self.value = 0.0
+
+    def update(self, true_range: float) -> float:
+        self.count += 1
+        if self.count < self.period:
+            self.tr_sum += true_range
+            return 0.0
+        if self.count == self.period:
+            self.value = (self.tr_sum + true_range) / self.period
+        else:
+            self.value = (self.value * (self.period - 1) + true_range) / self.period
+        return self.value
+
+
+class IndicatorState:
+    """Stato di tutti gli indicatori usati da indicators.get_complete_analysis per una serie"""
+
+    def __init__(self):
+        self.prev_close: Optional[float] = None
+        self.ema_20 = EMA(20)
+        self.ema_50 = EMA(50)
+        self.macd = MACD()
+        self.rsi_7 = RSI(7)
+        self.rsi_14 = RSI(14)
+        self.atr_3 = ATR(3)
+        self.atr_14 = ATR(14)
+
+    def update(self, bar: Dict[str, Any]) -> Dict[str, Any]:
+        """Applica una barra e restituisce la riga con i valori degli indicatori"""
+        high, low, close = _num(bar.get("high")), _num(bar.get("low")), _num(bar.get("close"))
+        prev = self.prev_close
+        if prev is None:
+            change, true_range = None, high - low
+        else:
+            change, true_range = close - prev, max(high - low, abs(high - prev), abs(low - prev))
+        self.prev_close = close
+        return {
+            "timestamp": bar.get("timestamp"),
+            "close": close,
+            "volume": _num(bar.get("volume")),
+            "ema_20": self.ema_20.update(close),
+            "ema_50": self.ema_50.update(close),
+            "macd": self.macd.update(close),
+            "rsi_7": self.rsi_7.update(change),
+            "rsi_14": self.rsi_14.update(change),
+            "atr_3": self.atr_3.update(true_range),
+            "atr_14": self.atr_14.update(true_range),
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return _encode(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "IndicatorState":
+        state = cls()
+        _decode(state, data)
+        return state
+
+
+def _encode(obj: Any) -> Any:
+    if hasattr(obj, "__dict__"):
+        return {k: _encode(v) for k, v in vars(obj).items()}
+    return obj
+
+
+def _decode(obj: Any, data: Dict[str, Any]):
+    for key, value in data.items():
+        current = getattr(obj, key, None)
+        if hasattr(current, "__dict__") and isinstance(value, dict):
+            _decode(current, value)
+        else:
+            setattr(obj, key, value)
+
+
+class IndicatorSeries:
+    """Stato + ultime HISTORY_ROWS righe di una serie; last_ts = inizio dell'ultima barra chiusa applicata"""
+
+    def __init__(self, seconds: Optional[int]):
+        self.seconds = seconds
+        self.state = IndicatorState()
+        self.last_ts: Optional[float] = None
+        self.rows: deque = deque(maxlen=HISTORY_ROWS)
+
+    def bars_needed(self, now: float, default: int) -> int:
+        """
+        Barre da chiedere alla sorgente: dall'ultima chiusa applicata (inclusa) alla barra in formazione.
+        Almeno 2 anche se l'orologio locale è indietro rispetto alle barre del server.
+        """
+        if self.last_ts is None or not self.seconds:
+            return default
+        return max(2, min(default, int((now - self.last_ts) // self.seconds) + 2))
+
+    def update(self, candles: Union[CandleBlock, List[Dict[str, Any]]],
+               warmup_bars: int = 0) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        candles: dalla più vecchia, l'ultima ancora in formazione (CandleBlock o formato di fetch_candles).
+        Applica le barre chiuse nuove e calcola la riga della barra in formazione
+        senza modificare lo stato. Restituisce (righe chiuse, riga corrente).
+        Se la finestra non prosegue lo stato ed è più corta di warmup_bars, lo stato viene
+        azzerato e si solleva WarmupNeeded (il chiamante riscarica bars_needed barre).
+        """
+        block = as_block(candles)
+        if not block:
+            raise ValueError("nessuna candela")
+        times = block.timestamp
+
+        if self.last_ts is not None and (times[-1] <= self.last_ts or self.last_ts not in times[:-1]):
+            # Finestra non contigua con lo stato (buco, o serie ripartita): si ricalcola da capo
+            self.reset()
+            if len(block) < warmup_bars:
+                raise WarmupNeeded(f"{len(block)} barre non contigue con lo stato, servono {warmup_bars}")
+        # Indici delle barre chiuse ancora da applicare (times è ordinato)
+        first = 0 if self.last_ts is None else int(np.searchsorted(times, self.last_ts, side="right"))
+
+        for i in range(first, len(block) - 1):
+            self.rows.append(self.state.update(block.candle(i)))
+            self.last_ts = int(times[i])
+
+        current = copy.deepcopy(self.state).update(block.candle(-1))
+        return list(self.rows), current
+
+    def reset(self):
+        self.state = IndicatorState()
+        self.last_ts = None
+        self.rows.clear()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"seconds": self.seconds, "last_ts": self.last_ts,
+                "state": self.state.to_dict(), "rows": list(self.rows)}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "IndicatorSeries":
+        series = cls(data.get("seconds"))
+        series.state = IndicatorState.from_dict(data["state"])
+        series.last_ts = data.get("last_ts")
+        series.rows.extend(data.get("rows", []))
+        return series
+
+
+class IndicatorEngine:
+    """
+    Indicatori incrementali per più serie, thread-safe, con checkpoint su file.
+
+    Uso tipico (vedi indicators.CryptoTechnicalAnalysis):
+        limit = engine.bars_needed(epic, resolution)
+        rows, current = engine.update(epic, resolution, fetch_block(source, epic, resolution, limit))
+    Dopo un buco update solleva WarmupNeeded: bars_needed restituisce allora warmup_bars
+    e basta ripetere il fetch.
+    """
+
+    def __init__(self, checkpoint_path: Optional[str] = None, warmup_bars: int = WARMUP_BARS, clock=time.time):
+        self.checkpoint_path = checkpoint_path or None
+        self.warmup_bars = warmup_bars
+        self.clock = clock
+        self._series: Dict[Tuple[str, str], IndicatorSeries] = {}
+        self._lock = threading.Lock()
+        if self.checkpoint_path:
+            self.load(self.checkpoint_path)
+
+    def bars_needed(self, epic: str, resolution: str) -> int:
+        with self._lock:
+            series = self._series.get((epic, resolution))
+            if series is None:
+                return self.warmup_bars
+            return series.bars_needed(self.clock(), self.warmup_bars)
+
+    def update(self, epic: str, resolution: str,
+               candles: Union[CandleBlock, List[Dict[str, Any]]]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        key = (epic, resolution)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = IndicatorSeries(RESOLUTION_SECONDS.get(resolution))
+            return series.update(candles, self.warmup_bars)
+
+    def rows(self, epic: str, resolution: str) -> List[Dict[str, Any]]:
+        """Ultime righe chiuse di una serie (senza scaricare niente), dalla più vecchia"""
+        with self._lock:
+            series = self._series.get((epic, resolution))
+            return list(series.rows) if series is not None else []
+
+    # ==========================================================================
+    #                           CHECKPOINT
+    # ==========================================================================
+
+    def save(self, path: Optional[str] = None):
+        """Scrive lo stato di tutte le serie (file temporaneo + rename: mai un file a metà)"""
+        path = path or self.checkpoint_path
+        if not path:
+            return
+        with self._lock:
+            data = {
+                "version": CHECKPOINT_VERSION,
+                "series": {f"{epic}|{resolution}": s.to_dict() for (epic, resolution), s in self._series.items()},
+            }
+        tmp = f"{path}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"⚠️ Checkpoint indicatori non salvato: {e}")
+
+    def load(self, path: str) -> int:
+        """Carica un checkpoint (se presente e compatibile); restituisce il numero di serie"""
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Checkpoint indicatori illeggibile ({e}): si riparte da zero")
+            return 0
+        if data.get("version") != CHECKPOINT_VERSION:
+            return 0
+        loaded = {}
+        for key, value in data.get("series", {}).items():
+            epic, _, resolution = key.partition("|")
+            try:
+                loaded[(epic, resolution)] = IndicatorSeries.from_dict(value)
+            except (KeyError, TypeError) as e:
+                print(f"⚠️ Checkpoint indicatori: serie {key} ignorata ({e})")
+        with self._lock:
+            self._series.update(loaded)
+        return len(loaded)
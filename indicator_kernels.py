@@ -0,0 +1,137 @@
+"""
+Kernel NumPy per EMA, MACD, RSI (Wilder) e ATR su array 2-D (ticker x barre).
+
+Ogni kernel scorre le barre una volta sola e lavora su tutte le righe insieme,
+quindi il costo dipende dal numero di barre e quasi per niente dal numero di
+strumenti. Le righe più corte vanno allineate a destra (ultima barra in fondo)
+con NaN iniziali (vedi stack_rows): ogni riga parte dal proprio primo valore
+valido, come farebbe `ta` sulla serie senza padding. Le posizioni di padding
+restano NaN nei risultati. I NaN devono essere solo iniziali.
+
+Stesse formule di `ta` (e di indicator_engine): EMA ewm(adjust=False) con
+min_periods=window, RSI con medie di Wilder e 100 quando non ci sono ribassi,
+istogramma MACD 12/26/9, ATR con seme a media semplice e 0 prima della finestra.
+"""
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def _as_2d(values) -> np.ndarray:
+    return np.atleast_2d(np.asarray(values, dtype=np.float64))
+
+
+def _restore_shape(out: np.ndarray, values) -> np.ndarray:
+    return out[0] if np.ndim(values) == 1 else out
+
+
+def stack_rows(rows: Sequence[Sequence[float]], length: Optional[int] = None) -> np.ndarray:
+    """Righe di lunghezza diversa -> array (len(rows), length) allineato a destra, NaN a sinistra"""
+    length = length or max((len(r) for r in rows), default=0)
+    out = np.full((len(rows), length), np.nan)
+    for i, row in enumerate(rows):
+        row = np.asarray(row, dtype=np.float64)[-length:]
+        if len(row):
+            out[i, length - len(row):] = row
+    return out
+
+
+def _leading(x: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (indice del primo valore valido per riga, x con il padding iniziale riempito da quel valore).
+    Una EMA che parte da una costante uguale al suo primo valore resta ferma fino ai dati
+    veri, quindi dopo il riempimento le ricorsioni non devono più controllare i NaN.
+    """
+    valid = ~np.isnan(x)
+    first = np.where(valid.any(axis=1), valid.argmax(axis=1), x.shape[1])
+    seed = x[np.arange(len(x)), np.minimum(first, x.shape[1] - 1)]
+    filled = np.where(valid, x, np.nan_to_num(seed, nan=0.0)[:, None])
+    return first, filled
+
+
+def _bar_index(x: np.ndarray, first: np.ndarray) -> np.ndarray:
+    """Numero di barre valide fino a ogni posizione inclusa (<= 0 nel padding)"""
+    return np.arange(x.shape[1])[None, :] - first[:, None] + 1
+
+
+def _ema_rows(filled: np.ndarray, alpha: float) -> np.ndarray:
+    """Ricorsione EMA su righe senza NaN (barre sull'asse 1)"""
+    steps = np.ascontiguousarray(filled.T) * alpha
+    out = np.empty_like(steps)
+    state = filled[:, 0].copy()
+    out[0] = state
+    beta = 1.0 - alpha
+    for t in range(1, len(steps)):
+        state *= beta
+        state += steps[t]
+        out[t] = state
+    return out.T
+
+
+def _ema_2d(x: np.ndarray, alpha: float, min_periods: int) -> np.ndarray:
+    first, filled = _leading(x)
+    out = _ema_rows(filled, alpha)
+    return np.where(_bar_index(x, first) >= min_periods, out, np.nan)
+
+
+def ema(values, window: int) -> np.ndarray:
+    """ta.trend.EMAIndicator(close, window).ema_indicator() per ogni riga"""
+    return _restore_shape(_ema_2d(_as_2d(values), 2.0 / (window + 1), window), values)
+
+
+def macd_diff(close, window_slow: int = 26, window_fast: int = 12, window_sign: int = 9) -> np.ndarray:
+    """ta.trend.MACD(close).macd_diff(): linea MACD meno la sua EMA di segnale"""
+    x = _as_2d(close)
+    line = _ema_2d(x, 2.0 / (window_fast + 1), window_fast) - _ema_2d(x, 2.0 / (window_slow + 1), window_slow)
+    # Il segnale parte dal primo valore valido della linea (NaN iniziali ignorati)
+    signal = _ema_2d(line, 2.0 / (window_sign + 1), window_sign)
+    return _restore_shape(line - signal, close)
+
+
+def rsi(close, window: int = 14) -> np.ndarray:
+    """ta.momentum.RSIIndicator(close, window).rsi() per ogni riga"""
+    x = _as_2d(close)
+    first, filled = _leading(x)
+    # Variazione 0 sulla prima barra valida e nel padding (in ta diff() iniziale vale 0)
+    change = np.zeros_like(filled)
+    change[:, 1:] = filled[:, 1:] - filled[:, :-1]
+    alpha = 1.0 / window
+    avg_up = _ema_rows(np.maximum(change, 0.0), alpha)
+    avg_down = _ema_rows(np.maximum(-change, 0.0), alpha)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out = np.where(avg_down == 0, 100.0, 100.0 - 100.0 / (1.0 + avg_up / avg_down))
+    return _restore_shape(np.where(_bar_index(x, first) >= window, out, np.nan), close)
+
+
+def true_range(high, low, close) -> np.ndarray:
+    """max(high-low, |high-close_prev|, |low-close_prev|); sulla prima barra high-low"""
+    h, l, c = _as_2d(high), _as_2d(low), _as_2d(close)
+    prev = np.full_like(c, np.nan)
+    prev[:, 1:] = c[:, :-1]
+    out = np.fmax(h - l, np.fmax(np.abs(h - prev), np.abs(l - prev)))
+    return _restore_shape(out, close)
+
+
+def atr(high, low, close, window: int = 14) -> np.ndarray:
+    """ta.volatility.AverageTrueRange(high, low, close, window).average_true_range() per ogni riga"""
+    tr = _as_2d(true_range(high, low, close))
+    first, _ = _leading(_as_2d(close))
+    bars = _bar_index(tr, first)
+    tr = np.where(bars >= 1, tr, 0.0)
+    n_bars = tr.shape[1]
+
+    # Seme: media semplice dei primi `window` true range validi, sulla barra first + window - 1
+    seed_at = first + window - 1
+    seed = np.cumsum(tr, axis=1)[np.arange(len(tr)), np.minimum(seed_at, n_bars - 1)] / window
+
+    steps = np.ascontiguousarray(tr.T) / window
+    out = np.zeros_like(steps)
+    state = np.zeros(len(tr))
+    keep = (window - 1) / window
+    for t in range(n_bars):
+        state *= keep
+        state += steps[t]
+        np.copyto(state, seed, where=seed_at == t)
+        out[t] = state
+    out = np.where(bars >= window, out.T, 0.0)
+    return _restore_shape(np.where(bars >= 1, out, np.nan), close)
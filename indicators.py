@@ -1,8 +1,17 @@
 import pandas as pd
 import ta
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
 from typing import Dict, List, Tuple, Optional, Any
 
+import indicator_kernels as kernels
+import timing
+from bar_aggregator import format_bar_time
+from candle_block import CandleBlock, fetch_block
+from capital_trader import HTTP_POOL_SIZE
+from indicator_engine import IndicatorEngine, HISTORY_ROWS, WARMUP_BARS, WarmupNeeded
+from cross_asset import CrossAssetFeatures
+
 
 # Mapping for Capital.com intervals
 CAPITAL_INTERVAL_MAP = {
@@ -28,10 +37,15 @@ class CryptoTechnicalAnalysis:
     Tutti gli indicatori principali sono centrati sul timeframe 15 minuti.
     """
 
-    def __init__(self, capital_client: Any):
+    def __init__(self, capital_client: Any, candle_source: Any = None, engine: Optional[IndicatorEngine] = None):
         if capital_client is None:
             raise ValueError("capital_client è obbligatorio")
         self.capital_client = capital_client
+        # Da dove leggere le candele (es. CandleProvider condiviso col forecaster); default il client
+        self.candle_source = candle_source or capital_client
+        # Stato incrementale degli indicatori (condiviso tra i cicli e salvabile su file);
+        # senza engine esterno ogni analisi riparte dalla finestra completa
+        self.engine = engine or IndicatorEngine()
 
     # ==============================
     #       FETCH OHLCV
@@ -41,27 +55,20 @@ class CryptoTechnicalAnalysis:
         """Capital.com non fornisce orderbook, restituiamo N/A"""
         return "N/A (Capital.com)"
 
+    def _epic(self, coin: str) -> str:
+        return TICKER_TO_EPIC.get(coin.upper(), coin.upper() + "USD")
+
     def fetch_ohlcv(self, coin: str, interval: str, limit: int = 500) -> pd.DataFrame:
-        """Recupera i dati OHLCV da Capital.com."""
-        epic = TICKER_TO_EPIC.get(coin.upper(), coin.upper() + "USD")
+        """Recupera i dati OHLCV da Capital.com (colonne OHLCV = vista sul CandleBlock, in sola lettura)."""
+        epic = self._epic(coin)
         resolution = CAPITAL_INTERVAL_MAP.get(interval, "MINUTE_15")
         
-        candles = self.capital_client.fetch_candles(epic, resolution, limit)
+        block = fetch_block(self.candle_source, epic, resolution, limit)
         
-        if not candles:
+        if not block:
             raise RuntimeError(f"Nessuna candela ricevuta da Capital.com per {epic}")
         
-        df = pd.DataFrame(candles)
-        df["timestamp"] = pd.to_datetime(df["timestamp"])
-        if df["timestamp"].dt.tz is None:
-            df["timestamp"] = df["timestamp"].dt.tz_localize('UTC')
-        
-        for col in ["open", "high", "low", "close", "volume"]:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-        
-        df = df.sort_values("timestamp").reset_index(drop=True)
-        return df
+        return block.to_frame()
 
     # ==============================
     #       INDICATORI TECNICI
@@ -116,64 +123,62 @@ class CryptoTechnicalAnalysis:
     def get_complete_analysis(self, ticker: str) -> Dict:
         coin = ticker.upper()
 
-        # 1) DATI 15 MINUTI (intraday principale)
-        df_15m = self.fetch_ohlcv(coin, "15m", limit=200)
-
-        df_15m["ema_20"] = self.calculate_ema(df_15m["close"], 20)
-        macd_line, signal_line, macd_diff = self.calculate_macd(df_15m["close"])
-        df_15m["macd"] = macd_diff
-        df_15m["rsi_7"] = self.calculate_rsi(df_15m["close"], 7)
-        df_15m["rsi_14"] = self.calculate_rsi(df_15m["close"], 14)
-
-        last_10_15m = df_15m.tail(10)
-
-        # 2) CONTESTO "longer term" sempre a 15m ma su finestra più lunga
-        longer_term = df_15m.tail(50).copy()
-        longer_term["ema_20"] = self.calculate_ema(longer_term["close"], 20)
-        longer_term["ema_50"] = self.calculate_ema(longer_term["close"], 50)
-        longer_term["atr_3"] = self.calculate_atr(
-            longer_term["high"], longer_term["low"], longer_term["close"], 3
-        )
-        longer_term["atr_14"] = self.calculate_atr(
-            longer_term["high"], longer_term["low"], longer_term["close"], 14
-        )
-        macd_15m_long, _, macd_diff_15m_long = self.calculate_macd(
-            longer_term["close"]
-        )
-        longer_term["macd"] = macd_diff_15m_long
-        longer_term["rsi_14"] = self.calculate_rsi(longer_term["close"], 14)
-
-        avg_volume = longer_term["volume"].tail(20).mean()
-        last_10_longer = longer_term.tail(10)
-
-        # 3) PIVOT POINTS daily
+        # 1) DATI 15 MINUTI (intraday principale): dopo il primo ciclo solo le barre nuove
+        epic, resolution = self._epic(coin), CAPITAL_INTERVAL_MAP["15m"]
+        for attempt in range(2):
+            candles = fetch_block(self.candle_source, epic, resolution, self.engine.bars_needed(epic, resolution))
+            if not candles:
+                raise RuntimeError(f"Nessuna candela ricevuta da Capital.com per {epic}")
+
+            with timing.stage(f"indicators:{coin}"):
+                # EMA20/50, MACD, RSI7/14, ATR3/14 aggiornati in O(1) per barra chiusa;
+                # l'ultima riga è la barra in formazione (come df.iloc[-1] sulla finestra)
+                try:
+                    rows, current = self.engine.update(epic, resolution, candles)
+                    break
+                except WarmupNeeded as e:
+                    # Buco rispetto allo stato: si riscalda sulla finestra completa
+                    if attempt:
+                        raise
+                    print(f"⚠️ Indicatori {coin}: {e}, nuovo riscaldamento")
+
+        return self.build_analysis(ticker, rows, current, self.get_pivot_points(coin, candles))
+
+    def get_pivot_points(self, coin: str, candles: CandleBlock) -> Dict[str, float]:
+        """PIVOT POINTS daily (giorno precedente; in mancanza l'ultima candela 15m)"""
         df_daily = self.fetch_ohlcv(coin, "1d", limit=2)
         if len(df_daily) >= 2:
             prev_day = df_daily.iloc[-2]
-            pivot_points = self.calculate_pivot_points(
+            return self.calculate_pivot_points(
                 prev_day["high"], prev_day["low"], prev_day["close"]
             )
-        else:
-            last = df_15m.iloc[-1]
-            pivot_points = self.calculate_pivot_points(
-                last["high"], last["low"], last["close"]
-            )
+        return self.calculate_pivot_points(candles.high[-1], candles.low[-1], candles.close[-1])
+
+    def build_analysis(self, ticker: str, rows: List[Dict[str, Any]], current: Dict[str, Any],
+                       pivot_points: Dict[str, float]) -> Dict:
+        """
+        Dizionario dell'analisi completa a partire dalle righe degli indicatori
+        (barre chiuse dalla più vecchia + barra in formazione, formato di IndicatorEngine.update).
+        """
+        coin = ticker.upper()
+        last_10 = rows[-9:] + [current]
+
+        # 2) CONTESTO "longer term" sempre a 15m: EMA50, ATR e volume medio su 20 barre
+        last_20 = rows[-19:] + [current]
+        avg_volume = sum(r["volume"] for r in last_20) / len(last_20)
 
         oi_data = self.get_open_interest(coin)
         funding_rate = self.get_funding_rate(coin)
 
-        current_15m = df_15m.iloc[-1]
-        current_longer = longer_term.iloc[-1]
-
         result = {
             "ticker": ticker,
             "timestamp": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
             
             "current": {
-                "price": current_15m["close"],
-                "ema20": current_15m["ema_20"],
-                "macd": current_15m["macd"],
-                "rsi_7": current_15m["rsi_7"],
+                "price": current["close"],
+                "ema20": current["ema_20"],
+                "macd": current["macd"],
+                "rsi_7": current["rsi_7"],
             },
             "volume": self.get_orderbook_volume(ticker),
             "pivot_points": pivot_points,
@@ -185,22 +190,20 @@ class CryptoTechnicalAnalysis:
             },
 
             "intraday": {
-                "mid_prices": last_10_15m["close"].tolist(),
-                "ema_20": last_10_15m["ema_20"].tolist(),
-                "macd": last_10_15m["macd"].tolist(),
-                "rsi_7": last_10_15m["rsi_7"].tolist(),
-                "rsi_14": last_10_15m["rsi_14"].tolist(),
+                "mid_prices": [r["close"] for r in last_10],
+                "ema_20": [r["ema_20"] for r in last_10],
+                "macd": [r["macd"] for r in last_10],
+                "rsi_7": [r["rsi_7"] for r in last_10],
+                "rsi_14": [r["rsi_14"] for r in last_10],
             },
 
+            # Solo i valori che non sono già in "current"/"intraday" (stessa serie 15m)
             "longer_term_15m": {
-                "ema_20_current": current_longer["ema_20"],
-                "ema_50_current": current_longer["ema_50"],
-                "atr_3_current": current_longer["atr_3"],
-                "atr_14_current": current_longer["atr_14"],
-                "volume_current": current_longer["volume"],
+                "ema_50_current": current["ema_50"],
+                "atr_3_current": current["atr_3"],
+                "atr_14_current": current["atr_14"],
+                "volume_current": current["volume"],
                 "volume_average": avg_volume,
-                "macd_series": last_10_longer["macd"].tolist(),
-                "rsi_14_series": last_10_longer["rsi_14"].tolist(),
             },
         }
         return result
@@ -240,45 +243,147 @@ class CryptoTechnicalAnalysis:
         lt = data["longer_term_15m"]
         output += "Longer-term context (still 15-minute timeframe, wider window):\n"
         output += (
-            f"20-Period EMA: {lt['ema_20_current']:.3f} vs. "
+            f"20-Period EMA: {curr['ema20']:.3f} vs. "
             f"50-Period EMA: {lt['ema_50_current']:.3f}\n"
             f"3-Period ATR: {lt['atr_3_current']:.3f} vs. "
             f"14-Period ATR: {lt['atr_14_current']:.3f}\n"
             f"Current Volume: {lt['volume_current']:.3f} vs. "
             f"Average Volume: {lt['volume_average']:.3f}\n"
-            f"MACD indicators: {[round(x, 3) for x in lt['macd_series']]}\n"
-            f"RSI indicators (14-Period): {[round(x, 3) for x in lt['rsi_14_series']]}\n"
         )
         output += f"</{data['ticker']}_data>\n"
         return output
 
 
-def analyze_multiple_tickers(tickers: List[str], capital_client: Any) -> Tuple[str, List]:
+def compute_indicator_rows(blocks: Dict[str, CandleBlock]
+                           ) -> Dict[str, Tuple[List[Dict[str, Any]], Dict[str, Any]]]:
+    """
+    Indicatori di tutti i ticker con una chiamata vettoriale per indicatore (indicator_kernels).
+    blocks: finestre per ticker (l'ultima candela in formazione), anche di lunghezza diversa.
+    Restituisce per ticker (righe chiuse, riga corrente) come IndicatorEngine.update
+    riscaldato sulla stessa finestra.
+    """
+    tickers = [t for t, block in blocks.items() if block]
+    high, low, close, volume = (kernels.stack_rows([getattr(blocks[t], name) for t in tickers])
+                                for name in ("high", "low", "close", "volume"))
+    values = {
+        "close": close,
+        "volume": volume,
+        "ema_20": kernels.ema(close, 20),
+        "ema_50": kernels.ema(close, 50),
+        "macd": kernels.macd_diff(close),
+        "rsi_7": kernels.rsi(close, 7),
+        "rsi_14": kernels.rsi(close, 14),
+        "atr_3": kernels.atr(high, low, close, 3),
+        "atr_14": kernels.atr(high, low, close, 14),
+    }
+
+    length = close.shape[1]
+    result = {}
+    for i, ticker in enumerate(tickers):
+        timestamps = blocks[ticker].timestamp
+        # Solo le ultime HISTORY_ROWS barre chiuse + quella in formazione (come l'engine)
+        first = max(length - len(timestamps), length - HISTORY_ROWS - 1)
+        rows = []
+        for j in range(first, length):
+            row = {"timestamp": format_bar_time(int(timestamps[j - length]))}
+            row.update({name: float(v[i, j]) for name, v in values.items()})
+            rows.append(row)
+        result[ticker] = (rows[:-1], rows[-1])
+    return result
+
+
+def _fetch_batch_inputs(analyzer: CryptoTechnicalAnalysis, ticker: str, limit: int):
+    """Candele 15m e pivot daily di un ticker (eseguito nel thread pool del batch)"""
+    coin = ticker.upper()
+    epic = analyzer._epic(coin)
+    candles = fetch_block(analyzer.candle_source, epic, CAPITAL_INTERVAL_MAP["15m"], limit)
+    if not candles:
+        raise RuntimeError(f"Nessuna candela ricevuta da Capital.com per {epic}")
+    return candles, analyzer.get_pivot_points(coin, candles)
+
+
+def analyze_multiple_tickers(tickers: List[str], capital_client: Any,
+                             candle_source: Any = None, engine: Optional[IndicatorEngine] = None,
+                             cross_asset: Optional[CrossAssetFeatures] = None,
+                             batch: bool = False, max_workers: int = HTTP_POOL_SIZE) -> Tuple[str, List]:
     """
     Analizza più ticker e restituisce output formattato + dati JSON.
     
     Args:
         tickers: Lista di ticker (es. ['BTC', 'ETH', 'SOL'])
         capital_client: Istanza CapitalTrader (obbligatorio)
+        candle_source: Sorgente candele opzionale (es. CandleProvider); default capital_client
+        engine: IndicatorEngine con lo stato dei cicli precedenti (opzionale)
+        cross_asset: CrossAssetFeatures dei cicli precedenti (opzionale); senza, viene
+            ricostruito dalle righe dell'engine
+        batch: per universi grandi. Scarica tutte le serie in parallelo (il rate limiter del
+            trader fa da freno) e calcola gli indicatori di tutti i ticker in una sola chiamata
+            vettoriale sulla finestra completa; l'engine non viene usato.
+        max_workers: richieste in parallelo in modalità batch
     """
     if capital_client is None:
         raise ValueError("capital_client è obbligatorio per analyze_multiple_tickers")
     
-    analyzer = CryptoTechnicalAnalysis(capital_client)
+    analyzer = CryptoTechnicalAnalysis(capital_client, candle_source, engine)
+    cross_asset = cross_asset or CrossAssetFeatures(tickers)
     full_output = ""
     datas = []
-    
-    for ticker in tickers:
+
+    if batch:
+        results = _analyze_batch(analyzer, tickers, max_workers)
+    else:
+        results = ((ticker, None) for ticker in tickers)
+
+    for ticker, prepared in results:
         try:
-            data = analyzer.get_complete_analysis(ticker)
+            if batch:
+                rows, current, pivot_points = prepared
+                data = analyzer.build_analysis(ticker, rows, current, pivot_points)
+            else:
+                data = analyzer.get_complete_analysis(ticker)
+                rows = analyzer.engine.rows(analyzer._epic(ticker), CAPITAL_INTERVAL_MAP["15m"])
             datas.append(data)
             full_output += analyzer.format_output(data)
+            # Le barre chiuse sono già calcolate: nessuna candela in più per le feature cross-asset
+            cross_asset.update(ticker, rows)
         except Exception as e:
             print(f"Errore durante l'analisi di {ticker}: {e}")
+
+    with timing.stage("indicators:cross_asset"):
+        features = cross_asset.features()
+    if features:
+        full_output += cross_asset.format_output(features)
+        for data in datas:
+            coin = data["ticker"].upper()
+            data["cross_asset"] = {
+                "correlations": features["correlations"].get(coin),
+                "beta_to_btc": features["beta_to_benchmark"].get(coin),
+                "volatility": features["volatility"].get(coin),
+            }
     
     return full_output, datas
 
 
+def _analyze_batch(analyzer: CryptoTechnicalAnalysis, tickers: List[str], max_workers: int):
+    """(ticker, (righe, riga corrente, pivot)) nell'ordine di tickers; i ticker falliti vengono saltati"""
+    inputs = {}
+    with timing.stage("indicators:batch_fetch"):
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tickers))),
+                                thread_name_prefix="indicators") as pool:
+            futures = {ticker: pool.submit(_fetch_batch_inputs, analyzer, ticker, WARMUP_BARS) for ticker in tickers}
+            for ticker, future in futures.items():
+                try:
+                    inputs[ticker] = future.result()
+                except Exception as e:
+                    print(f"Errore durante l'analisi di {ticker}: {e}")
+
+    if not inputs:
+        return []
+    with timing.stage("indicators:batch_compute"):
+        computed = compute_indicator_rows({ticker: candles for ticker, (candles, _) in inputs.items()})
+    return [(ticker, computed[ticker] + (inputs[ticker][1],)) for ticker in tickers if ticker in computed]
+
+
 # if __name__ == "__main__":
 #     tickers = ["BTC", "ETH", "BNB"]
 #     result = analyze_multiple_tickers(tickers, testnet=True)
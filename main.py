@@ -6,10 +6,21 @@ from news_feed import fetch_latest_news
 from trading_agent import previsione_trading_agent
 from sentiment import get_sentiment
 from forecaster import get_crypto_forecasts
-from capital_trader import CapitalTrader
+from capital_trader import CapitalTrader, map_symbol_to_epic, format_quotes
+from capital_streaming import CapitalStreamingClient
+from bar_aggregator import BarAggregator
+from candle_store import CandleStore, DEFAULT_CANDLE_STORE_PATH
+from candle_provider import CandleProvider
+from indicator_engine import IndicatorEngine, DEFAULT_INDICATOR_CHECKPOINT_PATH
+from cross_asset import CrossAssetFeatures
 import os
 import json
+import time
+import argparse
 import db_utils
+import timing
+from scheduler import CandleCloseScheduler, decision_lag_seconds, last_bar_close
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone, timedelta
 from dotenv import load_dotenv
 load_dotenv()
@@ -33,24 +44,28 @@ CAPITAL_ACCOUNT_ID = os.getenv("CAPITAL_ACCOUNT_ID")  # Account specifico (opzio
 # Tickers - Capital.com EPICs per crypto
 TICKERS = ['BTC', 'ETH', 'SOL']  # Verranno mappati a BTCUSD, ETHUSD, SOLUSD
 
-# Inizializza variabili per error handling
-system_prompt = None
-indicators_json = None
-news_txt = None
-sentiment_json = None
-forecasts_json = None
-account_status = None
+# Daemon mode: i cicli partono alla chiusura di ogni barra (MINUTE_15 = 900s)
+CYCLE_INTERVAL_SECONDS = int(os.getenv("CYCLE_INTERVAL_SECONDS", "900"))
+# Secondi di attesa dopo la chiusura della barra (lascia a Capital.com il tempo di pubblicarla)
+CYCLE_BAR_OFFSET_SECONDS = float(os.getenv("CYCLE_BAR_OFFSET_SECONDS", "5"))
+# Cosa fare se il ciclo precedente è ancora in corso alla barra successiva: skip | coalesce
+CYCLE_OVERRUN_POLICY = os.getenv("CYCLE_OVERRUN_POLICY", "skip")
+# Daemon mode: quotazioni in streaming (WebSocket) invece di GET /markets per prezzo e sizing
+CAPITAL_STREAMING = os.getenv("CAPITAL_STREAMING", "False").lower() == "true"
+# Indicatori in modalità batch (serie scaricate in parallelo, calcolo vettoriale su tutta la
+# finestra): conviene con molti strumenti; con pochi ticker l'engine incrementale scarica meno
+INDICATORS_BATCH = os.getenv("INDICATORS_BATCH", "False").lower() == "true"
 
-# Verifica credenziali
-if not CAPITAL_API_KEY or not CAPITAL_PASSWORD or not CAPITAL_IDENTIFIER:
-    raise RuntimeError("Credenziali Capital.com mancanti nel .env (CAPITAL_API_KEY, CAPITAL_API_PASSWORD, CAPITAL_IDENTIFIER)")
 
-try:
-    print("="*60)
-    print(f"🤖 TRADING BOT - Capital.com {'DEMO' if CAPITAL_DEMO else 'LIVE'}")
-    print("="*60)
-    
-    # 1. Connessione a Capital.com
+
+def check_credentials():
+    """Verifica che le credenziali Capital.com siano presenti nel .env"""
+    if not CAPITAL_API_KEY or not CAPITAL_PASSWORD or not CAPITAL_IDENTIFIER:
+        raise RuntimeError("Credenziali Capital.com mancanti nel .env (CAPITAL_API_KEY, CAPITAL_API_PASSWORD, CAPITAL_IDENTIFIER)")
+
+
+def create_trader() -> CapitalTrader:
+    """Crea il CapitalTrader (login + selezione conto)"""
     print("\n1️⃣ Connessione a Capital.com...")
     bot = CapitalTrader(
         api_key=CAPITAL_API_KEY,
@@ -60,29 +75,150 @@ try:
         account_id=CAPITAL_ACCOUNT_ID  # Forza account specifico da env
     )
     print("   ✅ Connesso a Capital.com")
+    return bot
+
+
+_system_prompt_template = None
+
+
+def create_candle_source(bot: CapitalTrader):
+    """Archivio candele locale con delta fetch (CANDLE_STORE_PATH vuoto = solo REST)"""
+    if not DEFAULT_CANDLE_STORE_PATH:
+        return bot
+    return CandleStore(bot, DEFAULT_CANDLE_STORE_PATH)
+
+
+def create_candle_provider(source) -> CandleProvider:
+    """Unico punto d'accesso alle candele per indicators e forecaster"""
+    return CandleProvider(source)
 
-    # 2. Analisi indicatori tecnici
-    print(f"\n2️⃣ Analisi indicatori per {TICKERS}...")
-    indicators_txt, indicators_json = analyze_multiple_tickers(TICKERS, capital_client=bot)
-    print("   ✅ Indicatori calcolati")
 
-    # 3. News
-    print("\n3️⃣ Recupero news crypto...")
-    news_txt = fetch_latest_news()
-    print("   ✅ News recuperate")
+def create_indicator_engine() -> IndicatorEngine:
+    """Indicatori incrementali, ripresi dal checkpoint dell'esecuzione precedente (INDICATOR_CHECKPOINT_PATH)"""
+    return IndicatorEngine(DEFAULT_INDICATOR_CHECKPOINT_PATH)
 
-    # 4. Sentiment
-    print("\n4️⃣ Analisi sentiment...")
-    sentiment_txt, sentiment_json = get_sentiment()
-    print("   ✅ Sentiment analizzato")
 
-    # 5. Forecasts
-    print("\n5️⃣ Generazione previsioni Prophet...")
-    forecasts_txt, forecasts_json = get_crypto_forecasts(tickers=TICKERS, capital_client=bot)
-    print("   ✅ Previsioni generate")
+def create_cross_asset() -> CrossAssetFeatures:
+    """Correlazioni, beta verso BTC e regimi di volatilità di tutti i TICKERS, aggiornati barra per barra"""
+    return CrossAssetFeatures(TICKERS)
 
-    # 6. Costruzione messaggio per AI
-    msg_info = f"""<indicatori>
+
+def load_system_prompt_template() -> str:
+    """Legge system_prompt.txt una sola volta per processo"""
+    global _system_prompt_template
+    if _system_prompt_template is None:
+        with open('system_prompt.txt', 'r') as f:
+            _system_prompt_template = f.read()
+    return _system_prompt_template
+
+
+def _timed_stage(name: str, fn):
+    with timing.stage(name):
+        return fn()
+
+
+def gather_market_data(bot: CapitalTrader, results: dict, candle_source=None, indicator_engine=None,
+                       cross_asset=None) -> dict:
+    """
+    Esegue in parallelo le fasi indipendenti di raccolta dati e le salva in `results`
+    (indicators, news, sentiment, forecasts, quotes, account_status).
+    candle_source: oggetto con fetch_candles() usato per indicatori e previsioni
+    (di norma un CandleProvider, così le serie comuni vengono scaricate una volta sola);
+    default il trader stesso (REST).
+    indicator_engine: IndicatorEngine con lo stato dei cicli precedenti (opzionale).
+    cross_asset: CrossAssetFeatures con lo stato dei cicli precedenti (opzionale).
+
+    Sono quasi tutte I/O-bound (Capital.com, RSS, CoinMarketCap) e Prophet rilascia
+    il GIL durante il fit, quindi un thread pool basta: il tempo totale scende a
+    quello della fase più lenta. `results` viene riempito anche in caso di errore,
+    così il contesto parziale finisce comunque nel log errori; la prima eccezione
+    viene poi rilanciata.
+    """
+    stages = {
+        "indicators": lambda: analyze_multiple_tickers(TICKERS, capital_client=bot, candle_source=candle_source,
+                                                       engine=indicator_engine, cross_asset=cross_asset,
+                                                       batch=INDICATORS_BATCH),
+        "news": fetch_latest_news,
+        "sentiment": get_sentiment,
+        "forecasts": lambda: get_crypto_forecasts(tickers=TICKERS, capital_client=bot, candle_source=candle_source),
+        # Una sola richiesta per le quotazioni di tutti i ticker (aggiorna anche la cache per il sizing)
+        "quotes": lambda: bot.get_quotes([map_symbol_to_epic(t) for t in TICKERS]),
+        "account_status": bot.get_account_status_formatted,
+    }
+    labels = {
+        "indicators": "Indicatori calcolati",
+        "news": "News recuperate",
+        "sentiment": "Sentiment analizzato",
+        "forecasts": "Previsioni generate",
+        "quotes": "Quotazioni aggiornate",
+        "account_status": "Stato account recuperato",
+    }
+
+    first_error = None
+    with ThreadPoolExecutor(max_workers=len(stages), thread_name_prefix="gather") as pool:
+        futures = {pool.submit(_timed_stage, f"gather:{name}", fn): name for name, fn in stages.items()}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+                print(f"   ✅ {labels[name]}")
+            except Exception as e:
+                print(f"   ❌ Fase '{name}' fallita: {e}")
+                if first_error is None:
+                    first_error = e
+
+    if first_error is not None:
+        raise first_error
+    return results
+
+
+def run_cycle(bot: CapitalTrader, bar_close: datetime = None, timer: timing.CycleTimer = None,
+              candle_source=None, indicator_engine=None, cross_asset=None):
+    """
+    Esegue un ciclo completo della pipeline: dati di mercato -> AI -> esecuzione -> DB.
+    Il trader viene passato dall'esterno, così in daemon mode sessione e
+    connessioni restano vive tra un ciclo e l'altro.
+
+    bar_close: chiusura della barra che ha fatto partire il ciclo (dallo scheduler, o l'ultima
+    chiusa in modalità one-shot); serve per misurare il lag tra chiusura barra e decisione.
+    timer: timer già avviato (es. prima del login in modalità one-shot); se None ne parte uno nuovo.
+    candle_source: sorgente candele alternativa al REST (vedi gather_market_data).
+    indicator_engine: stato incrementale degli indicatori; il checkpoint viene salvato dopo la raccolta dati.
+    cross_asset: stato incrementale delle feature cross-asset (ricostruibile dalle righe dell'engine).
+    Le durate di tutte le fasi vengono salvate in cycle_stage_timings.
+    """
+    if timer is None:
+        timer = timing.start_cycle()
+    op_id = None
+    # Inizializza variabili per error handling
+    system_prompt = None
+    indicators_json = None
+    news_txt = None
+    sentiment_json = None
+    forecasts_json = None
+    account_status = None
+
+    try:
+        # Saldo e posizioni vengono letti dal broker una volta per ciclo (poi aggiornati dalle conferme)
+        bot.invalidate_account_state()
+
+        # 2-6. Raccolta dati in parallelo (indicatori, news, sentiment, forecast, account)
+        print(f"\n2️⃣ Raccolta dati di mercato in parallelo per {TICKERS}...")
+        gathered = {}
+        try:
+            gather_market_data(bot, gathered, candle_source, indicator_engine, cross_asset)
+        finally:
+            if indicator_engine is not None:
+                indicator_engine.save()
+            indicators_txt, indicators_json = gathered.get("indicators", (None, None))
+            news_txt = gathered.get("news")
+            sentiment_txt, sentiment_json = gathered.get("sentiment", (None, None))
+            forecasts_txt, forecasts_json = gathered.get("forecasts", (None, None))
+            quotes = gathered.get("quotes") or {}
+            account_status = gathered.get("account_status")
+
+        # 6. Costruzione messaggio per AI
+        msg_info = f"""<indicatori>
 {indicators_txt}
 </indicatori>
 
@@ -97,130 +233,242 @@ try:
 <forecast>
 {forecasts_txt}
 </forecast>
+
+<quotazioni>
+{format_quotes(quotes)}
+</quotazioni>
 """
 
-    # 7. Stato account
-    print("\n6️⃣ Recupero stato account...")
-    account_status = bot.get_account_status_formatted()
-    portfolio_data = json.dumps(account_status)
-    snapshot_id = db_utils.log_account_status(account_status)
-    print(f"   ✅ Snapshot salvato con id={snapshot_id}")
+        # 7. Stato account
+        print("\n6️⃣ Salvataggio stato account...")
+        portfolio_data = json.dumps(account_status)
+        with timing.stage("db:log_account_status"):
+            snapshot_id = db_utils.log_account_status(account_status)
+        print(f"   ✅ Snapshot salvato con id={snapshot_id}")
     
-    # Sincronizza posizioni reali nel DB per la dashboard
-    positions = account_status.get('positions', [])
-    synced_count = db_utils.sync_real_positions(positions)
-    print(f"   ✅ Sincronizzate {synced_count} posizioni reali")
-
-    # 8. Creazione System Prompt
-    print("\n7️⃣ Preparazione prompt per AI...")
-    with open('system_prompt.txt', 'r') as f:
-        system_prompt = f.read()
-    system_prompt = system_prompt.format(portfolio_data, msg_info)
-    print("   ✅ Prompt preparato")
-
-    # 9. Chiamata AI
-    print("\n8️⃣ L'agente AI sta decidendo...")
-    out = previsione_trading_agent(system_prompt)
+        # Sincronizza posizioni reali nel DB per la dashboard
+        positions = account_status.get('positions', [])
+        with timing.stage("db:sync_real_positions"):
+            synced_count = db_utils.sync_real_positions(positions)
+        print(f"   ✅ Sincronizzate {synced_count} posizioni reali")
+
+        # 8. Creazione System Prompt
+        print("\n7️⃣ Preparazione prompt per AI...")
+        system_prompt = load_system_prompt_template().format(portfolio_data, msg_info)
+        print("   ✅ Prompt preparato")
+
+        # 9. Chiamata AI
+        print("\n8️⃣ L'agente AI sta decidendo...")
+        with timing.stage("gemini"):
+            out = previsione_trading_agent(system_prompt)
+        lag_s = decision_lag_seconds(bar_close)
+        if lag_s is not None:
+            print(f"   ⏱️ Lag chiusura barra -> decisione: {lag_s:.1f}s")
     
-    # 9.5 ANTI-OVERTRADING: Verifica se l'AI vuole chiudere troppo presto
-    if out.get('operation') == 'close':
-        symbol_to_close = out.get('symbol', '')
-        epic_to_close = f"{symbol_to_close}USD"
+        # 9.5 ANTI-OVERTRADING: Verifica se l'AI vuole chiudere troppo presto
+        if out.get('operation') == 'close':
+            symbol_to_close = out.get('symbol', '')
+            epic_to_close = f"{symbol_to_close}USD"
         
-        # Cerca la posizione aperta
-        position_to_check = None
-        for pos in positions:
-            pos_symbol = pos.get('symbol') or pos.get('epic', '')
-            if pos_symbol == epic_to_close or pos_symbol == symbol_to_close:
-                position_to_check = pos
-                break
+            # Cerca la posizione aperta
+            position_to_check = None
+            for pos in positions:
+                pos_symbol = pos.get('symbol') or pos.get('epic', '')
+                if pos_symbol == epic_to_close or pos_symbol == symbol_to_close:
+                    position_to_check = pos
+                    break
         
-        if position_to_check:
-            # Calcola quanto tempo è aperta la posizione
-            opened_at = position_to_check.get('opened_at')
-            pnl_pct = position_to_check.get('pnl_pct', 0) or 0
+            if position_to_check:
+                # Calcola quanto tempo è aperta la posizione
+                opened_at = position_to_check.get('opened_at')
+                pnl_pct = position_to_check.get('pnl_pct', 0) or 0
             
-            # Verifica se possiamo chiudere
-            can_close = False
-            override_reason = None
+                # Verifica se possiamo chiudere
+                can_close = False
+                override_reason = None
             
-            # Sempre permetti chiusura se stop loss o take profit significativo
-            if pnl_pct <= STOP_LOSS_THRESHOLD_PCT:
-                can_close = True
-                override_reason = f"Stop loss triggered (PnL: {pnl_pct:.2f}%)"
-            elif pnl_pct >= TAKE_PROFIT_THRESHOLD_PCT:
-                can_close = True
-                override_reason = f"Take profit triggered (PnL: {pnl_pct:.2f}%)"
-            elif opened_at:
-                # Controlla tempo minimo
-                try:
-                    if isinstance(opened_at, str):
-                        opened_at = datetime.fromisoformat(opened_at.replace('Z', '+00:00'))
-                    time_held = datetime.now(timezone.utc) - opened_at
-                    minutes_held = time_held.total_seconds() / 60
+                # Sempre permetti chiusura se stop loss o take profit significativo
+                if pnl_pct <= STOP_LOSS_THRESHOLD_PCT:
+                    can_close = True
+                    override_reason = f"Stop loss triggered (PnL: {pnl_pct:.2f}%)"
+                elif pnl_pct >= TAKE_PROFIT_THRESHOLD_PCT:
+                    can_close = True
+                    override_reason = f"Take profit triggered (PnL: {pnl_pct:.2f}%)"
+                elif opened_at:
+                    # Controlla tempo minimo
+                    try:
+                        if isinstance(opened_at, str):
+                            opened_at = datetime.fromisoformat(opened_at.replace('Z', '+00:00'))
+                        time_held = datetime.now(timezone.utc) - opened_at
+                        minutes_held = time_held.total_seconds() / 60
                     
-                    if minutes_held >= MIN_POSITION_HOLD_MINUTES:
-                        can_close = True
-                        override_reason = f"Position held for {minutes_held:.0f} min (>= {MIN_POSITION_HOLD_MINUTES} min)"
-                    else:
-                        print(f"   ⏳ ANTI-OVERTRADING: Posizione aperta da {minutes_held:.0f} min")
-                        print(f"      Minimo richiesto: {MIN_POSITION_HOLD_MINUTES} min")
-                        print(f"      PnL: {pnl_pct:.2f}% (stop loss: {STOP_LOSS_THRESHOLD_PCT}%, take profit: {TAKE_PROFIT_THRESHOLD_PCT}%)")
-                except Exception as e:
-                    print(f"   ⚠️ Errore calcolo tempo: {e}")
-                    can_close = True  # In caso di errore, permetti
-            else:
-                # Nessuna info su opened_at, controlla l'ultima operazione nel DB
-                can_close = True  # Default: permetti
+                        if minutes_held >= MIN_POSITION_HOLD_MINUTES:
+                            can_close = True
+                            override_reason = f"Position held for {minutes_held:.0f} min (>= {MIN_POSITION_HOLD_MINUTES} min)"
+                        else:
+                            print(f"   ⏳ ANTI-OVERTRADING: Posizione aperta da {minutes_held:.0f} min")
+                            print(f"      Minimo richiesto: {MIN_POSITION_HOLD_MINUTES} min")
+                            print(f"      PnL: {pnl_pct:.2f}% (stop loss: {STOP_LOSS_THRESHOLD_PCT}%, take profit: {TAKE_PROFIT_THRESHOLD_PCT}%)")
+                    except Exception as e:
+                        print(f"   ⚠️ Errore calcolo tempo: {e}")
+                        can_close = True  # In caso di errore, permetti
+                else:
+                    # Nessuna info su opened_at, controlla l'ultima operazione nel DB
+                    can_close = True  # Default: permetti
             
-            if not can_close:
-                # Override: forza HOLD invece di CLOSE
-                print(f"   🛑 OVERRIDE: Cambio 'close' -> 'hold' per evitare overtrading")
-                out['operation'] = 'hold'
-                out['reason'] = f"[ANTI-OVERTRADING] Position too young. Original: {out.get('reason', '')[:100]}"
-            else:
-                if override_reason:
-                    print(f"   ✅ Chiusura permessa: {override_reason}")
+                if not can_close:
+                    # Override: forza HOLD invece di CLOSE
+                    print(f"   🛑 OVERRIDE: Cambio 'close' -> 'hold' per evitare overtrading")
+                    out['operation'] = 'hold'
+                    out['reason'] = f"[ANTI-OVERTRADING] Position too young. Original: {out.get('reason', '')[:100]}"
+                else:
+                    if override_reason:
+                        print(f"   ✅ Chiusura permessa: {override_reason}")
     
-    # 10. Esecuzione segnale
-    print("\n9️⃣ Esecuzione segnale...")
-    exec_result = bot.execute_signal(out)
+        # 10. Esecuzione segnale
+        print("\n9️⃣ Esecuzione segnale...")
+        with timing.stage("order_execution"):
+            exec_result = bot.execute_signal(out)
     
-    # 11. Logging
-    print("\n🔟 Salvataggio nel database...")
-    op_id = db_utils.log_bot_operation(
-        out, 
-        system_prompt=system_prompt, 
-        indicators=indicators_json, 
-        news_text=news_txt, 
-        sentiment=sentiment_json, 
-        forecasts=forecasts_json
-    )
-    print(f"   ✅ Operazione salvata con id={op_id}")
+        # 11. Logging
+        print("\n🔟 Salvataggio nel database...")
+        with timing.stage("db:log_bot_operation"):
+            op_id = db_utils.log_bot_operation(
+                out, 
+                system_prompt=system_prompt, 
+                indicators=indicators_json, 
+                news_text=news_txt, 
+                sentiment=sentiment_json, 
+                forecasts=forecasts_json,
+                bar_close_at=bar_close,
+                decision_lag_ms=lag_s * 1000 if lag_s is not None else None
+            )
+        print(f"   ✅ Operazione salvata con id={op_id}")
 
-    print("\n" + "="*60)
-    print("✅ CICLO COMPLETATO")
-    print("="*60)
+        print("\n" + "="*60)
+        print("✅ CICLO COMPLETATO")
+        print(f"⏱️ Durata ciclo: {timer.elapsed_ms() / 1000:.1f}s - fasi più lente:")
+        print(timer.summary())
+        print("="*60)
 
-except Exception as e:
-    print(f"\n❌ ERRORE: {e}")
-    import traceback
-    traceback.print_exc()
+        return out
+
+    except Exception as e:
+        print(f"\n❌ ERRORE: {e}")
+        import traceback
+        traceback.print_exc()
     
-    # Log error to database
+        # Log error to database
+        try:
+            db_utils.log_error(
+                e, 
+                context={
+                    "prompt": system_prompt, 
+                    "tickers": TICKERS,
+                    "indicators": indicators_json, 
+                    "news": news_txt,
+                    "sentiment": sentiment_json, 
+                    "forecasts": forecasts_json,
+                    "balance": account_status
+                }, 
+                source="trading_agent"
+            )
+        except:
+            pass
+        return None
+
+    finally:
+        timing.end_cycle()
+        try:
+            db_utils.log_stage_timings(op_id, timer.records)
+        except Exception as e:
+            print(f"   ⚠️ Errore salvataggio tempi per fase: {e}")
+
+
+def run_daemon(bot: CapitalTrader, interval: int = CYCLE_INTERVAL_SECONDS,
+               offset: float = CYCLE_BAR_OFFSET_SECONDS, overrun: str = CYCLE_OVERRUN_POLICY):
+    """
+    Loop persistente: riusa lo stesso processo, la stessa sessione Capital.com,
+    il modello Gemini e la connessione DB per tutti i cicli.
+    I cicli partono `offset` secondi dopo la chiusura di ogni barra da `interval` secondi.
+    """
+    print(f"\n♻️ Daemon mode attivo (Ctrl+C per uscire)")
+    db_utils.enable_persistent_connection()
+    # Tra un ciclo e l'altro passano 15 minuti: senza keepalive la sessione (10 min) scadrebbe
+    bot.start_keepalive()
+    stream = None
+    candles = create_candle_source(bot)
+    if CAPITAL_STREAMING:
+        stream = CapitalStreamingClient(bot, [map_symbol_to_epic(t) for t in TICKERS])
+        # Candele costruite dalle quotazioni: archivio/REST solo per il backfill iniziale o dopo un buco
+        candles = BarAggregator(candles, stream.bus)
+        stream.start()
+    provider = create_candle_provider(candles)
+    engine = create_indicator_engine()
+    cross_asset = create_cross_asset()
+
+    def job(bar_close):
+        print(f"\n🔁 Ciclo barra {bar_close.strftime('%Y-%m-%d %H:%M')} UTC")
+        started = time.monotonic()
+        provider.reset()
+        run_cycle(bot, bar_close=bar_close, candle_source=provider, indicator_engine=engine,
+                  cross_asset=cross_asset)
+        print(f"   ⏱️ Ciclo completato in {time.monotonic() - started:.1f}s")
+
+    scheduler = CandleCloseScheduler(job, bar_seconds=interval, offset_seconds=offset, overrun=overrun)
     try:
-        db_utils.log_error(
-            e, 
-            context={
-                "prompt": system_prompt, 
-                "tickers": TICKERS,
-                "indicators": indicators_json, 
-                "news": news_txt,
-                "sentiment": sentiment_json, 
-                "forecasts": forecasts_json,
-                "balance": account_status
-            }, 
-            source="trading_agent"
-        )
-    except:
-        pass
\ No newline at end of file
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Daemon interrotto")
+    finally:
+        scheduler.stop()
+        if stream is not None:
+            stream.stop()
+        bot.stop_keepalive()
+        db_utils.close_persistent_connection()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Trading bot Capital.com + Gemini")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Resta in esecuzione ed esegue un ciclo ogni --interval secondi")
+    parser.add_argument("--interval", type=int, default=CYCLE_INTERVAL_SECONDS,
+                        help="Durata della barra in secondi: un ciclo per ogni chiusura (default 900 = 15m)")
+    parser.add_argument("--offset", type=float, default=CYCLE_BAR_OFFSET_SECONDS,
+                        help="Secondi di attesa dopo la chiusura della barra")
+    parser.add_argument("--overrun", choices=["skip", "coalesce"], default=CYCLE_OVERRUN_POLICY,
+                        help="Se il ciclo precedente è ancora in corso: salta il tick o accodalo")
+    args = parser.parse_args(argv)
+
+    check_credentials()
+
+    print("="*60)
+    print(f"🤖 TRADING BOT - Capital.com {'DEMO' if CAPITAL_DEMO else 'LIVE'}")
+    print("="*60)
+
+    # In modalità one-shot il login fa parte del ciclo: il timer parte prima
+    timer = None if args.daemon else timing.start_cycle()
+    try:
+        with timing.stage("startup:create_trader"):
+            bot = create_trader()
+    except Exception as e:
+        print(f"\n❌ ERRORE: {e}")
+        import traceback
+        traceback.print_exc()
+        try:
+            db_utils.log_error(e, context={"tickers": TICKERS}, source="trading_agent")
+        except:
+            pass
+        raise
+
+    if args.daemon:
+        run_daemon(bot, interval=args.interval, offset=args.offset, overrun=args.overrun)
+    else:
+        # Senza scheduler il lag si misura dalla chiusura dell'ultima barra
+        run_cycle(bot, bar_close=last_bar_close(time.time(), args.interval), timer=timer,
+                  candle_source=create_candle_provider(create_candle_source(bot)),
+                  indicator_engine=create_indicator_engine())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,513 @@
+"""
+Server locale che imita le API REST (e lo streaming) di Capital.com usate da
+CapitalTrader / AsyncCapitalTrader / CapitalStreamingClient, per benchmark e
+test di carico senza rete.
+
+Endpoint: session (login, switch conto), ping, accounts, positions (apertura,
+chiusura, modifica), confirms, prices, markets (singolo e batch) e /connect
+(WebSocket con le quotazioni).
+
+Comportamenti configurabili (MockConfig):
+- latenza per richiesta (+ jitter)
+- scadenza dei token dopo `session_ttl` secondi di inattività (401)
+- limite di richieste al secondo (429 con Retry-After)
+- ritardo prima che una conferma sia disponibile
+- prezzi sintetici deterministici (stesse candele per lo stesso istante)
+
+Uso:
+    python mock_capital_server.py --port 8765 --latency 0.02
+    CAPITAL_BASE_URL=http://127.0.0.1:8765 \\
+    CAPITAL_STREAMING_URL=ws://127.0.0.1:8765/connect python main.py
+
+oppure in-process: `server = MockCapitalServer(MockConfig(...)); server.start()`
+e poi `CapitalTrader(..., base_url=server.base_url)`.
+"""
+import argparse
+import asyncio
+import itertools
+import math
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set
+
+from aiohttp import web, WSMsgType
+
+from bar_aggregator import RESOLUTION_SECONDS, bar_start, format_bar_time, parse_bar_time
+
+DEFAULT_PRICES = {"BTCUSD": 65000.0, "ETHUSD": 3200.0, "SOLUSD": 150.0}
+# Punti campionati per candela (più punti = high/low più realistici, risposte più lente)
+SAMPLES_PER_BAR = 12
+
+
+@dataclass
+class MockConfig:
+    latency: float = 0.0              # secondi aggiunti a ogni risposta
+    jitter: float = 0.0               # +/- casuale sulla latenza
+    session_ttl: float = 600.0        # inattività dopo cui i token scadono (Capital.com: 10 min)
+    max_requests_per_second: int = 10  # oltre: 429 (0 = nessun limite)
+    max_logins_per_second: int = 1
+    confirm_delay: float = 0.0        # la conferma di un deal è disponibile dopo questo ritardo
+    stream_interval: float = 1.0      # secondi tra due quotazioni in streaming per epic
+    spread_pct: float = 0.0005
+    volatility: float = 0.002         # ampiezza del rumore per campione (relativa)
+    balance: float = 10000.0
+    seed: int = 42
+    prices: Dict[str, float] = field(default_factory=lambda: dict(DEFAULT_PRICES))
+    # Fuso del conto: snapshotTime è in ora locale, snapshotTimeUTC resta in UTC (come su Capital.com)
+    account_utc_offset_hours: float = 0.0
+    # Epic su cui ordini e chiusure vengono rifiutati in conferma (es. mercato chiuso)
+    reject_epics: Set[str] = field(default_factory=set)
+
+
+class PriceModel:
+    """
+    Prezzo sintetico in funzione del tempo: due onde lente + rumore deterministico.
+    Stesso (epic, istante) -> stesso prezzo, così candele scaricate in momenti diversi
+    coincidono (come serve a CandleStore per il delta fetch).
+    """
+
+    def __init__(self, base_prices: Dict[str, float], volatility: float, seed: int):
+        self.base_prices = base_prices
+        self.volatility = volatility
+        self.seed = seed
+
+    def _noise(self, epic: str, k: int) -> float:
+        h = (k * 2654435761 + sum(map(ord, epic)) * 40503 + self.seed) & 0xFFFFFFFF
+        h = ((h ^ (h >> 15)) * 2246822519) & 0xFFFFFFFF
+        return (h ^ (h >> 13)) / 0xFFFFFFFF - 0.5
+
+    def price(self, epic: str, ts: float) -> float:
+        base = self.base_prices.get(epic, 100.0)
+        phase = sum(map(ord, epic))
+        drift = 0.03 * math.sin(ts / 86400 + phase) + 0.01 * math.sin(ts / 3600 + phase)
+        return base * math.exp(drift + self.volatility * self._noise(epic, int(ts // 5)))
+
+    def candles(self, epic: str, resolution: str, limit: int,
+                start: Optional[float] = None, end: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Barre (dalla più vecchia) nel formato di GET /prices; l'ultima è in formazione"""
+        seconds = RESOLUTION_SECONDS[resolution]
+        end = min(end or time.time(), time.time())
+        last = bar_start(end, seconds)
+        first = bar_start(start, seconds) if start is not None else last - (limit - 1) * seconds
+        first = max(first, last - (limit - 1) * seconds)
+        bars = []
+        for open_ts in range(first, last + 1, seconds):
+            close_ts = min(open_ts + seconds, end)
+            step = max((close_ts - open_ts) / SAMPLES_PER_BAR, 1)
+            samples = [self.price(epic, open_ts + i * step) for i in range(SAMPLES_PER_BAR)
+                       if open_ts + i * step <= close_ts]
+            samples.append(self.price(epic, close_ts))
+            bars.append({
+                "snapshotTime": format_bar_time(open_ts),
+                "snapshotTimeUTC": format_bar_time(open_ts),
+                "openPrice": {"bid": samples[0], "ask": samples[0]},
+                "highPrice": {"bid": max(samples), "ask": max(samples)},
+                "lowPrice": {"bid": min(samples), "ask": min(samples)},
+                "closePrice": {"bid": samples[-1], "ask": samples[-1]},
+                "lastTradedVolume": len(samples),
+            })
+        return bars
+
+
+class MockCapitalServer:
+    """Stato del broker finto (sessioni, conto, posizioni, conferme) + app aiohttp"""
+
+    def __init__(self, config: Optional[MockConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or MockConfig()
+        self.host = host
+        self.port = port
+        self.prices = PriceModel(self.config.prices, self.config.volatility, self.config.seed)
+        self.base_url: Optional[str] = None
+        self.streaming_url: Optional[str] = None
+
+        # Statistiche (lette da test e benchmark)
+        self.requests: Dict[str, int] = {}
+        self.logins = 0
+        self.throttled = 0
+        self.expired = 0
+        # Richieste REST in corso e massimo osservato (concorrenza dei client)
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+        self._rng = random.Random(self.config.seed)
+        self._ids = itertools.count(1)
+        self._sessions: Dict[str, float] = {}      # CST -> ultimo utilizzo
+        self._recent: deque = deque()
+        self._recent_logins: deque = deque()
+        self._balance = self.config.balance
+        self._positions: Dict[str, Dict[str, Any]] = {}
+        self._confirms: Dict[str, Dict[str, Any]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._ready = threading.Event()
+
+    # ==========================================================================
+    #                           CONTROLLO DAI TEST
+    # ==========================================================================
+
+    def reset_stats(self):
+        """Azzera i contatori di richieste (es. tra due fasi dello stesso test)"""
+        self.requests = {}
+        self.throttled = 0
+        self.max_in_flight = self.in_flight
+
+    def expire_sessions(self):
+        """Invalida tutti i token: la prossima richiesta autenticata riceve 401"""
+        self._sessions.clear()
+
+    def quote(self, epic: str, ts: Optional[float] = None) -> Dict[str, float]:
+        mid = self.prices.price(epic, ts or time.time())
+        half = mid * self.config.spread_pct / 2
+        return {"bid": round(mid - half, 5), "offer": round(mid + half, 5)}
+
+    # ==========================================================================
+    #                           MIDDLEWARE
+    # ==========================================================================
+
+    def _over_limit(self, window: deque, limit: int) -> bool:
+        if limit <= 0:
+            return False
+        now = time.monotonic()
+        while window and now - window[0] >= 1.0:
+            window.popleft()
+        if len(window) >= limit:
+            return True
+        window.append(now)
+        return False
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler):
+        resource = request.match_info.route.resource
+        route = f"{request.method} {resource.canonical if resource is not None else request.path}"
+        self.requests[route] = self.requests.get(route, 0) + 1
+        if request.path == "/connect":
+            return await handler(request)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            return await self._handle_rest(request, handler)
+        finally:
+            self.in_flight -= 1
+
+    async def _handle_rest(self, request: web.Request, handler):
+        cfg = self.config
+        delay = cfg.latency + (self._rng.uniform(-cfg.jitter, cfg.jitter) if cfg.jitter else 0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        login = request.method == "POST" and request.path == "/api/v1/session"
+        if self._over_limit(self._recent_logins if login else self._recent,
+                            cfg.max_logins_per_second if login else cfg.max_requests_per_second):
+            self.throttled += 1
+            return web.json_response({"errorCode": "error.too-many.requests"}, status=429,
+                                     headers={"Retry-After": "1"})
+
+        if not login:
+            cst = request.headers.get("CST")
+            last = self._sessions.get(cst)
+            if last is None or time.monotonic() - last > cfg.session_ttl:
+                self._sessions.pop(cst, None)
+                self.expired += 1
+                return web.json_response({"errorCode": "error.invalid.session.token"}, status=401)
+            self._sessions[cst] = time.monotonic()
+        return await handler(request)
+
+    # ==========================================================================
+    #                           SESSIONE / CONTO
+    # ==========================================================================
+
+    def _account(self) -> Dict[str, Any]:
+        upl = sum(self._upl(p) for p in self._positions.values())
+        return {
+            "accountId": "MOCK-1",
+            "accountName": "Mock",
+            "preferred": True,
+            "currency": "USD",
+            "balance": {"balance": round(self._balance, 2), "deposit": round(self._balance, 2),
+                        "profitLoss": round(upl, 2), "available": round(self._balance + upl, 2)},
+        }
+
+    async def login(self, request: web.Request) -> web.Response:
+        self.logins += 1
+        cst = f"cst-{next(self._ids)}"
+        self._sessions[cst] = time.monotonic()
+        return web.json_response(
+            {"accountType": "CFD", "currentAccountId": "MOCK-1", "accounts": [self._account()]},
+            headers={"CST": cst, "X-SECURITY-TOKEN": f"xst-{cst}"},
+        )
+
+    async def switch_account(self, request: web.Request) -> web.Response:
+        return web.json_response({"errorCode": "error.not-different.accountId"}, status=400)
+
+    async def ping(self, request: web.Request) -> web.Response:
+        return web.json_response({"status": "OK"})
+
+    async def accounts(self, request: web.Request) -> web.Response:
+        return web.json_response({"accounts": [self._account()]})
+
+    # ==========================================================================
+    #                           POSIZIONI / CONFERME
+    # ==========================================================================
+
+    def _close_level(self, position: Dict[str, Any]) -> float:
+        quote = self.quote(position["epic"])
+        return quote["bid"] if position["direction"] == "BUY" else quote["offer"]
+
+    def _upl(self, position: Dict[str, Any]) -> float:
+        sign = 1 if position["direction"] == "BUY" else -1
+        return sign * (self._close_level(position) - position["level"]) * position["size"]
+
+    def _new_confirm(self, payload: Dict[str, Any]) -> str:
+        reference = f"o_{next(self._ids)}"
+        self._confirms[reference] = dict(payload, dealReference=reference,
+                                         date=datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S"),
+                                         ready_at=time.monotonic() + self.config.confirm_delay)
+        return reference
+
+    async def positions(self, request: web.Request) -> web.Response:
+        items = []
+        for p in self._positions.values():
+            quote = self.quote(p["epic"])
+            items.append({
+                "position": {"dealId": p["dealId"], "dealReference": p["dealReference"],
+                             "direction": p["direction"], "size": p["size"], "level": p["level"],
+                             "stopLevel": p.get("stopLevel"), "profitLevel": p.get("profitLevel"),
+                             "trailingStop": p.get("trailingStop", False), "guaranteedStop": False,
+                             "upl": round(self._upl(p), 2), "createdDate": p["createdDate"],
+                             "leverage": 2, "currency": "USD"},
+                "market": {"epic": p["epic"], "bid": quote["bid"], "offer": quote["offer"],
+                           "marketStatus": "TRADEABLE", "updateTimeUTC": format_bar_time(int(time.time()))},
+            })
+        return web.json_response({"positions": items})
+
+    async def open_position(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        epic, direction, size = body.get("epic"), str(body.get("direction", "")).upper(), body.get("size")
+        if epic not in self.config.prices or direction not in ("BUY", "SELL") or not size:
+            reference = self._new_confirm({"dealStatus": "REJECTED", "status": "REJECTED",
+                                           "reason": "INVALID_REQUEST", "epic": epic, "affectedDeals": []})
+            return web.json_response({"dealReference": reference})
+
+        if epic in self.config.reject_epics:
+            reference = self._new_confirm({"dealStatus": "REJECTED", "status": "REJECTED",
+                                           "reason": "MARKET_CLOSED", "epic": epic, "affectedDeals": []})
+            return web.json_response({"dealReference": reference})
+
+        quote = self.quote(epic)
+        deal_id = f"deal-{next(self._ids)}"
+        level = quote["offer"] if direction == "BUY" else quote["bid"]
+        reference = self._new_confirm({
+            "dealStatus": "ACCEPTED", "status": "OPEN", "dealId": deal_id, "epic": epic,
+            "direction": direction, "size": size, "level": level,
+            "affectedDeals": [{"dealId": deal_id, "status": "OPENED"}],
+        })
+        self._positions[deal_id] = {
+            "dealId": deal_id, "dealReference": reference, "epic": epic, "direction": direction,
+            "size": size, "level": level, "trailingStop": body.get("trailingStop", False),
+            "createdDate": self._confirms[reference]["date"],
+        }
+        return web.json_response({"dealReference": reference})
+
+    async def close_position(self, request: web.Request) -> web.Response:
+        deal_id = request.match_info["deal_id"]
+        position = self._positions.get(deal_id)
+        if position is None:
+            return web.json_response({"errorCode": "error.not-found.dealId"}, status=404)
+        if position["epic"] in self.config.reject_epics:
+            reference = self._new_confirm({"dealStatus": "REJECTED", "status": "REJECTED", "reason": "MARKET_CLOSED",
+                                           "dealId": deal_id, "epic": position["epic"], "affectedDeals": []})
+            return web.json_response({"dealReference": reference})
+        del self._positions[deal_id]
+        profit = round(self._upl(position), 2)
+        self._balance += profit
+        reference = self._new_confirm({
+            "dealStatus": "ACCEPTED", "status": "CLOSED", "dealId": position["dealId"],
+            "epic": position["epic"], "direction": position["direction"], "size": position["size"],
+            "level": self._close_level(position), "profit": profit, "profitCurrency": "USD",
+            "affectedDeals": [{"dealId": position["dealId"], "status": "FULLY_CLOSED"}],
+        })
+        return web.json_response({"dealReference": reference})
+
+    async def update_position(self, request: web.Request) -> web.Response:
+        position = self._positions.get(request.match_info["deal_id"])
+        if position is None:
+            return web.json_response({"errorCode": "error.not-found.dealId"}, status=404)
+        body = await request.json()
+        for key in ("stopLevel", "profitLevel", "trailingStop"):
+            if key in body:
+                position[key] = body[key]
+        reference = self._new_confirm({
+            "dealStatus": "ACCEPTED", "status": "OPEN", "dealId": position["dealId"],
+            "epic": position["epic"], "affectedDeals": [{"dealId": position["dealId"], "status": "AMENDED"}],
+        })
+        return web.json_response({"dealReference": reference})
+
+    async def confirm(self, request: web.Request) -> web.Response:
+        confirmation = self._confirms.get(request.match_info["reference"])
+        if confirmation is None or time.monotonic() < confirmation["ready_at"]:
+            return web.json_response({"errorCode": "error.not-found.dealReference"}, status=404)
+        return web.json_response({k: v for k, v in confirmation.items() if k != "ready_at"})
+
+    # ==========================================================================
+    #                           MARKET DATA
+    # ==========================================================================
+
+    def _market_details(self, epic: str) -> Dict[str, Any]:
+        quote = self.quote(epic)
+        day_ago = self.prices.price(epic, time.time() - 86400)
+        return {
+            "instrument": {"epic": epic, "name": epic, "type": "CRYPTOCURRENCIES", "currency": "USD"},
+            "dealingRules": {"minDealSize": {"unit": "POINTS", "value": 0.0001},
+                             "maxDealSize": {"unit": "POINTS", "value": 1000}},
+            "snapshot": {"marketStatus": "TRADEABLE", "bid": quote["bid"], "offer": quote["offer"],
+                         "percentageChange": round((quote["bid"] / day_ago - 1) * 100, 2),
+                         "updateTime": format_bar_time(int(time.time()))},
+        }
+
+    async def market(self, request: web.Request) -> web.Response:
+        epic = request.match_info["epic"]
+        if epic not in self.config.prices:
+            return web.json_response({"errorCode": "error.not-found.epic"}, status=404)
+        return web.json_response(self._market_details(epic))
+
+    async def markets(self, request: web.Request) -> web.Response:
+        epics = [e for e in request.query.get("epics", "").split(",") if e in self.config.prices]
+        return web.json_response({"marketDetails": [self._market_details(e) for e in epics]})
+
+    async def prices_history(self, request: web.Request) -> web.Response:
+        epic = request.match_info["epic"]
+        resolution = request.query.get("resolution", "MINUTE")
+        if epic not in self.config.prices or resolution not in RESOLUTION_SECONDS:
+            return web.json_response({"errorCode": "error.invalid.request"}, status=400)
+        limit = min(int(request.query.get("max", 10)), 1000)
+        start = parse_bar_time(request.query["from"]) if "from" in request.query else None
+        end = parse_bar_time(request.query["to"]) if "to" in request.query else None
+        bars = self.prices.candles(epic, resolution, limit, start, end)
+        offset = int(self.config.account_utc_offset_hours * 3600)
+        if offset:
+            for bar in bars:
+                bar["snapshotTime"] = format_bar_time(int(parse_bar_time(bar["snapshotTimeUTC"])) + offset)
+        return web.json_response({"prices": bars, "instrumentType": "CRYPTOCURRENCIES"})
+
+    async def stream(self, request: web.Request) -> web.WebSocketResponse:
+        """/connect: risponde a marketData.subscribe e invia quotazioni ogni stream_interval"""
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        epics: List[str] = []
+        sender = None
+
+        async def send_quotes():
+            while not ws.closed:
+                for epic in list(epics):
+                    quote = self.quote(epic)
+                    await ws.send_json({"status": "OK", "destination": "quote",
+                                        "payload": {"epic": epic, "bid": quote["bid"], "ofr": quote["offer"],
+                                                    "timestamp": int(time.time() * 1000)}})
+                await asyncio.sleep(self.config.stream_interval)
+
+        try:
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    continue
+                message = msg.json()
+                destination = message.get("destination")
+                if message.get("cst") not in self._sessions:
+                    await ws.send_json({"status": "ERROR", "destination": destination,
+                                        "payload": {"errorCode": "error.invalid.session.token"}})
+                    continue
+                self._sessions[message["cst"]] = time.monotonic()
+                if destination == "marketData.subscribe":
+                    requested = (message.get("payload") or {}).get("epics", [])
+                    epics.extend(e for e in requested if e in self.config.prices and e not in epics)
+                    await ws.send_json({"status": "OK", "destination": destination,
+                                        "correlationId": message.get("correlationId"),
+                                        "payload": {"subscriptions": {
+                                            e: "PROCESSED" if e in self.config.prices else "ERROR.NOT_FOUND"
+                                            for e in requested}}})
+                    if sender is None:
+                        sender = asyncio.ensure_future(send_quotes())
+                elif destination == "ping":
+                    await ws.send_json({"status": "OK", "destination": "ping",
+                                        "correlationId": message.get("correlationId"), "payload": {}})
+        finally:
+            if sender is not None:
+                sender.cancel()
+        return ws
+
+    # ==========================================================================
+    #                           AVVIO
+    # ==========================================================================
+
+    def create_app(self) -> web.Application:
+        app = web.Application(middlewares=[self._middleware])
+        app.router.add_post("/api/v1/session", self.login)
+        app.router.add_put("/api/v1/session", self.switch_account)
+        app.router.add_get("/api/v1/ping", self.ping)
+        app.router.add_get("/api/v1/accounts", self.accounts)
+        app.router.add_get("/api/v1/positions", self.positions)
+        app.router.add_post("/api/v1/positions", self.open_position)
+        app.router.add_delete("/api/v1/positions/{deal_id}", self.close_position)
+        app.router.add_put("/api/v1/positions/{deal_id}", self.update_position)
+        app.router.add_get("/api/v1/confirms/{reference}", self.confirm)
+        app.router.add_get("/api/v1/markets", self.markets)
+        app.router.add_get("/api/v1/markets/{epic}", self.market)
+        app.router.add_get("/api/v1/prices/{epic}", self.prices_history)
+        app.router.add_get("/connect", self.stream)
+        return app
+
+    def start(self) -> str:
+        """Avvia il server in un thread daemon e restituisce base_url"""
+        threading.Thread(target=self._serve, name="mock-capital", daemon=True).start()
+        if not self._ready.wait(10):
+            raise RuntimeError("mock server non avviato")
+        return self.base_url
+
+    def _serve(self):
+        self._loop = asyncio.new_event_loop()
+        self._runner = web.AppRunner(self.create_app())
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, self.host, self.port)
+        self._loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{self.host}:{self.port}"
+        self.streaming_url = f"ws://{self.host}:{self.port}/connect"
+        self._ready.set()
+        self._loop.run_forever()
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result(5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Server locale che imita le API Capital.com")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Latenza per richiesta (secondi)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Variazione casuale della latenza (secondi)")
+    parser.add_argument("--session-ttl", type=float, default=600.0, help="Inattività prima del 401 (secondi)")
+    parser.add_argument("--rps", type=int, default=10, help="Richieste al secondo prima del 429 (0 = nessun limite)")
+    parser.add_argument("--confirm-delay", type=float, default=0.0, help="Ritardo delle conferme dei deal (secondi)")
+    args = parser.parse_args(argv)
+
+    config = MockConfig(latency=args.latency, jitter=args.jitter, session_ttl=args.session_ttl,
+                        max_requests_per_second=args.rps, confirm_delay=args.confirm_delay)
+    server = MockCapitalServer(config, host=args.host, port=args.port)
+    server.start()
+    print(f"🧪 Mock Capital.com su {server.base_url} (streaming {server.streaming_url})")
+    print(f"   CAPITAL_BASE_URL={server.base_url} CAPITAL_STREAMING_URL={server.streaming_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
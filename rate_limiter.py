@@ -0,0 +1,155 @@
+"""Rate limiter client-side per le API Capital.com (token bucket con corsie a priorità)"""
+import asyncio
+import threading
+import time
+from typing import Dict, Optional
+
+
+class TokenBucket:
+    """Bucket classico: `rate` token al secondo, al massimo `capacity` accumulabili"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float, needed: float = 1.0) -> float:
+        """Secondi da attendere perché ci siano `needed` token (0 se già disponibili)"""
+        self.refill(now)
+        if self.tokens >= needed:
+            return 0.0
+        return (needed - self.tokens) / self.rate
+
+    def take(self, amount: float = 1.0):
+        self.tokens -= amount
+
+
+# Limiti documentati (CAPITAL_API_REFERENCE.md):
+# - 10 richieste/secondo per utente
+# - 1 richiesta ogni 0.1s per POST /positions e /workingorders
+# - 1 richiesta/secondo per POST /session
+GLOBAL_RATE = 10.0
+GLOBAL_BURST = 10.0
+
+# priority: più basso = più urgente. reserve: token globali che la corsia NON può
+# consumare (restano sempre disponibili per le corsie più urgenti).
+DEFAULT_LANES = {
+    "session": {"priority": 0, "rate": 1.0, "burst": 1.0, "reserve": 0},
+    "trading": {"priority": 0, "rate": 10.0, "burst": 1.0, "reserve": 0},
+    # GET /confirms: stessa urgenza degli ordini ma senza il passo di 0.1s (che vale solo per le scritture)
+    "confirm": {"priority": 0, "rate": None, "burst": None, "reserve": 0},
+    "account": {"priority": 1, "rate": None, "burst": None, "reserve": 1},
+    "market_data": {"priority": 2, "rate": None, "burst": None, "reserve": 2},
+}
+
+
+class PriorityRateLimiter:
+    """
+    Limiter condiviso con un bucket globale (limite per utente) e un bucket
+    opzionale per corsia (es. ordini, login).
+
+    Ordini e chiusure ("trading") hanno la precedenza: le corsie meno urgenti
+    restano in attesa finché c'è una richiesta più urgente in coda, e non possono
+    consumare gli ultimi `reserve` token globali. Così aumentare il numero di
+    ticker (più fetch di candele) non rallenta mai il percorso degli ordini.
+    """
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, global_burst: float = GLOBAL_BURST,
+                 lanes: Optional[Dict[str, Dict]] = None):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.lanes = lanes or DEFAULT_LANES
+        self.lane_buckets = {
+            name: TokenBucket(cfg["rate"], cfg["burst"])
+            for name, cfg in self.lanes.items() if cfg.get("rate")
+        }
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._waiting: Dict[int, int] = {}
+        self._blocked_until = 0.0
+
+    def _lane(self, lane: str) -> Dict:
+        if lane not in self.lanes:
+            raise ValueError(f"Corsia rate limit sconosciuta: {lane}")
+        return self.lanes[lane]
+
+    def _higher_priority_waiting(self, priority: int) -> bool:
+        return any(count > 0 for p, count in self._waiting.items() if p < priority)
+
+    def _reserve(self, lane: str) -> float:
+        """Da chiamare col lock: prende i token e restituisce 0, oppure i secondi da attendere"""
+        cfg = self._lane(lane)
+        now = time.monotonic()
+
+        wait = max(0.0, self._blocked_until - now)
+        if self._higher_priority_waiting(cfg["priority"]):
+            wait = max(wait, 0.01)
+
+        wait = max(wait, self.global_bucket.wait_time(now, 1.0 + cfg.get("reserve", 0)))
+        bucket = self.lane_buckets.get(lane)
+        if bucket is not None:
+            wait = max(wait, bucket.wait_time(now))
+
+        if wait > 0:
+            return wait
+        self.global_bucket.take()
+        if bucket is not None:
+            bucket.take()
+        return 0.0
+
+    def acquire(self, lane: str = "market_data"):
+        """Blocca finché la richiesta può partire nel rispetto dei limiti"""
+        priority = self._lane(lane)["priority"]
+        with self._cond:
+            self._waiting[priority] = self._waiting.get(priority, 0) + 1
+            try:
+                while True:
+                    wait = self._reserve(lane)
+                    if wait == 0:
+                        return
+                    self._cond.wait(wait)
+            finally:
+                self._waiting[priority] -= 1
+                self._cond.notify_all()
+
+    async def acquire_async(self, lane: str = "market_data"):
+        """Come acquire(), ma cede il controllo all'event loop durante l'attesa"""
+        priority = self._lane(lane)["priority"]
+        with self._lock:
+            self._waiting[priority] = self._waiting.get(priority, 0) + 1
+        try:
+            while True:
+                with self._lock:
+                    wait = self._reserve(lane)
+                if wait == 0:
+                    return
+                await asyncio.sleep(wait)
+        finally:
+            with self._cond:
+                self._waiting[priority] -= 1
+                self._cond.notify_all()
+
+    def backoff(self, seconds: float):
+        """Sospende tutte le corsie per `seconds` (es. dopo un 429 dal server)"""
+        with self._cond:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._cond.notify_all()
+
+
+_shared_limiters: Dict[str, PriorityRateLimiter] = {}
+_shared_lock = threading.Lock()
+
+
+def shared_limiter(key: str) -> PriorityRateLimiter:
+    """
+    Limiter unico per chiave (API key): i limiti Capital.com sono per utente,
+    quindi più CapitalTrader sulla stessa utenza devono condividere il budget.
+    """
+    with _shared_lock:
+        if key not in _shared_limiters:
+            _shared_limiters[key] = PriorityRateLimiter()
+        return _shared_limiters[key]
@@ -0,0 +1,122 @@
+"""Scheduler allineato alla chiusura delle candele (default MINUTE_15)"""
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+
+OVERRUN_POLICIES = ("skip", "coalesce")
+
+
+class CandleCloseScheduler:
+    """
+    Esegue `job(bar_close)` pochi secondi dopo la chiusura di ogni barra.
+
+    Le barre sono allineate all'epoch UTC (come le candele Capital.com), quindi
+    con bar_seconds=900 il job parte a :00, :15, :30, :45 + offset_seconds.
+
+    Se al tick successivo il ciclo precedente è ancora in corso:
+    - "skip": il tick viene scartato
+    - "coalesce": i tick persi vengono fusi in un'unica esecuzione, lanciata
+      appena il ciclo precedente termina, sulla barra più recente
+    In nessun caso due cicli girano in parallelo.
+    """
+
+    def __init__(self, job: Callable[[datetime], None], bar_seconds: int = 900,
+                 offset_seconds: float = 5.0, overrun: str = "skip",
+                 clock: Callable[[], float] = time.time):
+        if bar_seconds <= 0:
+            raise ValueError("bar_seconds deve essere > 0")
+        if not 0 <= offset_seconds < bar_seconds:
+            raise ValueError("offset_seconds deve essere compreso tra 0 e bar_seconds")
+        if overrun not in OVERRUN_POLICIES:
+            raise ValueError(f"overrun deve essere uno di {OVERRUN_POLICIES}")
+
+        self.job = job
+        self.bar_seconds = bar_seconds
+        self.offset_seconds = offset_seconds
+        self.overrun = overrun
+        self.clock = clock
+
+        self.cycles_run = 0
+        self.ticks_skipped = 0
+        self.ticks_coalesced = 0
+
+        self._lock = threading.Lock()
+        self._running = False
+        self._pending: Optional[float] = None
+        self._last_fired: Optional[float] = None
+        self._stop = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+
+    def next_bar_close(self, now: float) -> float:
+        """Chiusura della prossima barra il cui istante di fire (close + offset) è > now"""
+        return ((now - self.offset_seconds) // self.bar_seconds) * self.bar_seconds + self.bar_seconds
+
+    def _tick(self, bar_close: float):
+        with self._lock:
+            if self._running:
+                if self.overrun == "coalesce":
+                    if self._pending is not None:
+                        self.ticks_coalesced += 1
+                    self._pending = bar_close
+                    print(f"⏭️ Scheduler: ciclo precedente ancora in corso, barra {_fmt(bar_close)} accodata")
+                else:
+                    self.ticks_skipped += 1
+                    print(f"⏭️ Scheduler: ciclo precedente ancora in corso, barra {_fmt(bar_close)} saltata")
+                return
+            self._running = True
+
+        self._worker = threading.Thread(target=self._run_job, args=(bar_close,),
+                                        name="cycle-worker", daemon=True)
+        self._worker.start()
+
+    def _run_job(self, bar_close: Optional[float]):
+        while bar_close is not None:
+            try:
+                self.job(datetime.fromtimestamp(bar_close, timezone.utc))
+            except Exception as e:
+                print(f"❌ Scheduler: errore nel ciclo della barra {_fmt(bar_close)}: {e}")
+            finally:
+                self.cycles_run += 1
+
+            with self._lock:
+                bar_close, self._pending = self._pending, None
+                if bar_close is None:
+                    self._running = False
+
+    def run_forever(self):
+        """Blocca il thread corrente fino a stop() (o KeyboardInterrupt)"""
+        print(f"⏰ Scheduler: barre da {self.bar_seconds}s, fire {self.offset_seconds}s dopo la chiusura, overrun={self.overrun}")
+        while not self._stop.is_set():
+            now = self.clock()
+            bar_close = self.next_bar_close(now)
+            fire_at = bar_close + self.offset_seconds
+            self._stop.wait(fire_at - now)
+            if self._stop.is_set():
+                break
+            if self.clock() < fire_at or bar_close == self._last_fired:
+                continue
+            self._last_fired = bar_close
+            self._tick(bar_close)
+
+    def stop(self, wait: bool = False):
+        self._stop.set()
+        if wait and self._worker is not None:
+            self._worker.join()
+
+
+def last_bar_close(now: float, bar_seconds: int) -> datetime:
+    """Chiusura dell'ultima barra già chiusa a `now` (il bar_close dei cicli one-shot)"""
+    return datetime.fromtimestamp((now // bar_seconds) * bar_seconds, timezone.utc)
+
+
+def decision_lag_seconds(bar_close: Optional[datetime]) -> Optional[float]:
+    """Secondi trascorsi tra la chiusura della barra e adesso (None se bar_close è None)"""
+    if bar_close is None:
+        return None
+    return (datetime.now(timezone.utc) - bar_close).total_seconds()
+
+
+def _fmt(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%H:%M:%S")
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""BarAggregator: cambio barra, buchi e backfill, quotazioni fuori ordine, conto con fuso diverso da UTC"""
+
+import time
+
+from bar_aggregator import BarAggregator, bar_start, parse_bar_time
+from capital_trader import CapitalTrader, parse_candles
+from mock_capital_server import DEFAULT_PRICES, MockCapitalServer, MockConfig, PriceModel
+
+EPIC, RESOLUTION, SECONDS = "BTCUSD", "MINUTE_15", 900
+
+
+class FakeRest:
+    """fetch_candles di CapitalTrader sui prezzi deterministici del server locale, all'istante `now`"""
+
+    def __init__(self, now: float):
+        self.now = now
+        self.calls = 0
+        self.model = PriceModel(dict(DEFAULT_PRICES), 0.002, 1)
+
+    def fetch_candles(self, epic, resolution, limit=100, from_date=None, to_date=None):
+        self.calls += 1
+        return parse_candles({"prices": self.model.candles(epic, resolution, limit, None, self.now)})
+
+
+def _aggregator(now: float):
+    rest = FakeRest(now)
+    agg = BarAggregator(rest, max_bars=50)
+    agg.fetch_candles(EPIC, RESOLUTION, 20)
+    return rest, agg, agg._series[(EPIC, RESOLUTION)]
+
+
+def test_bar_rollover():
+    now = float(bar_start(time.time(), SECONDS)) + 100
+    rest, agg, series = _aggregator(now)
+    forming = series.current_start
+    assert forming == bar_start(now, SECONDS)
+
+    agg.on_quote(EPIC, {"bid": 1.0, "timestamp": now + 10})
+    agg.on_quote(EPIC, {"bid": 3.0, "timestamp": now + 20})
+    agg.on_quote(EPIC, {"bid": 2.0, "timestamp": now + 30})
+    bar = series.current
+    assert bar["high"] >= 3.0 and bar["low"] <= 1.0 and bar["close"] == 2.0
+
+    # Prima quotazione della barra successiva: la barra in formazione viene chiusa
+    agg.on_quote(EPIC, {"bid": 5.0, "timestamp": forming + SECONDS + 1})
+    candles = agg.fetch_candles(EPIC, RESOLUTION, 20)
+    assert rest.calls == 1 and len(candles) == 20
+    assert candles[-2]["close"] == 2.0
+    assert parse_bar_time(candles[-1]["timestamp"]) == forming + SECONDS
+    assert candles[-1]["open"] == candles[-1]["close"] == 5.0 and candles[-1]["volume"] == 1
+    print("   ✅ Barra chiusa al cambio di intervallo, nessun backfill REST")
+
+
+def test_gap_triggers_backfill():
+    now = float(bar_start(time.time(), SECONDS)) + 100
+    rest, agg, series = _aggregator(now)
+    # Tre barre intere senza quotazioni: lo storico in memoria ha un buco
+    agg.on_quote(EPIC, {"bid": 1.0, "timestamp": series.current_start + 4 * SECONDS})
+    assert series.needs_backfill
+    rest.now = series.current_start + 10
+    candles = agg.fetch_candles(EPIC, RESOLUTION, 20)
+    assert rest.calls == 2 and agg.backfills == 2 and not series.needs_backfill
+    times = [parse_bar_time(c["timestamp"]) for c in candles]
+    assert all(b - a == SECONDS for a, b in zip(times, times[1:]))
+    print("   ✅ Buco nello stream -> backfill REST, finestra di nuovo contigua")
+
+
+def test_out_of_order_quote_ignored():
+    now = float(bar_start(time.time(), SECONDS)) + 100
+    _, agg, series = _aggregator(now)
+    agg.on_quote(EPIC, {"bid": 7.0, "timestamp": now + 1})
+    before = dict(series.current), len(series.bars)
+    # Quotazione di una barra già chiusa (arrivata in ritardo)
+    agg.on_quote(EPIC, {"bid": 1e9, "timestamp": series.current_start - 1})
+    assert (dict(series.current), len(series.bars)) == before
+    print("   ✅ Quotazione fuori ordine ignorata")
+
+
+def test_stale_stream_backfills():
+    now = float(bar_start(time.time(), SECONDS)) + 100
+    rest, agg, series = _aggregator(now)
+    series.last_update -= agg.max_quote_gap + 1
+    agg.fetch_candles(EPIC, RESOLUTION, 20)
+    assert rest.calls == 2
+    print("   ✅ Stream fermo -> candele rilette via REST")
+
+
+def test_account_timezone_not_utc():
+    # snapshotTime nel fuso del conto (UTC+2): le barre devono comunque allinearsi allo stream UTC
+    server = MockCapitalServer(MockConfig(latency=0, jitter=0, account_utc_offset_hours=2))
+    server.start()
+    try:
+        bot = CapitalTrader("mock-key", "pwd", "mock@example.com", session_cache_path=None, base_url=server.base_url)
+        agg = BarAggregator(bot)
+        before = time.time()
+        agg.fetch_candles(EPIC, RESOLUTION, 20)
+        series = agg._series[(EPIC, RESOLUTION)]
+        now = time.time()
+        assert series.current_start in (bar_start(before, SECONDS), bar_start(now, SECONDS))
+        agg.on_quote(EPIC, {"bid": 1.0, "timestamp": now})
+        assert not series.needs_backfill and series.current["close"] == 1.0
+        print("   ✅ Conto in UTC+2: barra in formazione allineata alle quotazioni dello stream")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("🧪 TEST BAR AGGREGATOR (candele dallo stream)")
+    print("=" * 60)
+    for test in (test_bar_rollover, test_gap_triggers_backfill, test_out_of_order_quote_ignored,
+                 test_stale_stream_backfills, test_account_timezone_not_utc):
+        print(f"\n▶️ {test.__name__}")
+        test()
+    print("\n✅ Tutti i test del BarAggregator superati")
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""CandleBlock: decodifica di /prices in array, stessi valori di parse_candles + DataFrame, viste senza copie"""
+
+import numpy as np
+import pandas as pd
+
+from bar_aggregator import format_bar_time, parse_bar_time
+from candle_block import CandleBlock, as_block
+from candle_provider import CandleProvider
+from capital_trader import parse_candles
+from mock_capital_server import DEFAULT_PRICES, PriceModel
+
+
+def _prices(limit: int = 300):
+    return {"prices": PriceModel(dict(DEFAULT_PRICES), 0.002, 1).candles("BTCUSD", "MINUTE_15", limit)}
+
+
+def _dataframe_reference(data):
+    """Il percorso precedente: dict per candela -> DataFrame -> to_datetime/to_numeric/fillna/sort"""
+    df = pd.DataFrame(parse_candles(data))
+    df["timestamp"] = pd.to_datetime(df["timestamp"]).dt.tz_localize("UTC")
+    for col in ["open", "high", "low", "close", "volume"]:
+        df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0)
+    return df.sort_values("timestamp").reset_index(drop=True)
+
+
+def test_same_values_as_dataframe_path():
+    data = _prices()
+    data["prices"][10]["closePrice"]["bid"] = None  # valore mancante -> 0, come fillna(0)
+    data["prices"][3], data["prices"][4] = data["prices"][4], data["prices"][3]  # fuori ordine
+    block = CandleBlock.from_prices(data)
+    expected = _dataframe_reference(data)
+    frame = block.to_frame()
+    assert block.timestamp.dtype == np.int64 and block.ohlcv.dtype == np.float64
+    assert (frame["timestamp"].values.astype("datetime64[s]") == expected["timestamp"].values.astype("datetime64[s]")).all()
+    cols = ["open", "high", "low", "close", "volume"]
+    assert np.array_equal(frame[cols].values, expected[cols].values)
+    assert as_block(parse_candles(data)).to_candles() == block.to_candles()
+    print(f"   ✅ {len(block)} candele: stessi valori del percorso DataFrame")
+
+
+def test_utc_snapshot_time():
+    data = _prices(20)
+    utc = [p["snapshotTime"] for p in data["prices"]]
+    for p in data["prices"]:
+        # Conto in UTC+2: snapshotTime nel fuso del conto, snapshotTimeUTC invariato
+        p["snapshotTime"] = format_bar_time(int(parse_bar_time(p["snapshotTime"])) + 2 * 3600)
+    block = CandleBlock.from_prices(data)
+    assert [c["timestamp"] for c in block.to_candles()] == utc
+    assert block.to_candles() == parse_candles(data)
+    del data["prices"][-1]["snapshotTimeUTC"]  # senza snapshotTimeUTC: fallback su snapshotTime
+    assert CandleBlock.from_prices(data).candle(-1)["timestamp"] == data["prices"][-1]["snapshotTime"]
+    print("   ✅ Timestamp da snapshotTimeUTC, snapshotTime solo se manca")
+
+
+def test_views_without_copies():
+    block = CandleBlock.from_prices(_prices())
+    tail = block.tail(50)
+    assert np.shares_memory(tail.close, block.ohlcv) and np.shares_memory(block.to_frame()["close"].to_numpy(), block.ohlcv)
+    try:
+        tail.close[0] = 0.0
+        raise AssertionError("il blocco dovrebbe essere in sola lettura")
+    except ValueError:
+        pass
+    print("   ✅ tail(), campi e to_frame() sono viste in sola lettura")
+
+
+def test_provider_shares_block():
+    class Source:
+        calls = 0
+
+        def fetch_candles_columnar(self, epic, resolution, limit):
+            Source.calls += 1
+            return CandleBlock.from_prices(_prices(limit))
+
+    provider = CandleProvider(Source())
+    big = provider.fetch_candles_columnar("BTCUSD", "MINUTE_15", 200)
+    small = provider.fetch_candles_columnar("BTCUSD", "MINUTE_15", 20)
+    assert Source.calls == 1 and len(small) == 20 and np.shares_memory(small.ohlcv, big.ohlcv)
+    assert provider.fetch_candles("BTCUSD", "MINUTE_15", 20) == small.to_candles()
+    print("   ✅ CandleProvider restituisce viste dello stesso blocco (una sola richiesta)")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("🧪 TEST CANDELE COLONNARI (CandleBlock)")
+    print("=" * 60)
+    for test in (test_same_values_as_dataframe_path, test_utc_snapshot_time, test_views_without_copies,
+                 test_provider_shares_block):
+        print(f"\n▶️ {test.__name__}")
+        test()
+    print("\n✅ Tutti i test CandleBlock superati")
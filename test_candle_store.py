@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""CandleStore: delta fetch, buchi e storico vecchio, refresh fallito (REST simulato con orologio iniettato)"""
+
+import os
+import tempfile
+
+from bar_aggregator import parse_bar_time
+from candle_store import CandleStore
+from capital_trader import parse_candles
+from mock_capital_server import DEFAULT_PRICES, PriceModel
+
+EPIC, RESOLUTION, SECONDS = "BTCUSD", "MINUTE_15", 900
+START = 1_760_000_000.0
+
+
+class FakeRest:
+    """fetch_candles di CapitalTrader sui prezzi deterministici del server locale, all'istante `now`"""
+
+    def __init__(self, now: float):
+        self.now = now
+        self.fail = False
+        self.calls = []
+        self.model = PriceModel(dict(DEFAULT_PRICES), 0.002, 1)
+
+    def fetch_candles(self, epic, resolution, limit=100, from_date=None, to_date=None):
+        self.calls.append({"limit": limit, "from": from_date, "to": to_date})
+        if self.fail:
+            return []
+        start = parse_bar_time(from_date) if from_date else None
+        end = parse_bar_time(to_date) if to_date else self.now
+        return parse_candles({"prices": self.model.candles(epic, resolution, limit, start, end)})
+
+
+def _store(rest: FakeRest) -> CandleStore:
+    path = os.path.join(tempfile.mkdtemp(), "candles.sqlite")
+    return CandleStore(rest, path, min_refresh_seconds=0, clock=lambda: rest.now)
+
+
+def _expected(rest: FakeRest, limit: int):
+    return FakeRest(rest.now).fetch_candles(EPIC, RESOLUTION, limit)
+
+
+def _contiguous(candles) -> bool:
+    times = [parse_bar_time(c["timestamp"]) for c in candles]
+    return all(b - a == SECONDS for a, b in zip(times, times[1:]))
+
+
+def test_delta_fetch():
+    rest = FakeRest(START)
+    store = _store(rest)
+    first = store.fetch_candles(EPIC, RESOLUTION, 100)
+    assert first == _expected(rest, 100) and rest.calls[0]["from"] is None
+    last_ts = first[-1]["timestamp"]
+
+    rest.now += 2 * SECONDS + 60
+    candles = store.fetch_candles(EPIC, RESOLUTION, 100)
+    delta = rest.calls[-1]
+    assert delta["from"] == last_ts and delta["limit"] <= 5
+    # La barra che era in formazione è stata sovrascritta con i valori finali
+    assert candles == _expected(rest, 100)
+    print(f"   ✅ Secondo fetch: {delta['limit']} barre chieste invece di 100, stessa finestra del REST")
+
+
+def test_gap_and_stale_history():
+    rest = FakeRest(START)
+    store = _store(rest)
+    store.fetch_candles(EPIC, RESOLUTION, 100)
+
+    # Buco più corto della finestra: un solo delta, finestra contigua
+    rest.now += 30 * SECONDS
+    candles = store.fetch_candles(EPIC, RESOLUTION, 100)
+    assert rest.calls[-1]["from"] is not None and rest.calls[-1]["limit"] <= 33
+    assert _contiguous(candles) and candles == _expected(rest, 100)
+
+    # Storico più vecchio della finestra richiesta: finestra completa
+    rest.now += 150 * SECONDS
+    candles = store.fetch_candles(EPIC, RESOLUTION, 100)
+    assert rest.calls[-1]["from"] is None and rest.calls[-1]["limit"] == 100
+    assert _contiguous(candles) and candles == _expected(rest, 100)
+    print("   ✅ Buco colmato col delta, storico vecchio riscaricato per intero")
+
+
+def test_failed_refresh_is_not_served():
+    rest = FakeRest(START)
+    store = _store(rest)
+    store.fetch_candles(EPIC, RESOLUTION, 100)
+
+    rest.now += SECONDS
+    rest.fail = True
+    calls = len(rest.calls)
+    assert store.fetch_candles(EPIC, RESOLUTION, 100) == []
+    # Delta vuoto -> tentativo con la finestra completa
+    assert [c["from"] is None for c in rest.calls[calls:]] == [False, True]
+
+    rest.fail = False
+    assert store.fetch_candles(EPIC, RESOLUTION, 100) == _expected(rest, 100)
+    print("   ✅ Refresh fallito: nessuna candela invece dello storico locale non aggiornato")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("🧪 TEST CANDLE STORE (SQLite + delta fetch)")
+    print("=" * 60)
+    for test in (test_delta_fetch, test_gap_and_stale_history, test_failed_refresh_is_not_served):
+        print(f"\n▶️ {test.__name__}")
+        test()
+    print("\n✅ Tutti i test del CandleStore superati")
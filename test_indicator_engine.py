@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""IndicatorEngine: riscaldamento + aggiornamenti incrementali confrontati con ta, checkpoint salvato e ricaricato"""
+
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import ta
+
+from bar_aggregator import format_bar_time
+from indicator_engine import IndicatorEngine
+from indicators import CryptoTechnicalAnalysis
+
+EPIC, RESOLUTION, SECONDS = "BTCUSD", "MINUTE_15", 900
+START = 1_760_000_000 // SECONDS * SECONDS
+WARMUP, STEPS = 200, 60
+COLUMNS = ["ema_20", "ema_50", "macd", "rsi_7", "rsi_14", "atr_3", "atr_14"]
+
+
+def _candles(n_bars: int, seed: int = 3):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, n_bars)))
+    high = close * (1 + rng.random(n_bars) * 0.005)
+    low = close * (1 - rng.random(n_bars) * 0.005)
+    return [{"timestamp": format_bar_time(START + i * SECONDS), "open": float(c), "high": float(h),
+             "low": float(l), "close": float(c), "volume": 1.0} for i, (h, l, c) in enumerate(zip(high, low, close))]
+
+
+def _reference(candles) -> pd.DataFrame:
+    df = pd.DataFrame(candles)
+    h, l, c = df["high"], df["low"], df["close"]
+    macd = ta.trend.MACD(c)
+    return pd.DataFrame({
+        "ema_20": ta.trend.EMAIndicator(c, 20).ema_indicator(),
+        "ema_50": ta.trend.EMAIndicator(c, 50).ema_indicator(),
+        "macd": macd.macd_diff(),
+        "rsi_7": ta.momentum.RSIIndicator(c, 7).rsi(),
+        "rsi_14": ta.momentum.RSIIndicator(c, 14).rsi(),
+        "atr_3": ta.volatility.AverageTrueRange(h, l, c, 3).average_true_range(),
+        "atr_14": ta.volatility.AverageTrueRange(h, l, c, 14).average_true_range(),
+    })
+
+
+def _check(row, expected):
+    got = np.array([row[c] for c in COLUMNS], dtype=float)
+    assert np.allclose(got, expected[COLUMNS].values.astype(float), rtol=1e-9, atol=1e-9, equal_nan=True), row["timestamp"]
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _step(engine, clock, candles, forming: int):
+    """Un ciclo del daemon: barra `forming` in formazione, si passano solo le barre chieste dal motore"""
+    clock.now = START + forming * SECONDS + 60
+    limit = engine.bars_needed(EPIC, RESOLUTION)
+    return limit, engine.update(EPIC, RESOLUTION, candles[max(0, forming + 1 - limit):forming + 1])
+
+
+def test_warmup_and_incremental_match_ta():
+    candles = _candles(WARMUP + STEPS)
+    expected = _reference(candles)
+    clock = Clock()
+    engine = IndicatorEngine(clock=clock)
+    limit, (rows, current) = _step(engine, clock, candles, WARMUP - 1)
+    assert limit == WARMUP and len(rows) == 50
+    _check(rows[-1], expected.iloc[WARMUP - 2])
+    _check(current, expected.iloc[WARMUP - 1])
+    for forming in range(WARMUP, WARMUP + STEPS):
+        limit, (rows, current) = _step(engine, clock, candles, forming)
+        assert limit <= 4
+        _check(rows[-1], expected.iloc[forming - 1])
+        _check(current, expected.iloc[forming])
+    print(f"   ✅ Riscaldamento su {WARMUP} barre + {STEPS} aggiornamenti da poche barre: stessi valori di ta")
+
+
+def test_checkpoint_round_trip():
+    candles = _candles(WARMUP + 10)
+    expected = _reference(candles)
+    path = os.path.join(tempfile.mkdtemp(), "indicators.json")
+    clock = Clock()
+    engine = IndicatorEngine(checkpoint_path=path, clock=clock)
+    _step(engine, clock, candles, WARMUP - 1)
+    engine.save()
+
+    restored = IndicatorEngine(checkpoint_path=path, clock=clock)
+    assert restored.rows(EPIC, RESOLUTION) == engine.rows(EPIC, RESOLUTION)
+    limit, (rows, current) = _step(restored, clock, candles, WARMUP + 4)
+    # Dopo il riavvio si scaricano solo le barre mancanti
+    assert limit == 8
+    _check(rows[-1], expected.iloc[WARMUP + 3])
+    _check(current, expected.iloc[WARMUP + 4])
+    print("   ✅ Checkpoint ricaricato: solo le barre mancanti, stessi valori di ta")
+
+
+def test_gap_rewarms_on_full_window():
+    candles = _candles(WARMUP + 20)
+    clock = Clock()
+    engine = IndicatorEngine(clock=clock)
+    _step(engine, clock, candles, WARMUP - 1)
+
+    class Source:
+        """Candele fino alla barra in formazione `forming`; la barra `missing` non c'è più"""
+        forming, missing, limits = WARMUP + 1, WARMUP - 2, []
+
+        def fetch_candles(self, epic, resolution, limit):
+            if resolution == "DAY":
+                return candles[:2]
+            Source.limits.append(limit)
+            window = [c for i, c in enumerate(candles[:Source.forming + 1]) if i != Source.missing]
+            return window[-limit:]
+
+    analyzer = CryptoTechnicalAnalysis(object(), Source(), engine)
+    clock.now = START + Source.forming * SECONDS + 60
+    data = analyzer.get_complete_analysis("BTC")
+    # L'ultima barra applicata manca dalla finestra corta: riscaldamento sulla finestra completa
+    assert len(Source.limits) == 2 and Source.limits[0] < 10 and Source.limits[1] == WARMUP
+    source = [c for i, c in enumerate(candles[:Source.forming + 1]) if i != Source.missing][-WARMUP:]
+    expected = _reference(source)
+    assert np.allclose(data["intraday"]["ema_20"], expected["ema_20"].values[-10:], rtol=1e-9)
+    assert np.allclose(data["intraday"]["rsi_14"], expected["rsi_14"].values[-10:], rtol=1e-9)
+    assert abs(data["current"]["macd"] - expected["macd"].iloc[-1]) < 1e-9
+    assert not np.isnan(data["longer_term_15m"]["ema_50_current"])
+
+    # I cicli successivi tornano incrementali e restano uguali a ta
+    for forming in range(Source.forming + 1, len(candles)):
+        Source.forming = forming
+        clock.now = START + forming * SECONDS + 60
+        data = analyzer.get_complete_analysis("BTC")
+        source.append(candles[forming])
+        _check(engine.rows(EPIC, RESOLUTION)[-1], _reference(source).iloc[-2])
+    assert max(Source.limits[2:]) <= 4
+    print("   ✅ Barra mancante nella sorgente: nuovo riscaldamento su 200 barre, poi di nuovo incrementale")
+
+
+def test_clock_behind_server():
+    candles = _candles(WARMUP)
+    clock = Clock()
+    engine = IndicatorEngine(clock=clock)
+    _step(engine, clock, candles, WARMUP - 1)
+    # Orologio locale indietro di un'ora rispetto alle barre del server
+    clock.now -= 3600
+    assert engine.bars_needed(EPIC, RESOLUTION) == 2
+    print("   ✅ Orologio locale indietro: si chiedono comunque 2 barre")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("🧪 TEST MOTORE INDICATORI INCREMENTALE")
+    print("=" * 60)
+    for test in (test_warmup_and_incremental_match_ta, test_checkpoint_round_trip, test_gap_rewarms_on_full_window,
+                 test_clock_behind_server):
+        print(f"\n▶️ {test.__name__}")
+        test()
+    print("\n✅ Tutti i test del motore indicatori superati")
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""Confronto dei kernel NumPy (indicator_kernels) con la libreria ta, anche su righe di lunghezza diversa"""
+
+import numpy as np
+import pandas as pd
+import ta
+
+import indicator_kernels as k
+from candle_block import CandleBlock
+from indicators import compute_indicator_rows
+
+
+def _random_ohlc(n_bars: int, seed: int):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, n_bars)))
+    high = close * (1 + rng.random(n_bars) * 0.005)
+    low = close * (1 - rng.random(n_bars) * 0.005)
+    return high, low, close
+
+
+def _reference(high, low, close):
+    h, l, c = pd.Series(high), pd.Series(low), pd.Series(close)
+    return {
+        "ema_20": ta.trend.EMAIndicator(c, 20).ema_indicator().values,
+        "macd": ta.trend.MACD(c).macd_diff().values,
+        "rsi_7": ta.momentum.RSIIndicator(c, 7).rsi().values,
+        "rsi_14": ta.momentum.RSIIndicator(c, 14).rsi().values,
+        "atr_3": ta.volatility.AverageTrueRange(h, l, c, 3).average_true_range().values,
+        "atr_14": ta.volatility.AverageTrueRange(h, l, c, 14).average_true_range().values,
+    }
+
+
+def _kernels(high, low, close):
+    return {
+        "ema_20": k.ema(close, 20),
+        "macd": k.macd_diff(close),
+        "rsi_7": k.rsi(close, 7),
+        "rsi_14": k.rsi(close, 14),
+        "atr_3": k.atr(high, low, close, 3),
+        "atr_14": k.atr(high, low, close, 14),
+    }
+
+
+def test_kernels_match_ta_with_padding():
+    lengths = [200, 150, 60, 35]
+    series = [_random_ohlc(n, seed) for seed, n in enumerate(lengths)]
+    high, low, close = (k.stack_rows([s[i] for s in series]) for i in range(3))
+    batch = _kernels(high, low, close)
+    for row, (h, l, c) in enumerate(series):
+        expected = _reference(h, l, c)
+        pad = 200 - len(c)
+        for name, values in expected.items():
+            got = batch[name][row]
+            assert np.isnan(got[:pad]).all(), f"{name}: il padding deve restare NaN"
+            assert np.allclose(got[pad:], values, rtol=1e-9, atol=1e-9, equal_nan=True), f"{name} riga {row}"
+    print("   ✅ EMA, MACD, RSI, ATR uguali a ta (righe allineate con NaN iniziali)")
+
+
+def test_one_dimensional_input():
+    h, l, c = _random_ohlc(120, 7)
+    expected = _reference(h, l, c)
+    got = _kernels(h, l, c)
+    for name in expected:
+        assert got[name].shape == (120,)
+        assert np.allclose(got[name], expected[name], rtol=1e-9, atol=1e-9, equal_nan=True), name
+    print("   ✅ Input 1-D: stessa forma e stessi valori di ta")
+
+
+def test_one_call_per_indicator():
+    """compute_indicator_rows: il numero di chiamate ai kernel non dipende dal numero di strumenti"""
+    def blocks(n_rows):
+        result = {}
+        for seed in range(n_rows):
+            high, low, close = _random_ohlc(200 - seed % 50, seed)
+            timestamp = 1_760_000_000 + 900 * np.arange(len(close), dtype=np.int64)
+            result[f"T{seed}"] = CandleBlock(timestamp, np.vstack([close, high, low, close, np.ones(len(close))]))
+        return result
+
+    calls = {}
+    originals = {name: getattr(k, name) for name in ("ema", "macd_diff", "rsi", "atr")}
+
+    def counted(name):
+        def kernel(*args, **kwargs):
+            calls[name] = calls.get(name, 0) + 1
+            return originals[name](*args, **kwargs)
+        return kernel
+
+    try:
+        for name in originals:
+            setattr(k, name, counted(name))
+        per_size = {}
+        for n_rows in (3, 100):
+            calls.clear()
+            computed = compute_indicator_rows(blocks(n_rows))
+            assert len(computed) == n_rows
+            per_size[n_rows] = dict(calls)
+    finally:
+        for name, kernel in originals.items():
+            setattr(k, name, kernel)
+    assert per_size[3] == per_size[100] == {"ema": 2, "macd_diff": 1, "rsi": 2, "atr": 2}, per_size
+    print(f"   ✅ 3 o 100 strumenti: {sum(per_size[100].values())} chiamate ai kernel "
+          "(tempi in benchmark_execution.py --indicators)")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("🧪 TEST KERNEL INDICATORI (NumPy vs ta)")
+    print("=" * 60)
+    for test in (test_kernels_match_ta_with_padding, test_one_dimensional_input, test_one_call_per_indicator):
+        print(f"\n▶️ {test.__name__}")
+        test()
+    print("\n✅ Tutti i test dei kernel superati")
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""analyze_multiple_tickers in modalità batch contro il server locale: stesso output della modalità seriale"""
+
+import contextlib
+import io
+import math
+
+from candle_provider import CandleProvider
+from capital_trader import CapitalTrader
+from indicator_engine import IndicatorEngine
+from indicators import analyze_multiple_tickers
+from mock_capital_server import MockCapitalServer, MockConfig
+
+TICKERS = ["BTC", "ETH", "SOL"]
+
+
+def _trader(server):
+    return CapitalTrader("mock-key", "pwd", "mock@example.com", session_cache_path=None, base_url=server.base_url)
+
+
+def _same(a, b) -> bool:
+    """Confronto ricorsivo dei dati JSON (float a meno di arrotondamenti, timestamp dell'analisi escluso)"""
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(_same(a[k], b[k]) for k in a if k != "timestamp")
+    if isinstance(a, list):
+        return len(a) == len(b) and all(_same(x, y) for x, y in zip(a, b))
+    if isinstance(a, float):
+        return (math.isnan(a) and math.isnan(b)) or abs(a - b) <= 1e-9 * max(1.0, abs(a))
+    return a == b
+
+
+def _without_timestamps(text: str) -> str:
+    return "\n".join(line for line in text.splitlines() if not line.startswith("Timestamp"))
+
+
+def test_batch_matches_serial():
+    server = MockCapitalServer(MockConfig(latency=0.01))
+    server.start()
+    try:
+        bot = _trader(server)
+        # Stesse candele per le due modalità (la barra in formazione cambia nel tempo)
+        provider = CandleProvider(bot)
+        serial_txt, serial = analyze_multiple_tickers(TICKERS, bot, provider, engine=IndicatorEngine())
+        batch_txt, batch = analyze_multiple_tickers(TICKERS, bot, provider, batch=True)
+        assert _without_timestamps(serial_txt) == _without_timestamps(batch_txt)
+        assert _same(serial, batch)
+        assert "<cross_asset>" in batch_txt
+        print(f"   ✅ Testo e JSON identici alla modalità seriale ({provider.fetches} richieste di candele)")
+    finally:
+        server.stop()
+
+
+def test_failures_isolated():
+    server = MockCapitalServer(MockConfig(latency=0.01))
+    server.start()
+    try:
+        bot = _trader(server)
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            text, datas = analyze_multiple_tickers(["BTC", "UNKNOWN", "ETH"], bot, batch=True)
+        assert [d["ticker"] for d in datas] == ["BTC", "ETH"]
+        assert "<UNKNOWN_data>" not in text and "Errore durante l'analisi di UNKNOWN" in out.getvalue()
+        print("   ✅ Ticker senza dati saltato, gli altri analizzati")
+    finally:
+        server.stop()
+
+
+def test_batch_fetches_concurrently():
+    prices = {f"X{i}USD": 100.0 + i for i in range(12)}
+    tickers = [epic[:-3] for epic in prices]
+    server = MockCapitalServer(MockConfig(latency=0.2, jitter=0, max_requests_per_second=0, prices=prices))
+    server.start()
+    try:
+        bot = _trader(server)
+        bot.get_account_status()  # login fuori dal conteggio
+        stats = {}
+        for batch in (False, True):
+            server.reset_stats()
+            with contextlib.redirect_stdout(io.StringIO()):
+                _, datas = analyze_multiple_tickers(tickers, bot, engine=IndicatorEngine(), batch=batch)
+            assert len(datas) == len(tickers)
+            stats[batch] = (dict(server.requests), server.max_in_flight)
+        # Stesse richieste (15m + daily per ticker), ma in batch si sovrappongono
+        # (latenza più lunga dell'intervallo del rate limiter)
+        assert stats[False][0] == stats[True][0]
+        assert stats[False][0]["GET /api/v1/prices/{epic}"] == 2 * len(tickers)
+        assert stats[False][1] == 1 and stats[True][1] > 1, stats
+        print(f"   ✅ {len(tickers)} strumenti: stesse richieste, fino a {stats[True][1]} in parallelo in batch "
+              "(tempi in benchmark_execution.py --indicators)")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("🧪 TEST INDICATORI IN MODALITÀ BATCH (server locale)")
+    print("=" * 60)
+    for test in (test_batch_matches_serial, test_failures_isolated, test_batch_fetches_concurrently):
+        print(f"\n▶️ {test.__name__}")
+        test()
+    print("\n✅ Tutti i test della modalità batch superati")
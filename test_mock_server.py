@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""Test di CapitalTrader / AsyncCapitalTrader contro il server locale (nessuna connessione a Capital.com)"""
+
+import asyncio
+import time
+
+import aiohttp
+
+import db_utils
+from async_capital_trader import AsyncCapitalTrader
+from capital_streaming import CapitalStreamingClient
+from capital_trader import CapitalTrader
+from mock_capital_server import MockCapitalServer, MockConfig
+
+
+def _trader(server, api_key="mock-key"):
+    return CapitalTrader(api_key, "pwd", "mock@example.com", session_cache_path=None, base_url=server.base_url)
+
+
+def test_market_data_and_trading():
+    server = MockCapitalServer(MockConfig(latency=0.01))
+    server.start()
+    try:
+        bot = _trader(server)
+        candles = bot.fetch_candles("BTCUSD", "MINUTE_15", 200)
+        assert len(candles) == 200 and all(c["low"] <= c["close"] <= c["high"] for c in candles)
+        # Stesse barre chiuse a ogni richiesta (prezzi deterministici)
+        assert bot.fetch_candles("BTCUSD", "MINUTE_15", 200)[:-1] == candles[:-1]
+
+        quotes = bot.get_quotes(["BTCUSD", "ETHUSD"])
+        assert quotes["ETHUSD"]["bid"] < quotes["ETHUSD"]["offer"]
+
+        order = bot.execute_order("ETHUSD", "BUY", 0.5)
+        assert order["dealStatus"] == "ACCEPTED" and order["dealId"]
+        assert [p["dealId"] for p in bot.get_open_positions()] == [order["dealId"]]
+
+        results = bot.close_positions([order["dealId"]])
+        assert results[order["dealId"]]["status"] == "closed"
+        assert bot.get_open_positions() == []
+        print(f"   ✅ Candele, quotazioni, apertura e chiusura ({sum(server.requests.values())} richieste)")
+    finally:
+        server.stop()
+
+
+def test_session_expiry_and_throttling():
+    server = MockCapitalServer(MockConfig(max_requests_per_second=5))
+    server.start()
+    try:
+        bot = _trader(server, api_key="mock-key-throttle")
+        server.expire_sessions()
+        assert bot.get_account_status().get("balance") == 10000.0
+        assert server.logins == 2 and server.expired >= 1
+
+        # Oltre il limite del server: 429 assorbiti dal limiter + retry delle GET
+        for _ in range(15):
+            assert len(bot.fetch_candles("SOLUSD", "MINUTE", 10)) == 10
+        assert server.throttled >= 1
+        print(f"   ✅ Re-login dopo 401 e {server.throttled} risposte 429 gestite")
+    finally:
+        server.stop()
+
+
+def test_async_trader_and_streaming():
+    server = MockCapitalServer(MockConfig(stream_interval=0.05, confirm_delay=0.1))
+    server.start()
+
+    async def run():
+        async with AsyncCapitalTrader("mock-key-async", "pwd", "mock@example.com",
+                                      session_cache_path=None, base_url=server.base_url) as bot:
+            series = await bot.fetch_candles_many(["BTCUSD", "ETHUSD", "SOLUSD"], "MINUTE_5", 50)
+            assert all(len(c) == 50 for c in series.values())
+            order = await bot.execute_order("SOLUSD", "SELL", 1)
+            assert order["dealStatus"] == "ACCEPTED"
+            # Stesso formato di CapitalTrader.execute_order
+            sync_order = _trader(server, api_key="mock-key-async-sync").execute_order("SOLUSD", "BUY", 1)
+            assert order.keys() == sync_order.keys() and order["confirmation"]["dealId"] == order["dealId"]
+
+    asyncio.run(run())
+
+    bot = _trader(server, api_key="mock-key-stream")
+    client = CapitalStreamingClient(bot, ["BTCUSD"], url=server.streaming_url)
+    client.start()
+    try:
+        assert client.bus.wait_for("BTCUSD", timeout=5) is not None
+        time.sleep(0.3)
+        assert client.quotes_received >= 3
+        print(f"   ✅ Trader async, conferme ritardate e {client.quotes_received} quotazioni in streaming")
+    finally:
+        client.stop()
+        server.stop()
+
+
+def test_async_retries():
+    server = MockCapitalServer(MockConfig(max_requests_per_second=5))
+    server.start()
+
+    async def run():
+        async with AsyncCapitalTrader("mock-key-async-retry", "pwd", "mock@example.com",
+                                      session_cache_path=None, base_url=server.base_url) as bot:
+            # Oltre il limite del server: 429 con Retry-After assorbiti dal limiter + retry delle GET
+            for _ in range(15):
+                assert len(await bot.fetch_candles("SOLUSD", "MINUTE", 10)) == 10
+            assert server.throttled >= 1
+
+            # Errore di rete sulla prima GET: nuovo tentativo come nel client sincrono
+            send, failures = bot._send, []
+
+            async def flaky_send(lane, method, path, headers, **kwargs):
+                if not failures:
+                    failures.append(path)
+                    raise aiohttp.ClientConnectionError("connessione chiusa")
+                return await send(lane, method, path, headers, **kwargs)
+
+            bot._send = flaky_send
+            assert len(await bot.fetch_candles("BTCUSD", "MINUTE", 10)) == 10 and len(failures) == 1
+
+    asyncio.run(run())
+    server.stop()
+    print(f"   ✅ Client asincrono: {server.throttled} risposte 429 e un errore di rete assorbiti dai retry")
+
+
+def test_rejected_deals():
+    server = MockCapitalServer(MockConfig(latency=0.01, reject_epics={"ETHUSD"}))
+    server.start()
+    # Scritture DB registrate invece che eseguite
+    writes = []
+    saved = db_utils.log_trade_close_from_position, db_utils.sync_real_positions
+    db_utils.log_trade_close_from_position = lambda position, **kw: writes.append(("close", position))
+    db_utils.sync_real_positions = lambda positions: writes.append(("sync", positions))
+    try:
+        bot = _trader(server)
+        bot.get_price_snapshot("ETHUSD")
+        result = bot.execute_signal({"operation": "open", "symbol": "ETH", "direction": "long",
+                                     "target_portion_of_balance": 0.1, "leverage": 1})
+        assert result["status"] == "rejected" and result["reason"] == "MARKET_CLOSED"
+        assert writes == [] and bot.market_cache.get("ETHUSD") is None
+
+        opened = bot.execute_signal({"operation": "open", "symbol": "BTC", "direction": "long",
+                                     "target_portion_of_balance": 0.1, "leverage": 1})
+        assert opened["status"] == "ok"
+        writes.clear()
+        server.config.reject_epics.add("BTCUSD")
+        result = bot.execute_signal({"operation": "close", "symbol": "BTC"})
+        assert result["status"] == "rejected" and writes == []
+        assert [p["dealId"] for p in bot.get_open_positions()] == [opened["dealId"]]
+
+        server.config.reject_epics.discard("BTCUSD")
+        result = bot.execute_signal({"operation": "close", "symbol": "BTC"})
+        assert result["status"] == "ok" and [w[0] for w in writes] == ["close", "sync"]
+        print("   ✅ Ordine e chiusura rifiutati: nessuna scrittura DB, cache del mercato invalidata")
+    finally:
+        db_utils.log_trade_close_from_position, db_utils.sync_real_positions = saved
+        server.stop()
+
+
+def test_bulk_close_history():
+    server = MockCapitalServer(MockConfig(latency=0.01, max_requests_per_second=0))
+    server.start()
+    # Scritture DB registrate invece che eseguite
+    writes = []
+    saved = db_utils.log_trades_close
+    db_utils.log_trades_close = lambda positions, **kw: writes.extend(positions)
+    try:
+        bot = _trader(server)
+        other = _trader(server, api_key="mock-key-other")
+        assert other.get_open_positions() == []
+        btc = bot.execute_order("BTCUSD", "BUY", 0.01)
+        sol = bot.execute_order("SOLUSD", "SELL", 1)
+        server.config.reject_epics.add("SOLUSD")
+        # `other` non conosce le posizioni aperte da `bot`: la riga arriva dalla conferma di chiusura
+        results = other.close_positions([btc["dealId"], sol["dealId"]])
+        assert results[btc["dealId"]]["status"] == "closed" and results[sol["dealId"]]["status"] == "rejected"
+        assert len(writes) == 1
+        row = db_utils._trade_close_row(writes[0], "test")
+        assert row[:4] == (btc["dealId"], "BTCUSD", "BUY", 0.01) and row[5] == results[btc["dealId"]]["level"]
+        print("   ✅ Chiusura di una posizione non nello stato locale registrata con i dati della conferma")
+    finally:
+        db_utils.log_trades_close = saved
+        server.stop()
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("🧪 TEST CAPITAL.COM SU SERVER LOCALE")
+    print("=" * 60)
+    for test in (test_market_data_and_trading, test_session_expiry_and_throttling, test_async_trader_and_streaming,
+                 test_async_retries, test_rejected_deals, test_bulk_close_history):
+        print(f"\n▶️ {test.__name__}")
+        test()
+    print("\n✅ Tutti i test sul server locale superati")
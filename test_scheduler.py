@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""CandleCloseScheduler con orologio iniettato: allineamento alle barre, overrun skip/coalesce, lag one-shot"""
+
+import threading
+from datetime import datetime, timezone
+
+from scheduler import CandleCloseScheduler, last_bar_close
+
+BAR, OFFSET = 900, 5.0
+START = 1_760_000_000 // BAR * BAR + 123  # a metà di una barra da 15 minuti
+
+
+class BarClock:
+    """
+    Orologio finto per run_forever: ogni lettura cade poco prima del fire della barra,
+    quella successiva subito dopo (l'attesa reale è di pochi millisecondi).
+    """
+
+    def __init__(self, scheduler: CandleCloseScheduler, bars: int):
+        self.scheduler = scheduler
+        self.bars = bars
+        self.fire_at = scheduler.next_bar_close(START) + OFFSET
+        self.calls = 0
+
+    def __call__(self) -> float:
+        self.calls += 1
+        if self.calls % 2:
+            return self.fire_at - 0.01
+        now = self.fire_at + 0.001
+        self.fire_at += BAR
+        if self.calls // 2 >= self.bars:
+            self.scheduler.stop()
+        return now
+
+
+def test_fires_on_bar_close():
+    fired = []
+    scheduler = CandleCloseScheduler(fired.append, bar_seconds=BAR, offset_seconds=OFFSET)
+    scheduler.clock = BarClock(scheduler, 4)
+    assert scheduler.next_bar_close(START) == START - 123 + BAR
+    # Prima dell'offset la barra appena chiusa non è ancora scattata
+    assert scheduler.next_bar_close(START - 123 + 2) == START - 123
+
+    scheduler.run_forever()
+    scheduler.stop(wait=True)
+    closes = [d.timestamp() for d in fired]
+    assert closes == [START - 123 + BAR * i for i in range(1, 5)], closes
+    assert all(d.tzinfo == timezone.utc and d.minute % 15 == 0 and d.second == 0 for d in fired)
+    print(f"   ✅ {len(fired)} cicli, uno per chiusura di barra (:00/:15/:30/:45 UTC)")
+
+
+def _overrun(policy: str):
+    release = threading.Event()
+    fired = []
+
+    def job(bar_close):
+        fired.append(bar_close.timestamp())
+        release.wait(5)
+
+    scheduler = CandleCloseScheduler(job, bar_seconds=BAR, offset_seconds=OFFSET, overrun=policy,
+                                     clock=lambda: START)
+    bars = [START - 123 + BAR * i for i in range(1, 5)]
+    for bar_close in bars:
+        scheduler._tick(bar_close)
+    release.set()
+    scheduler._worker.join(5)
+    return scheduler, bars, fired
+
+
+def test_overrun_skip():
+    scheduler, bars, fired = _overrun("skip")
+    assert fired == bars[:1] and scheduler.ticks_skipped == 3 and scheduler.cycles_run == 1
+    print("   ✅ skip: tick arrivati durante il ciclo scartati")
+
+
+def test_overrun_coalesce():
+    scheduler, bars, fired = _overrun("coalesce")
+    # I tre tick persi diventano un solo ciclo, sulla barra più recente
+    assert fired == [bars[0], bars[-1]] and scheduler.ticks_coalesced == 2 and scheduler.cycles_run == 2
+    assert not scheduler._running
+    print("   ✅ coalesce: tick persi fusi in un ciclo sull'ultima barra")
+
+
+def test_one_shot_bar_close():
+    assert last_bar_close(START, BAR) == datetime.fromtimestamp(START - 123, timezone.utc)
+    assert last_bar_close(START - 123, BAR).timestamp() == START - 123
+    print("   ✅ One-shot: lag misurato dall'ultima barra chiusa")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("🧪 TEST SCHEDULER (chiusura candele)")
+    print("=" * 60)
+    for test in (test_fires_on_bar_close, test_overrun_skip, test_overrun_coalesce, test_one_shot_bar_close):
+        print(f"\n▶️ {test.__name__}")
+        test()
+    print("\n✅ Tutti i test dello scheduler superati")
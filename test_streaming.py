@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""Test del client streaming contro un server WebSocket locale (nessuna connessione a Capital.com)"""
+
+import asyncio
+import json
+import threading
+import time
+
+from aiohttp import web, WSMsgType
+
+from capital_streaming import CapitalStreamingClient
+from capital_trader import MarketCache
+
+
+class FakeTrader:
+    """Quanto serve al client streaming: token, ping() e market_cache"""
+
+    def __init__(self):
+        self.cst = "cst-1"
+        self.x_security_token = "xst-1"
+        self.market_cache = MarketCache()
+        self.pings = 0
+
+    def ping(self):
+        self.pings += 1
+        self.cst = f"cst-{self.pings + 1}"
+        return True
+
+
+class StreamingStandIn:
+    """
+    Server WebSocket locale che imita /connect di Capital.com:
+    risponde a marketData.subscribe e invia una quotazione per epic.
+    """
+
+    def __init__(self, valid_cst=None, bad_frames=()):
+        self.valid_cst = valid_cst
+        # Frame non validi inviati prima delle quotazioni
+        self.bad_frames = list(bad_frames)
+        self.connections = 0
+        self.subscriptions = []
+        self.sockets = []
+        self.url = None
+        self._loop = None
+        self._runner = None
+        self._ready = threading.Event()
+
+    async def handler(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.connections += 1
+        self.sockets.append(ws)
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                continue
+            message = json.loads(msg.data)
+            if self.valid_cst and message.get("cst") != self.valid_cst:
+                await ws.send_json({"status": "ERROR", "destination": message["destination"],
+                                    "payload": {"errorCode": "error.invalid.session.token"}})
+                continue
+            if message["destination"] == "marketData.subscribe":
+                epics = message["payload"]["epics"]
+                self.subscriptions.append(epics)
+                await ws.send_json({"status": "OK", "destination": "marketData.subscribe",
+                                    "correlationId": message["correlationId"],
+                                    "payload": {"subscriptions": {e: "PROCESSED" for e in epics}}})
+                for frame in self.bad_frames:
+                    await ws.send_str(frame)
+                for i, epic in enumerate(epics):
+                    await ws.send_json({"status": "OK", "destination": "quote",
+                                        "payload": {"epic": epic, "bid": 100.0 + i, "ofr": 100.5 + i,
+                                                    "timestamp": int(time.time() * 1000)}})
+        return ws
+
+    def start(self):
+        threading.Thread(target=self._serve, daemon=True).start()
+        self._ready.wait(5)
+
+    def _serve(self):
+        self._loop = asyncio.new_event_loop()
+        app = web.Application()
+        app.router.add_get("/connect", self.handler)
+        self._runner = web.AppRunner(app)
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        self._loop.run_until_complete(site.start())
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/connect"
+        self._ready.set()
+        self._loop.run_forever()
+
+    def drop_connections(self):
+        """Chiude lato server tutte le connessioni aperte (simula una disconnessione)"""
+        for ws in list(self.sockets):
+            asyncio.run_coroutine_threadsafe(ws.close(), self._loop).result(5)
+        self.sockets.clear()
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result(5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+def _wait(condition, timeout=10):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_quotes_reach_price_bus():
+    server = StreamingStandIn()
+    server.start()
+    trader = FakeTrader()
+    client = CapitalStreamingClient(trader, ["BTCUSD", "ETHUSD"], url=server.url)
+    client.start()
+    try:
+        quote = client.bus.wait_for("ETHUSD", timeout=5)
+        assert quote is not None and quote["bid"] == 101.0 and quote["offer"] == 101.5
+        assert client.bus.mid("BTCUSD") == 100.25
+        # Le quotazioni aggiornano anche lo snapshot usato per il sizing
+        assert trader.market_cache.snapshot("BTCUSD")["offer"] == 100.5
+        print("   ✅ Quotazioni ricevute nel PriceBus e nella market cache")
+    finally:
+        client.stop()
+        server.stop()
+
+
+def test_reconnect_and_resubscribe():
+    server = StreamingStandIn()
+    server.start()
+    client = CapitalStreamingClient(FakeTrader(), ["BTCUSD"], url=server.url)
+    client.start()
+    try:
+        assert _wait(lambda: len(server.subscriptions) == 1)
+        server.drop_connections()
+        assert _wait(lambda: len(server.subscriptions) == 2), "nessuna nuova sottoscrizione dopo la disconnessione"
+        assert server.connections == 2 and client.reconnects >= 1
+        print(f"   ✅ Riconnesso e ri-sottoscritto ({client.reconnects} riconnessioni)")
+    finally:
+        client.stop()
+        server.stop()
+
+
+def test_session_expired_refreshes_tokens():
+    server = StreamingStandIn(valid_cst="cst-2")
+    server.start()
+    trader = FakeTrader()
+    client = CapitalStreamingClient(trader, ["SOLUSD"], url=server.url)
+    client.start()
+    try:
+        assert client.bus.wait_for("SOLUSD", timeout=10) is not None
+        assert trader.pings == 1 and server.subscriptions == [["SOLUSD"]]
+        print("   ✅ Token rinnovati e sottoscrizione ripetuta dopo sessione scaduta")
+    finally:
+        client.stop()
+        server.stop()
+
+
+def test_bad_messages_do_not_stop_stream():
+    bad = ["not json", json.dumps({"destination": "quote", "payload": {"epic": "BTCUSD", "bid": 1, "timestamp": "x"}}),
+           json.dumps(["lista", "invece di un oggetto"])]
+    server = StreamingStandIn(bad_frames=bad)
+    server.start()
+    client = CapitalStreamingClient(FakeTrader(), ["BTCUSD"], url=server.url)
+
+    def broken_listener(epic, quote):
+        raise KeyError("listener rotto")
+
+    client.bus.add_listener(broken_listener)
+    client.start()
+    try:
+        assert client.bus.wait_for("BTCUSD", timeout=5) is not None
+        assert client.bad_messages == len(bad) and server.connections == 1 and client.reconnects == 0
+        print(f"   ✅ {client.bad_messages} frame non validi e un listener rotto: stream ancora attivo")
+    finally:
+        client.stop()
+        server.stop()
+
+
+def test_unexpected_error_reconnects():
+    server = StreamingStandIn()
+    server.start()
+
+    class FlakyClient(CapitalStreamingClient):
+        failures = 1
+
+        async def _session_loop(self, session):
+            if FlakyClient.failures:
+                FlakyClient.failures -= 1
+                raise RuntimeError("errore non previsto")
+            await super()._session_loop(session)
+
+    client = FlakyClient(FakeTrader(), ["ETHUSD"], url=server.url)
+    client.start()
+    try:
+        assert client.bus.wait_for("ETHUSD", timeout=10) is not None
+        assert client.reconnects == 1
+        print("   ✅ Errore inatteso: backoff e riconnessione invece di fermare il thread")
+    finally:
+        client.stop()
+        server.stop()
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("🧪 TEST STREAMING CAPITAL.COM (server locale)")
+    print("=" * 60)
+    for test in (test_quotes_reach_price_bus, test_reconnect_and_resubscribe, test_session_expired_refreshes_tokens,
+                 test_bad_messages_do_not_stop_stream, test_unexpected_error_reconnects):
+        print(f"\n▶️ {test.__name__}")
+        test()
+    print("\n✅ Tutti i test streaming superati")
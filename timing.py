@@ -0,0 +1,93 @@
+"""Misura dei tempi per fase di un ciclo del bot (clock monotono)"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+
+class CycleTimer:
+    """
+    Raccoglie le durate delle fasi di un singolo ciclo.
+
+    Thread-safe: le fasi della gather stage girano in parallelo e registrano
+    sullo stesso timer. Ogni record contiene l'offset di inizio rispetto
+    all'avvio del ciclo, così è possibile ricostruire la timeline.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.records: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        t0 = time.monotonic()
+        success = True
+        try:
+            yield
+        except BaseException:
+            success = False
+            raise
+        finally:
+            self.record(name, t0, time.monotonic(), success)
+
+    def record(self, name: str, t0: float, t1: float, success: bool = True):
+        """Registra una fase già misurata (t0/t1 dal clock monotono)"""
+        with self._lock:
+            self.records.append({
+                "stage": name,
+                "started_offset_ms": (t0 - self.started) * 1000,
+                "duration_ms": (t1 - t0) * 1000,
+                "success": success,
+                "thread_name": threading.current_thread().name,
+            })
+
+    def elapsed_ms(self) -> float:
+        return (time.monotonic() - self.started) * 1000
+
+    def summary(self, top: int = 8) -> str:
+        """Le fasi più lente, una per riga"""
+        with self._lock:
+            records = sorted(self.records, key=lambda r: r["duration_ms"], reverse=True)[:top]
+        lines = [f"   {r['stage']:<40} {r['duration_ms']:>10.1f} ms{'' if r['success'] else '  ❌'}"
+                 for r in records]
+        return "\n".join(lines)
+
+
+_current: Optional[CycleTimer] = None
+
+
+def start_cycle() -> CycleTimer:
+    """Crea un nuovo timer e lo rende quello attivo (uno per processo: i cicli non si sovrappongono)"""
+    global _current
+    _current = CycleTimer()
+    return _current
+
+
+def end_cycle() -> Optional[CycleTimer]:
+    """Disattiva il timer corrente e lo restituisce"""
+    global _current
+    timer, _current = _current, None
+    return timer
+
+
+def current() -> Optional[CycleTimer]:
+    return _current
+
+
+@contextmanager
+def stage(name: str):
+    """Misura una fase sul timer attivo; no-op se nessun ciclo è in corso (script, test)"""
+    timer = _current
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+
+def record(name: str, t0: float, t1: float, success: bool = True):
+    """Come stage(), per intervalli misurati altrove; no-op se nessun ciclo è in corso"""
+    timer = _current
+    if timer is not None:
+        timer.record(name, t0, t1, success)
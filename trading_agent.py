@@ -75,6 +75,30 @@ TRADING STRATEGY RULES - VERY IMPORTANT:
 - Avoid overtrading: opening and closing the same position multiple times per day destroys profits through spreads and fees.
 """
 
+# Il modello viene creato una sola volta per processo (riusato in daemon mode)
+_model = None
+
+
+def _get_model():
+    """Restituisce l'istanza condivisa di Gemini 2.5 Pro, creandola al primo uso."""
+    global _model
+    if _model is None:
+        # Temperature bassa (0.3) per decisioni più stabili e coerenti
+        # come GPT-5.1 di Rizzo che usa reasoning deterministico
+        _model = genai.GenerativeModel(
+            model_name='gemini-2.5-pro',
+            generation_config={
+                "temperature": 0.3,
+                "top_p": 0.90,
+                "top_k": 20,
+                "max_output_tokens": 8192,
+                "response_mime_type": "application/json",
+                "response_schema": TRADE_SCHEMA
+            }
+        )
+    return _model
+
+
 def previsione_trading_agent(prompt):
     """
     Utilizza Gemini 2.5 Pro per generare decisioni di trading strutturate.
@@ -89,20 +113,7 @@ def previsione_trading_agent(prompt):
         # Aggiungi le istruzioni di validazione al prompt
         full_prompt = f"{VALIDATION_INSTRUCTIONS}\n\n{prompt}"
         
-        # Inizializza il modello Gemini 2.5 Pro
-        # Temperature bassa (0.3) per decisioni più stabili e coerenti
-        # come GPT-5.1 di Rizzo che usa reasoning deterministico
-        model = genai.GenerativeModel(
-            model_name='gemini-2.5-pro',
-            generation_config={
-                "temperature": 0.3,
-                "top_p": 0.90,
-                "top_k": 20,
-                "max_output_tokens": 8192,
-                "response_mime_type": "application/json",
-                "response_schema": TRADE_SCHEMA
-            }
-        )
+        model = _get_model()
         
         # Genera la risposta
         response = model.generate_content(full_prompt)